@@ -1,8 +1,13 @@
 from .COAsT import COAsT
+import os
+import glob
+import time
 import numpy as np
+import dask
 import xarray as xr
 import xarray.ufuncs as uf
 from dask.diagnostics import ProgressBar
+from .logging_util import get_slug, debug, info, warn, error
 
 
 class CLIMATOLOGY(COAsT):
@@ -18,7 +23,8 @@ class CLIMATOLOGY(COAsT):
     @staticmethod
     def make_climatology(ds, output_frequency, monthly_weights = False, 
                               time_var_name = 'time', time_dim_name = 't_dim',
-                              fn_out = None, missing_values = False):
+                              fn_out = None, missing_values = False,
+                              output_format = 'netcdf', callback = None):
         '''
         Calculates a climatology for all variables in a supplied dataset.
         The resulting xarray dataset will NOT be loaded to RAM. Instead,
@@ -43,6 +49,11 @@ class CLIMATOLOGY(COAsT):
         fn_out :: string defining full output netcdf file path and name.
         missing_values :: boolean where True indicates the data has missing values 
             that should be ignored. Missing values must be represented by NaNs.
+        output_format :: 'netcdf' or 'zarr'. If 'zarr', fn_out is a zarr store
+            and each group and variable is computed and written in parallel.
+            See CLIMATOLOGY.write_climatology_zarr().
+        callback :: function called with the timing record of each write task
+            when output_format is 'zarr'.
         '''
         
         frequency_str = time_var_name + '.' + output_frequency
@@ -71,9 +82,466 @@ class CLIMATOLOGY(COAsT):
 
         if fn_out is not None:
             print('Saving to file. May take some time..')
-            with ProgressBar():
-                ds_mean.to_netcdf(fn_out)
+            if output_format == 'zarr':
+                CLIMATOLOGY.write_climatology_zarr(ds_mean, fn_out, 
+                                    output_frequency, callback=callback)
+            else:
+                with ProgressBar():
+                    ds_mean.to_netcdf(fn_out)
         
         return ds_mean
+
+    @staticmethod
+    def write_climatology_zarr(ds_clim, fn_zarr, group_dim, callback = None,
+                               fn_netcdf = None):
+        '''
+        Writes a (lazy) climatology dataset to a zarr store. Each group (e.g.
+        month) of each variable is an independent zarr chunk, computed and
+        written by its own dask task, so writes happen in parallel rather than
+        through a single NetCDF writer.
+        
+        If a dask.distributed Client is running, the tasks are submitted to it
+        and are named 'write-<variable>-<group>' on the dashboard. Otherwise 
+        the local dask scheduler is used with a progress bar. Requires the
+        zarr package to be installed.
+        
+        ds_clim :: xarray dataset, e.g. output from make_climatology().
+        fn_zarr :: string defining full output zarr store path and name.
+        group_dim :: the string name of the group dimension, e.g. 'month'.
+        callback :: function called once per completed task with a dictionary
+            containing 'variable', 'group', 'seconds' (time to write), 
+            'nbytes' (size of the region) and 'rss' (memory of the process
+            that wrote it, in bytes).
+        fn_netcdf :: if given, the zarr store is consolidated to this netcdf
+            file once all regions are written.
+        
+        Returns a list of timing records, one per task.
+        '''
+        # Write metadata and variables without the group dimension (e.g.
+        # longitude) only. One chunk per group.
+        ds_clim = ds_clim.chunk({group_dim:1})
+        for name, variable in ds_clim.variables.items():
+            if group_dim not in variable.dims:
+                variable.load()
+        ds_clim.to_zarr(fn_zarr, mode='w', compute=False)
+        
+        tasks = []
+        for varname, da in ds_clim.data_vars.items():
+            if group_dim not in da.dims:
+                continue
+            for ig, label in enumerate(ds_clim[group_dim].values):
+                region = {group_dim:slice(ig, ig+1)}
+                ds_region = ds_clim[[varname]].isel(region)
+                ds_region = ds_region.drop_vars([coord for coord in 
+                                    ds_region.coords if group_dim not in 
+                                    ds_region[coord].dims])
+                key = f"write-{varname}-{label}"
+                tasks.append( dask.delayed(_write_zarr_region, pure=False)(
+                    ds_region, fn_zarr, region, varname, label, 
+                    dask_key_name=key) )
+        
+        try:
+            from dask.distributed import get_client, as_completed
+            client = get_client()
+        except (ImportError, ValueError):
+            client = None
+        
+        records = []
+        if client is not None:
+            futures = client.compute(tasks)
+            for future in as_completed(futures):
+                records.append(future.result())
+                if callback is not None:
+                    callback(records[-1])
+        else:
+            with ProgressBar():
+                records = list(dask.compute(*tasks))
+            if callback is not None:
+                for record in records:
+                    callback(record)
+        
+        if fn_netcdf is not None:
+            info(f"Consolidating {fn_zarr} to {fn_netcdf}")
+            with xr.open_zarr(fn_zarr) as ds_zarr:
+                ds_zarr.to_netcdf(fn_netcdf)
+        
+        return records
+
+    @staticmethod
+    def make_climatology_streaming(data, output_frequency, 
+                                   time_var_name = 'time', time_dim_name = 't_dim',
+                                   fn_out = None, time_chunk = 100,
+                                   variance = False, fn_checkpoint = None,
+                                   checkpoint_every = 1, preprocess = None,
+                                   smoothing_window = None):
+        '''
+        Calculates a climatology for all time dependent variables in a dataset
+        or a list of files by walking through the data once, a block of
+        time_chunk time steps at a time. For each group (e.g. month) a running
+        sum, count of valid (non-NaN) values and, optionally, sum of squared 
+        deviations (M2) are accumulated in float64. Missing values (NaNs) are 
+        always ignored. Only one block of data is in memory at any time, 
+        unlike make_climatology() which builds a graph over the whole dataset.
+        
+        Several output frequencies can be requested at once by passing a list,
+        e.g. ['month', 'season', 'annual', 'dayofyear']. The accumulators for
+        all frequencies are filled from the same read of the data and a 
+        dictionary of datasets, keyed by frequency, is returned.
+        
+        If fn_checkpoint is given, the accumulators are written to this file 
+        every checkpoint_every blocks. If the file already exists when the 
+        routine is called, the accumulators are restored from it and blocks 
+        that have already been processed are skipped, so an interrupted job 
+        can be resumed by calling the routine again with the same arguments.
+        
+        data :: xarray dataset, a list of file paths or a glob string. Files
+            are opened one at a time with xr.open_dataset.
+        output_frequency :: any xarray datetime accessor string, 'annual' for 
+            the mean over all times, or a list of these. i.e:
+            'month'
+            'season'
+            'dayofyear'
+            ['month', 'season', 'annual']
+        time_var_name :: the string name of the time variable in dataset
+        time_dim_name :: the string name of the time dimension variable in dataset
+        fn_out :: string defining full output netcdf file path and name. For
+            a list of frequencies, one file per frequency is written with the
+            frequency appended to the name, e.g. clim_month.nc.
+        time_chunk :: number of time steps to read in each block.
+        variance :: if True, also return the variance (ddof=1) of each group
+            as variables with the suffix '_var'.
+        fn_checkpoint :: string defining checkpoint netcdf file path and name.
+            For a list of frequencies the frequency is appended as for fn_out.
+        checkpoint_every :: number of blocks between checkpoint writes.
+        preprocess :: function applied to each dataset opened from file, 
+            e.g. to rename dimensions. As in xr.open_mfdataset.
+        smoothing_window :: odd number of days in a centred running mean 
+            applied to the 'dayofyear' climatology. Days are pooled by 
+            calendar day on a 1..366 day of year axis, so days with no data
+            count as empty, and the window wraps from day 366 to day 1. The 
+            smoothed climatology is returned for all 366 days, NaN where no
+            data falls in the window. Means and variances are pooled from 
+            the accumulated sums and counts, so days with more data carry 
+            more weight.
+        
+        Returns an xarray dataset of climatological means (loaded to RAM), or
+        a dictionary of datasets if output_frequency is a list.
+        '''
+        multiple = not isinstance(output_frequency, str)
+        frequencies = list(output_frequency) if multiple else [output_frequency]
+        if smoothing_window is not None:
+            _check_smoothing_window(smoothing_window)
+        
+        def suffixed(fn, frequency):
+            if fn is None or not multiple:
+                return fn
+            root, ext = os.path.splitext(fn)
+            return f"{root}_{frequency}{ext}"
+        
+        accumulators = {}
+        for frequency in frequencies:
+            fn_ck = suffixed(fn_checkpoint, frequency)
+            if fn_ck is not None and os.path.isfile(fn_ck):
+                info(f"Resuming climatology from checkpoint {fn_ck}")
+                accumulators[frequency] = _ClimatologyAccumulator.from_checkpoint(fn_ck)
+            else:
+                accumulators[frequency] = _ClimatologyAccumulator(frequency, 
+                                    time_var_name, time_dim_name, variance)
+        
+        n_since_checkpoint = 0
+        for key, ds_block in _iterate_time_blocks(data, time_dim_name, 
+                                                  time_chunk, preprocess):
+            todo = [acc for acc in accumulators.values() 
+                    if key not in acc.processed]
+            if len(todo) == 0:
+                debug(f"Skipping {key}, already in checkpoint")
+                continue
+            ds_block = ds_block.load()
+            for accumulator in todo:
+                accumulator.update(ds_block, key)
+            n_since_checkpoint += 1
+            if fn_checkpoint is not None and n_since_checkpoint >= checkpoint_every:
+                for frequency, accumulator in accumulators.items():
+                    accumulator.to_checkpoint(suffixed(fn_checkpoint, frequency))
+                n_since_checkpoint = 0
+        
+        if fn_checkpoint is not None and n_since_checkpoint > 0:
+            for frequency, accumulator in accumulators.items():
+                accumulator.to_checkpoint(suffixed(fn_checkpoint, frequency))
+        
+        climatologies = {}
+        for frequency, accumulator in accumulators.items():
+            window = smoothing_window if frequency == 'dayofyear' else None
+            climatologies[frequency] = accumulator.to_dataset(window)
+            if fn_out is not None:
+                print('Saving to file.')
+                climatologies[frequency].to_netcdf(suffixed(fn_out, frequency))
+        
+        if multiple:
+            return climatologies
+        return climatologies[output_frequency]
+
+
+def _write_zarr_region(ds_region, fn_zarr, region, varname, label):
+    '''
+    Write one computed region of a climatology to an existing zarr store and
+    return a timing record. Used by CLIMATOLOGY.write_climatology_zarr().
+    '''
+    import psutil
+    t0 = time.perf_counter()
+    ds_region.to_zarr(fn_zarr, region=region)
+    return {'variable':varname, 'group':label, 
+            'seconds':time.perf_counter() - t0, 'nbytes':ds_region.nbytes,
+            'rss':psutil.Process().memory_info().rss}
+
+
+def _iterate_time_blocks(data, time_dim_name, time_chunk, preprocess = None):
+    '''
+    Generator yielding (key, dataset) pairs of consecutive blocks of at most
+    time_chunk time steps from a dataset or a list of files. The key uniquely
+    identifies the block and is used for checkpointing.
+    '''
+    if isinstance(data, xr.Dataset):
+        sources = [(None, data)]
+    else:
+        if isinstance(data, str):
+            data = sorted(glob.glob(data))
+        sources = [(fn, None) for fn in data]
+    
+    for fn, ds in sources:
+        if ds is None:
+            ds = xr.open_dataset(fn)
+            if preprocess is not None:
+                ds = preprocess(ds)
+        n_time = ds.dims[time_dim_name]
+        for t0 in range(0, n_time, time_chunk):
+            t1 = min(t0 + time_chunk, n_time)
+            key = f"{t0}:{t1}" if fn is None else f"{os.path.abspath(fn)}[{t0}:{t1}]"
+            yield key, ds.isel({time_dim_name:slice(t0, t1)})
+        if fn is not None:
+            ds.close()
+
+
+class _ClimatologyAccumulator():
+    '''
+    Running per-group sums, counts and M2 (sum of squared deviations from
+    the mean) used by CLIMATOLOGY.make_climatology_streaming(). Blocks are
+    combined using the parallel algorithm of Chan et al. (1979), so the
+    result does not depend on how the data is split into blocks.
+    '''
+    
+    def __init__(self, output_frequency, time_var_name, time_dim_name, 
+                 variance = False):
+        self.output_frequency = output_frequency
+        self.time_var_name = time_var_name
+        self.time_dim_name = time_dim_name
+        self.variance = variance
+        self.groups = []
+        self.templates = {}
+        self.sums = {}
+        self.counts = {}
+        self.m2s = {}
+        self.processed = []
         
-        return
\ No newline at end of file
+    def group_labels(self, ds):
+        ''' Group label of every time in ds for the output frequency '''
+        if self.output_frequency == 'annual':
+            return np.zeros(ds.dims[self.time_dim_name], dtype=int)
+        return getattr(ds[self.time_var_name].dt, self.output_frequency).values
+    
+    def _add_group(self, label):
+        self.groups.append(label)
+        for varname, template in self.templates.items():
+            shape = (1,) + template.shape
+            self.sums[varname] = np.concatenate( (self.sums[varname], 
+                                        np.zeros(shape)) )
+            self.counts[varname] = np.concatenate( (self.counts[varname], 
+                                        np.zeros(shape, dtype=np.int64)) )
+            if self.variance:
+                self.m2s[varname] = np.concatenate( (self.m2s[varname], 
+                                            np.zeros(shape)) )
+    
+    def _set_templates(self, ds):
+        ''' Store empty accumulators and coordinates for each variable '''
+        for varname, da in ds.data_vars.items():
+            if self.time_dim_name not in da.dims:
+                continue
+            template = da.isel({self.time_dim_name:0}, drop=True)
+            template = template.drop_vars( [coord for coord in template.coords
+                        if self.time_var_name == coord] )
+            self.templates[varname] = xr.zeros_like(template, dtype=np.float64)
+            shape = (0,) + template.shape
+            self.sums[varname] = np.zeros(shape)
+            self.counts[varname] = np.zeros(shape, dtype=np.int64)
+            if self.variance:
+                self.m2s[varname] = np.zeros(shape)
+    
+    def update(self, ds, key = None):
+        '''
+        Add a block of data (in memory) to the accumulators. key is recorded
+        in self.processed so that the block can be skipped on resumption.
+        '''
+        if len(self.templates) == 0:
+            self._set_templates(ds)
+        labels = self.group_labels(ds)
+        for label in np.unique(labels):
+            if label not in self.groups:
+                self._add_group(label)
+            ig = self.groups.index(label)
+            ind = np.where(labels == label)[0]
+            for varname in self.templates:
+                da = ds[varname].transpose(self.time_dim_name, ...)
+                values = da.values[ind].astype(np.float64)
+                self._combine(varname, ig, values)
+        if key is not None:
+            self.processed.append(key)
+    
+    def _combine(self, varname, ig, values):
+        valid = ~np.isnan(values)
+        count_b = valid.sum(axis=0)
+        sum_b = np.where(valid, values, 0).sum(axis=0)
+        if self.variance:
+            count_a = self.counts[varname][ig]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean_a = self.sums[varname][ig] / count_a
+                mean_b = sum_b / count_b
+                m2_b = (np.where(valid, values - mean_b, 0)**2).sum(axis=0)
+                delta = mean_b - mean_a
+                count = count_a + count_b
+                m2 = self.m2s[varname][ig] + m2_b \
+                     + delta**2 * count_a * count_b / count
+            update = (count_a > 0) & (count_b > 0)
+            first = (count_a == 0) & (count_b > 0)
+            self.m2s[varname][ig][update] = m2[update]
+            self.m2s[varname][ig][first] = m2_b[first]
+        self.sums[varname][ig] += sum_b
+        self.counts[varname][ig] += count_b
+    
+    def to_dataset(self, smoothing_window = None):
+        '''
+        Climatological mean (and variance) of each group as a dataset. If 
+        smoothing_window is given (dayofyear only), each day is pooled with 
+        the calendar days in a centred window of that many days, on a full
+        1..366 day of year axis that wraps around the end of the year.
+        '''
+        order = np.argsort(self.groups)
+        groups = np.array(self.groups)[order]
+        if smoothing_window is not None:
+            _check_smoothing_window(smoothing_window)
+            if self.output_frequency != 'dayofyear':
+                raise ValueError("smoothing_window can only be used with the "
+                                 + "'dayofyear' output frequency")
+            # Position of each observed day on the full day of year axis
+            position = groups - 1
+            groups = np.arange(1, 367)
+        ds_clim = xr.Dataset()
+        for varname, template in self.templates.items():
+            dims = (self.output_frequency,) + template.dims
+            coords = dict(template.coords)
+            coords[self.output_frequency] = groups
+            sums = self.sums[varname][order]
+            count = self.counts[varname][order]
+            m2 = self.m2s[varname][order] if self.variance else None
+            if smoothing_window is not None:
+                sums, count, m2 = [ None if array is None 
+                                    else _on_day_axis(array, position) 
+                                    for array in (sums, count, m2) ]
+                sums, count, m2 = _pool_circular(sums, count, m2, 
+                                                 smoothing_window)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = sums / count
+                mean[count == 0] = np.nan
+                ds_clim[varname] = xr.DataArray(mean, coords=coords, dims=dims)
+                if self.variance:
+                    var = m2 / (count - 1)
+                    var[count < 2] = np.nan
+                    ds_clim[varname + '_var'] = xr.DataArray(var, 
+                                                coords=coords, dims=dims)
+        if self.output_frequency == 'annual':
+            ds_clim = ds_clim.isel(annual=0, drop=True)
+        return ds_clim
+    
+    def to_checkpoint(self, fn_checkpoint):
+        ''' Write the accumulators to file. The old file is replaced atomically. '''
+        ds = xr.Dataset()
+        for varname, template in self.templates.items():
+            dims = ('group',) + template.dims
+            coords = dict(template.coords)
+            ds[varname + '_sum'] = (dims, self.sums[varname])
+            ds[varname + '_count'] = (dims, self.counts[varname])
+            if self.variance:
+                ds[varname + '_m2'] = (dims, self.m2s[varname])
+            ds = ds.assign_coords(coords)
+        ds['group_label'] = ('group', np.array(self.groups))
+        ds.attrs['output_frequency'] = self.output_frequency
+        ds.attrs['time_var_name'] = self.time_var_name
+        ds.attrs['time_dim_name'] = self.time_dim_name
+        ds.attrs['variance'] = int(self.variance)
+        ds.attrs['variables'] = '\n'.join(self.templates.keys())
+        ds.attrs['processed'] = '\n'.join(self.processed)
+        fn_tmp = fn_checkpoint + '.tmp'
+        ds.to_netcdf(fn_tmp)
+        os.replace(fn_tmp, fn_checkpoint)
+        debug(f"Written checkpoint for {get_slug(self)} to {fn_checkpoint}")
+    
+    @classmethod
+    def from_checkpoint(cls, fn_checkpoint):
+        ''' Restore accumulators written by to_checkpoint() '''
+        with xr.open_dataset(fn_checkpoint) as ds:
+            ds = ds.load()
+        acc = cls(ds.attrs['output_frequency'], ds.attrs['time_var_name'],
+                  ds.attrs['time_dim_name'], bool(ds.attrs['variance']))
+        acc.groups = list(ds['group_label'].values)
+        acc.processed = [key for key in ds.attrs['processed'].split('\n') if key]
+        for varname in ds.attrs['variables'].split('\n'):
+            template = ds[varname + '_sum'].isel(group=0, drop=True)
+            template = template.drop_vars('group_label', errors='ignore')
+            acc.templates[varname] = xr.zeros_like(template)
+            acc.sums[varname] = ds[varname + '_sum'].values
+            acc.counts[varname] = ds[varname + '_count'].values.astype(np.int64)
+            if acc.variance:
+                acc.m2s[varname] = ds[varname + '_m2'].values
+        return acc
+
+
+def _check_smoothing_window(window):
+    ''' Raise a ValueError unless window is an odd number of days up to 365 '''
+    if int(window) != window or window < 1 or window > 365 or window % 2 == 0:
+        raise ValueError(f"smoothing_window must be an odd number of days "
+                         + f"from 1 to 365, not {window}")
+
+
+def _on_day_axis(array, position):
+    '''
+    Place accumulators of the observed days (first axis) at their positions
+    on a full 366 day axis, with zeros for days without data.
+    '''
+    full = np.zeros((366,) + array.shape[1:], dtype=array.dtype)
+    full[position] = array
+    return full
+
+
+def _pool_circular(sums, counts, m2s, window):
+    '''
+    Pool accumulated sums, counts and M2 over a centred window of groups 
+    along the first axis, wrapping around the ends. The first axis must
+    hold every group (e.g. from _on_day_axis()), so neighbours by position 
+    are neighbours in time. M2 is pooled as
+    sum( M2_g + n_g * (mean_g - mean_pooled)**2 ). m2s may be None.
+    '''
+    half = window // 2
+    shifts = range(-half, half + 1)
+    pooled_sums = sum( np.roll(sums, shift, axis=0) for shift in shifts )
+    pooled_counts = sum( np.roll(counts, shift, axis=0) for shift in shifts )
+    if m2s is None:
+        return pooled_sums, pooled_counts, None
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pooled_mean = pooled_sums / pooled_counts
+        means = sums / counts
+    pooled_m2s = np.zeros_like(m2s)
+    for shift in shifts:
+        count_g = np.roll(counts, shift, axis=0)
+        deviation = np.roll(means, shift, axis=0) - pooled_mean
+        pooled_m2s += np.where(count_g > 0, np.roll(m2s, shift, axis=0) 
+                               + count_g * deviation**2, 0)
+    return pooled_sums, pooled_counts, pooled_m2s
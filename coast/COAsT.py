@@ -3,6 +3,7 @@ import xarray as xr
 import numpy as np
 from dask.distributed import Client
 import copy
+from . import geodesy
 from .logging_util import get_slug, debug, info, warn, warning
 
 
@@ -207,7 +208,7 @@ class COAsT:
         """
         This method returns a `tuple` of indices within the `radius` of the lon/lat point given by the user.
 
-        Distance is calculated as haversine - see `self.calculate_haversine_distance`
+        Distance is calculated as haversine - see `coast.geodesy.haversine`
 
         :param centre_lon: The longitude of the users central point
         :param centre_lat: The latitude of the users central point
@@ -220,10 +221,8 @@ class COAsT:
         lat = self.dataset.latitude
 
         # Calculate the distances between every model point and the specified
-        # centre. Calls another routine dist_haversine.
-
-        dist = self.calculate_haversine_distance(centre_lon, centre_lat, 
-                                                 lon, lat)
+        # centre.
+        dist = geodesy.point_to_grid(centre_lon, centre_lat, lon, lat)
         indices_bool = dist < radius
         indices = np.where(indices_bool.compute())
 
@@ -265,22 +264,7 @@ class COAsT:
         '''
 
         debug(f"Calculating haversine distance between {lon1},{lat1} and {lon2},{lat2}")
-
-        # Convert to radians for calculations
-        lon1 = xr.ufuncs.deg2rad(lon1)
-        lat1 = xr.ufuncs.deg2rad(lat1)
-        lon2 = xr.ufuncs.deg2rad(lon2)
-        lat2 = xr.ufuncs.deg2rad(lat2)
-
-        # Latitude and longitude differences
-        dlat = (lat2 - lat1) / 2
-        dlon = (lon2 - lon1) / 2
-
-        # Haversine function.
-        distance = xr.ufuncs.sin(dlat) ** 2 + xr.ufuncs.cos(lat1) * xr.ufuncs.cos(lat2) * xr.ufuncs.sin(dlon) ** 2
-        distance = 2 * 6371.007176 * xr.ufuncs.arcsin(xr.ufuncs.sqrt(distance))
-
-        return distance
+        return geodesy.haversine(lon1, lat1, lon2, lat2)
 
     def get_subset_as_xarray(self, var: str, points_x: slice, points_y: slice, line_length: int = None,
                              time_counter: int = 0):
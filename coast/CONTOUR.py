@@ -5,8 +5,10 @@ import numpy as np
 import warnings
 import gsw
 import traceback
+import hashlib
 from .COAsT import COAsT
 from .NEMO import NEMO
+from . import section_util, general_utils, geodesy
 from scipy import interpolate
 from scipy.integrate import cumtrapz
 from sklearn.neighbors import BallTree
@@ -17,6 +19,11 @@ from .logging_util import get_slug, debug, info, warn, error
 # The contour module is a place for code related to contours only
 # =============================================================================
 
+# Isobaths extracted so far, by (domain, depth). Only the
+# ISOBATH_CACHE_SIZE most recently extracted are kept.
+ISOBATH_CACHE_SIZE = 8
+_isobath_cache = {}
+
 class Contour:
     GRAVITY = 9.8 # m s^-2
     EARTH_ROT_RATE = 7.2921 * 10**(-5) # rad/s
@@ -42,13 +49,11 @@ class Contour:
             2d ndarray of indicies, i.e. for each list item:
             contour[:,0] contains the y indices for the contour on the model grid
             contour[:,1] contains the x indices for the contour on the model grid
+        
+        The contours are cached for each domain and depth, see coast.Isobaths.
 
         '''
-        contours = measure.find_contours( nemo.dataset.bathymetry.data, contour_depth )
-        # The find_contours method returns indices that have been interpolated
-        # between grid points so we must round and cast to integer 
-        contours = [np.round(contour).astype(int) for contour in contours]
-        return contours, len(contours)
+        return Isobaths( nemo, contour_depth ).get_contours( contour_depth )
     
     
     @staticmethod
@@ -118,29 +123,7 @@ class Contour:
         # Create tree of lat and lon on the pre-processed contour
         bt = BallTree( np.deg2rad( list( zip( nemo.dataset.latitude.values[y_ind, x_ind], 
                     nemo.dataset.longitude.values[y_ind, x_ind] ) ) ), metric='haversine' )
-
-        # Get start and end indices for contour and subset accordingly
-        start_idx = bt.query( np.deg2rad( [start_coords]) )[1][0][0]
-        end_idx = bt.query( np.deg2rad([end_coords]) )[1][0][0]   
-        if start_idx > end_idx:
-            y_ind = y_ind[end_idx:start_idx+1] 
-            x_ind = x_ind[end_idx:start_idx+1]
-        else:
-            y_ind = y_ind[start_idx:end_idx+1] 
-            x_ind = x_ind[start_idx:end_idx+1]
-            
-        # Ensure that the start point is closer to southern boundary of domain.
-        # If start and end point have same latitude then ensure start point is 
-        # closer to the western boundary of the domain.
-        if y_ind[0] > y_ind[-1]:
-            y_ind = y_ind[::-1]
-            x_ind = x_ind[::-1]
-        elif y_ind[0] == y_ind[-1]:
-            if x_ind[0] > x_ind[-1]:
-                y_ind = y_ind[::-1]
-                x_ind = x_ind[::-1]
-                
-        return y_ind, x_ind, np.vstack((y_ind,x_ind)).T
+        return _trim_contour( y_ind, x_ind, bt, start_coords, end_coords )
                         
     
     def __init__(self, nemo: COAsT, y_ind, x_ind, depth: int):        
@@ -214,27 +197,10 @@ class Contour:
         """
          
         try:
-            y_ind = np.asarray(y_ind)
-            x_ind = np.asarray(x_ind)
             # When replacing diagonal segments in the contour, pick the path that is
             # closest to the contour isobath depth
-            option1 = uf.fabs(ds.bathymetry[xr.DataArray(y_ind+1), xr.DataArray(x_ind)] - self.depth)
-            option0 = uf.fabs(ds.bathymetry[xr.DataArray(y_ind), xr.DataArray(x_ind+1)] - self.depth)
-            add_new_y_point = xr.where(option1 <= option0, 1, 0 )
-        
-            spacing = np.abs( np.diff(y_ind) ) + np.abs( np.diff(x_ind) )
-            if spacing.max() > 2:
-                raise ValueError("The contour is not continuous. The contour must be defined on " 
-                                 "adjacent grid points.")
-            spacing[spacing!=2]=0
-            doublespacing = np.nonzero( spacing )[0]
-            for ispacing in doublespacing[::-1]:
-                if add_new_y_point[ispacing]:
-                    y_ind = np.insert( y_ind, ispacing+1, y_ind[ispacing+1] )
-                    x_ind = np.insert( x_ind, ispacing+1, x_ind[ispacing] )
-                else:
-                    y_ind = np.insert( y_ind, ispacing+1, y_ind[ispacing] )
-                    x_ind = np.insert( x_ind, ispacing+1, x_ind[ispacing+1] ) 
+            rule = section_util.isobath_rule( ds.bathymetry.values, self.depth )
+            y_ind, x_ind = section_util.four_connected( y_ind, x_ind, y_first=rule )
             
             # Remove any repeated points caused by the rounding of the indices
             nonrepeated_idx = np.nonzero( np.abs( np.diff(y_ind) ) + np.abs( np.diff(x_ind) ) )
@@ -251,16 +217,7 @@ class Contour:
         ''' Generates a pre-defined 1d vertical depth coordinates,
         i.e. horizontal z-level vertical coordinates up to a supplied 
         maximum depth, 'max_depth' '''
-        
-        max_depth = max_depth + 650
-        z_levels_0_50 = np.arange(0,55,5)
-        z_levels_60_290 = np.arange(60,300,10)
-        z_levels_300_600 = np.arange(300,650,50)
-        z_levels_650_ = np.arange(650,max_depth+150,150)
-        z_levels = np.concatenate( (z_levels_0_50, z_levels_60_290, 
-                                    z_levels_300_600, z_levels_650_) )
-        z_levels = z_levels[z_levels <= max_depth] 
-        return z_levels
+        return section_util.gen_z_levels(max_depth)
     
 
 class Contour_f(Contour):
@@ -427,68 +384,8 @@ class Contour_f(Contour):
             self.data_cross_flow[var][:,:,-1] = np.nan    
         
             
-    def __pressure_grad_fpoint2(self, ds_T, ds_T_j1, ds_T_i1, ds_T_j1i1, r_ind, velocity_component):
-        """
-        Calculates the hydrostatic and surface pressure gradients at a set of f-points
-        along the contour, i.e. at a set of specific values of r_dim (but for all time and depth).
-        The caller must supply four datasets that contain the variables which define
-        the hydrostatic and surface pressure at all vertical z_levels and all time 
-        on the t-points around the contour i.e. for a set of f-points on the contour 
-        defined each defined at (j+1/2, i+1/2), we want t-points at (j,i), (j+1,i), (j,i+1), (j+1,i+1), 
-        corresponding to ds_T, ds_T_j1, ds_T_i1, ds_T_j1i1, respectively. 
-        ds_T, ds_T_j1, ds_T_i1, ds_T_j1i1 will have dimensions in time and depth.
-        
-        The velocity_component defines whether u or v is normal to the contour 
-        for the segments of the contour. A segment of contour is 
-        defined as being r_dim to r_dim+1 where r_dim is the along contour dimension.
-
-
-        Returns
-        -------
-        hpg_f : DataArray with dimensions in time and depth and along contour
-            hydrostatic pressure gradient at a set of f-points along the contour
-            for all time and depth
-        spg_f : DataArray with dimensions in time and depth and along contour
-            surface pressure gradient at a set of f-points along the contour
-
-        """
-        if velocity_component == "u":
-            # required scale factors for derivative and averaging
-            e2v = 0.5*( ds_T_j1.e2.data[r_ind] + ds_T.e2.data[r_ind] )
-            e2v_i1 = 0.5*( ds_T_j1i1.e2.data[r_ind] + ds_T_i1.e2.data[r_ind] )
-            e1v = 0.5*( ds_T_j1.e1.data[r_ind] + ds_T.e1.data[r_ind] )
-            e1v_i1 = 0.5*( ds_T_j1i1.e1.data[r_ind] + ds_T_i1.e1.data[r_ind] )
-            e1f = 0.5*( e1v + e1v_i1 )            
-            # calculate gradients at v-points either side of f-point
-            hpg = (ds_T_j1.pressure_h_zlevels.data[:,:,r_ind] - ds_T.pressure_h_zlevels.data[:,:,r_ind]) / e2v
-            hpg_i1 = (ds_T_j1i1.pressure_h_zlevels.data[:,:,r_ind] - ds_T_i1.pressure_h_zlevels.data[:,:,r_ind]) / e2v_i1   
-            # average onto f-point
-            hpg_f = 0.5 * ( ( e1v * hpg ) + ( e1v_i1 * hpg_i1 ) ) / e1f 
-            # as aboave            
-            spg = (ds_T_j1.pressure_s.data[:,r_ind] - ds_T.pressure_s.data[:,r_ind]) / e2v
-            spg_i1 = (ds_T_j1i1.pressure_s.data[:,r_ind] - ds_T_i1.pressure_s.data[:,r_ind]) / e2v_i1
-            spg_f = 0.5 * ( (e1v * spg) + (e1v_i1 * spg_i1) ) / e1f 
-        elif velocity_component == "v":
-            # required scale factors for derivative and averaging
-            e1u = 0.5 * ( ds_T_i1.e1.data[r_ind] + ds_T.e1.data[r_ind] ) 
-            e1u_j1 = 0.5 * ( ds_T_j1i1.e1.data[r_ind] + ds_T_j1.e1.data[r_ind] )
-            e2u = 0.5 * ( ds_T_i1.e2.data[r_ind] + ds_T.e2.data[r_ind] )
-            e2u_j1 = 0.5 * ( ds_T_j1i1.e2.data[r_ind] + ds_T_j1.e2.data[r_ind] )
-            e2f = 0.5 * ( e2u + e2u_j1 )
-            # calculate gradients at u-points either side of f-point
-            hpg = (ds_T_i1.pressure_h_zlevels.data[:,:,r_ind] - ds_T.pressure_h_zlevels.data[:,:,r_ind]) / e1u
-            hpg_j1 = (ds_T_j1i1.pressure_h_zlevels.data[:,:,r_ind] - ds_T_j1.pressure_h_zlevels.data[:,:,r_ind]) / e1u_j1 
-            # average onto f-point
-            hpg_f = 0.5 * ( (e2u * hpg) + (e2u_j1 * hpg_j1) ) / e2f
-            # as above
-            spg = (ds_T_i1.pressure_s.data[:,r_ind] - ds_T.pressure_s.data[:,r_ind]) / e1u
-            spg_j1 = (ds_T_j1i1.pressure_s.data[:,r_ind] - ds_T_j1.pressure_s.data[:,r_ind]) / e1u_j1 
-            spg_f = 0.5 * ( (e2u * spg) + (e2u_j1 * spg_j1) ) / e2f
-        
-        return (hpg_f, spg_f)
-   
-    
-    def calc_geostrophic_flow(self, nemo_t: COAsT, ref_density=None):
+    def calc_geostrophic_flow(self, nemo_t: COAsT, ref_density=None, nemo_u: COAsT=None,
+                              nemo_v: COAsT=None, time_chunk=None):
         """
         This method will calculate the geostrophic velocity and volume transport
         (due to the geostrophic current) across the contour. 
@@ -504,7 +401,10 @@ class Contour_f(Contour):
                                                                        
         This implementation works by regridding vertically onto horizontal z_levels in order
         to perform the horizontal gradients. Currently s_level depths are
-        assumed fixed at their initial depths, i.e. at time zero.
+        assumed fixed at their initial depths, i.e. at time zero. The t-point
+        columns around the contour are read once and density and pressure are
+        calculated once per column (see section_util.geostrophic_flow). If nemo_t
+        is dask-backed, or time_chunk is given, the new variables are lazy.
         
         Requirements: The nemo t-grid dataset, nemo_t, must contain the sea surface height,
         Practical Salinity and the Potential Temperature variables. The depth_0
@@ -518,181 +418,56 @@ class Contour_f(Contour):
         ref_density : TYPE, optional
             reference density value. If not supplied a mean in time, depth and 
             along the contour will be used as the mean reference value.
+        nemo_u, nemo_v : COAsT, optional
+            The nemo objects on the u and v grids, e.g. those passed to
+            calc_cross_contour_flow(). Used for the coordinates and scale factors
+            of the normal velocity points. If not supplied they are loaded from
+            the domain file.
+        time_chunk : int, optional
+            Number of times in each dask chunk of the calculation.
 
         Returns
         -------
         None.
 
         """
-        # If there is no time dimension, add one then remove at end. This is so
-        # indexing can assume a time dimension exists
-        nemo_t_local = nemo_t.copy()
-        if 't_dim' not in nemo_t_local.dataset.dims:
-            nemo_t_local.dataset = nemo_t_local.dataset.expand_dims(dim={'t_dim':1},axis=0)
-        
-        # We need to calculate the pressure at four t-points to get an
-        # average onto the pressure gradient at the f-points, which will then
-        # be averaged onto the normal velocity points. Here we subset the nemo_t 
-        # data around the contour so we have these four t-grid points at each 
-        # point along the contour        
-        cont_t = Contour_t(nemo_t_local, self.y_ind, self.x_ind, self.depth)            # j,i
-        cont_t_j1 = Contour_t(nemo_t_local, self.y_ind+1, self.x_ind, self.depth)       # j+1,i
-        cont_t_i1 = Contour_t(nemo_t_local, self.y_ind, self.x_ind+1, self.depth)       # j,i+1
-        cont_t_j1i1 = Contour_t(nemo_t_local, self.y_ind+1, self.x_ind+1, self.depth)   # j+1,i+1
-        
-        bath_max = np.max([cont_t.data_contour.bathymetry.max().item(), 
-                           cont_t_j1.data_contour.bathymetry.max().item(),
-                           cont_t_i1.data_contour.bathymetry.max().item(), 
-                           cont_t_j1i1.data_contour.bathymetry.max().item()])   
-        z_levels = self.gen_z_levels(bath_max)
-        
-        cont_t.construct_pressure(ref_density, z_levels, extrapolate=True)
-        cont_t_j1.construct_pressure(ref_density, z_levels, extrapolate=True)
-        cont_t_i1.construct_pressure(ref_density, z_levels, extrapolate=True)
-        cont_t_j1i1.construct_pressure(ref_density, z_levels, extrapolate=True)        
-        
-        # Remove the mean hydrostatic pressure on each z_level from the hydrostatic pressure.
-        # This helps to reduce the noise when taking the horizontal gradients of hydrostatic pressure.
-        # Also catch and ignore nan-slice warning
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore", category=RuntimeWarning)
-            pressure_h_zlevel_mean = ( xr.concat( (cont_t.data_contour.pressure_h_zlevels, 
-                            cont_t_j1.data_contour.pressure_h_zlevels, 
-                            cont_t_i1.data_contour.pressure_h_zlevels, 
-                            cont_t_j1i1.data_contour.pressure_h_zlevels), dim='concat_dim' )
-                            .mean(dim=('concat_dim','r_dim','t_dim'),skipna=True) )
-            if ref_density is None:
-                ref_density = ( xr.concat( (cont_t.data_contour.density_zlevels, 
-                            cont_t_j1.data_contour.density_zlevels, 
-                            cont_t_i1.data_contour.density_zlevels, 
-                            cont_t_j1i1.data_contour.density_zlevels), dim='concat_dim' )
-                            .mean(dim=('concat_dim','r_dim','t_dim','depth_z_levels'),skipna=True).item() )
-        cont_t.data_contour['pressure_h_zlevels'] = \
-                cont_t.data_contour.pressure_h_zlevels - pressure_h_zlevel_mean
-        cont_t_j1.data_contour['pressure_h_zlevels'] = \
-                cont_t_j1.data_contour.pressure_h_zlevels - pressure_h_zlevel_mean
-        cont_t_i1.data_contour['pressure_h_zlevels'] = \
-                cont_t_i1.data_contour.pressure_h_zlevels - pressure_h_zlevel_mean
-        cont_t_j1i1.data_contour['pressure_h_zlevels'] = \
-                cont_t_j1i1.data_contour.pressure_h_zlevels - pressure_h_zlevel_mean
-                
-        # Coriolis parameter
-        f = 2 * self.EARTH_ROT_RATE * np.sin( np.deg2rad(self.data_contour.latitude) )        
-    
-        # Find the indices where the derivative of the contour in the north, south, east and west
-        # directions are positive.
-        dr_n = np.where(np.diff(self.y_ind)>0, np.arange(0,self.data_contour.r_dim.size-1), np.nan )
-        dr_s = np.where(np.diff(self.y_ind)<0, np.arange(0,self.data_contour.r_dim.size-1), np.nan )
-        dr_e = np.where(np.diff(self.x_ind)>0, np.arange(0,self.data_contour.r_dim.size-1), np.nan )
-        dr_w = np.where(np.diff(self.x_ind)<0, np.arange(0,self.data_contour.r_dim.size-1), np.nan )        
-        dr_list = [dr_n[~np.isnan(dr_n)].astype(int), dr_s[~np.isnan(dr_s)].astype(int),
-                   dr_e[~np.isnan(dr_e)].astype(int), dr_w[~np.isnan(dr_w)].astype(int)]
-        
-        # horizontal scale factors on the relevent u and v grids that are
-        # normal to the contour for dr_n, dr_s, dr_e, dr_w
-        e2u_j1  = 0.5 * ( cont_t_j1.data_contour.e2.data[dr_list[0]] + cont_t_j1i1.data_contour.e2.data[dr_list[0]] )
-        e2u     = 0.5 * ( cont_t.data_contour.e2.data[dr_list[1]] + cont_t_i1.data_contour.e2.data[dr_list[1]] )
-        e1v_i1  = 0.5 * ( cont_t_i1.data_contour.e1.data[dr_list[2]] + cont_t_j1i1.data_contour.e1.data[dr_list[2]] )
-        e1v     = 0.5 * ( cont_t.data_contour.e1.data[dr_list[3]] + cont_t_j1.data_contour.e1.data[dr_list[3]] )
-        e_horiz_vel = [e2u_j1, e2u, e1v_i1, e1v] 
-        # Horizontal scale factors on f-grid for dr_n, dr_s, dr_e, dr_w
-        e_horiz_f   = [self.data_contour.e2, self.data_contour.e2, 
-                       self.data_contour.e1, self.data_contour.e1]
-        # velocity component normal to contour for dr_n, dr_s, dr_e, dr_w
-        velocity_component = ["u","u","v",'v']
-        # Geostrophic flow direction across contour
-        flow_direction = [-1,1,-1,1]        
-        
-        normal_velocity_hpg = np.zeros_like(cont_t.data_contour.pressure_h_zlevels)
-        normal_velocity_spg = np.zeros_like(cont_t.data_contour.pressure_s)
-        # horizontal scale factors for each segmant of contour
-        e_horiz = np.zeros( (cont_t.data_contour.t_dim.size, cont_t.data_contour.r_dim.size) ) 
-        # Contruct geostrophic flow
-        for dr, vel_comp, flow_dir, e_hor_vel, e_hor_f in \
-                zip(dr_list, velocity_component, flow_direction, e_horiz_vel, e_horiz_f) :
-            hpg, spg        = self.__pressure_grad_fpoint2( cont_t.data_contour, 
-                                cont_t_j1.data_contour, cont_t_i1.data_contour, 
-                                cont_t_j1i1.data_contour, dr, vel_comp )
-            hpg_r1, spg_r1  = self.__pressure_grad_fpoint2( cont_t.data_contour,
-                                cont_t_j1.data_contour,
-                                cont_t_i1.data_contour, 
-                                cont_t_j1i1.data_contour, dr+1, vel_comp )
-            normal_velocity_hpg[:,:,dr] = ( flow_dir * 0.5 * (e_hor_f.data[dr]*hpg/f.data[dr] 
-                                            + e_hor_f.data[dr+1]*hpg_r1/f.data[dr+1]) 
-                                            / (e_hor_vel * ref_density) )
-            normal_velocity_spg[:,dr]   = ( flow_dir * 0.5 * (e_hor_f.data[dr]*spg/f.data[dr] 
-                                            + e_hor_f.data[dr+1]*spg_r1/f.data[dr+1]) 
-                                            / (e_hor_vel * ref_density) ) 
-            e_horiz[:,dr]               = e_hor_vel
-
-        # Bathymetry at normal velocity points             
-        H = np.zeros_like( self.data_contour.bathymetry.values )
-        H[:-1] = 0.5*(self.data_contour.bathymetry.values[:-1] + self.data_contour.bathymetry.values[1:])
-        # Remove redundent levels below bathymetry
-        normal_velocity_hpg = np.where( z_levels[:,np.newaxis] <= H, 
-                                       normal_velocity_hpg, np.nan )           
-        active_z_levels = np.count_nonzero(~np.isnan(normal_velocity_hpg),axis=1).max() 
-        normal_velocity_hpg = normal_velocity_hpg[:,:active_z_levels,:]
-        z_levels = z_levels[:active_z_levels]
+        flow = section_util.geostrophic_flow(nemo_t, self.data_contour, self.y_ind, self.x_ind,
+                                             ref_density, time_chunk)
+        # The contour variables are defined at every point of the contour, 
+        # the last point having no segment
+        flow = flow.pad(r_dim=(0, 1), constant_values=0)
+        flow['normal_velocity_hpg'] = flow.normal_velocity_hpg.where( 
+                                        flow.depth_z_levels <= flow.bathymetry )
 
         # The cross contour flow is defined on the u and v points that are across
         # the contour, i.e. between f points, therefore the attributes of the
         # data_cross_flow dataset need to be on these points.
-        da_y_ind = xr.DataArray( self.y_ind, dims=['r_dim'] )
-        da_x_ind = xr.DataArray( self.x_ind, dims=['r_dim'] )
-        u_ds = NEMO( fn_domain=self.filename_domain, grid_ref='u-grid' ).dataset \
-            .isel(y_dim=da_y_ind, x_dim=da_x_ind)
-        v_ds = NEMO( fn_domain=self.filename_domain, grid_ref='v-grid' ).dataset \
-            .isel(y_dim=da_y_ind, x_dim=da_x_ind)
-        self.data_cross_flow['e1'] = xr.full_like(self.data_contour.e1, np.nan)  
-        self.data_cross_flow['e2'] = xr.full_like(self.data_contour.e2, np.nan)
-        self.data_cross_flow['latitude'] = xr.full_like(self.data_contour.latitude, np.nan)  
-        self.data_cross_flow['longitude'] = xr.full_like(self.data_contour.longitude, np.nan)
-        self.__update_cross_flow_vars('longitude',u_ds.longitude,v_ds.longitude,
-                            dr_list[0],dr_list[1],dr_list[2],dr_list[3],0)
-        self.__update_cross_flow_vars('latitude',u_ds.latitude,v_ds.latitude,
-                            dr_list[0],dr_list[1],dr_list[2],dr_list[3],0)         
-        self.__update_cross_flow_vars('e1',u_ds.e1,v_ds.e1,
-                            dr_list[0],dr_list[1],dr_list[2],dr_list[3],0)        
-        self.__update_cross_flow_vars('e2',u_ds.e2,v_ds.e2,
-                            dr_list[0],dr_list[1],dr_list[2],dr_list[3],0)
-        self.data_cross_flow['latitude'].attrs = {'standard_name':'Latitude at \
-                the contour-normal velocity grid points'}
-        self.data_cross_flow['longitude'].attrs = {'standard_name':'Longitude at \
-                the contour-normal velocity grid points'}
+        points = section_util.normal_point_metrics(self.y_ind, self.x_ind, nemo_u, nemo_v,
+                    ['latitude', 'longitude', 'e1', 'e2'], fn_domain=self.filename_domain) \
+                    .pad(r_dim=(0, 1))
+        coords = {'latitude': (('r_dim'), points.latitude.values),
+                  'longitude': (('r_dim'), points.longitude.values)}
         
-        # DataArray attributes
-        coords_hpg={'depth_z_levels': (('depth_z_levels'), z_levels),
-                'latitude': (('r_dim'), self.data_cross_flow.latitude),
-                'longitude': (('r_dim'), self.data_cross_flow.longitude)}
-        dims_hpg=['depth_z_levels', 'r_dim']
-        attributes_hpg = {'units': 'm/s', 'standard name': 'velocity across the \
+        # Add DataArrays  to dataset
+        self.data_cross_flow['normal_velocity_hpg'] = flow.normal_velocity_hpg.assign_coords(coords)
+        self.data_cross_flow.normal_velocity_hpg.attrs = {'units': 'm/s', 'standard name': 'velocity across the \
                           transect due to the hydrostatic pressure gradient'}
-        coords_spg={'latitude': (('r_dim'), self.data_cross_flow.latitude),
-                'longitude': (('r_dim'), self.data_cross_flow.longitude)}
-        dims_spg=['r_dim']
-        attributes_spg = {'units': 'm/s', 'standard name': 'velocity across the \
+        self.data_cross_flow['normal_velocity_spg'] = flow.normal_velocity_spg.assign_coords(coords)
+        self.data_cross_flow.normal_velocity_spg.attrs = {'units': 'm/s', 'standard name': 'velocity across the \
                           transect due to the surface pressure gradient'}
-        
-        # Add time if required
-        if 't_dim' in cont_t.data_contour.dims:
-            coords_hpg['time'] = (('t_dim'), cont_t.data_contour.time)
-            dims_hpg.insert(0, 't_dim')
-            coords_spg['time'] = (('t_dim'), cont_t.data_contour.time)
-            dims_spg.insert(0, 't_dim')
-        
-        # Add DataArrays  to dataset
-        self.data_cross_flow['normal_velocity_hpg'] = xr.DataArray( np.squeeze(normal_velocity_hpg),
-                coords=coords_hpg, dims=dims_hpg, attrs=attributes_hpg)
-        self.data_cross_flow['normal_velocity_spg'] = xr.DataArray( np.squeeze(normal_velocity_spg),
-                coords=coords_spg, dims=dims_spg, attrs=attributes_spg)
-        self.data_cross_flow['transport_across_AB_hpg'] = ( self.data_cross_flow
-                .normal_velocity_hpg.fillna(0).integrate(dim='depth_z_levels') ) * e_horiz / 1000000   
+        self.data_cross_flow['transport_across_AB_hpg'] = flow.normal_transport_hpg
         self.data_cross_flow.transport_across_AB_hpg.attrs = {'units': 'Sv', 
                 'standard_name': 'volume transport across transect due to the hydrostatic pressure gradient'}        
-        self.data_cross_flow['transport_across_AB_spg'] = self.data_cross_flow.normal_velocity_spg * H * e_horiz / 1000000
+        self.data_cross_flow['transport_across_AB_spg'] = flow.normal_transport_spg
         self.data_cross_flow.transport_across_AB_spg.attrs = {'units': 'Sv', 
                 'standard_name': 'volume transport across transect due to the surface pressure gradient'}
+
+        for var in ['e1', 'e2', 'latitude', 'longitude']:
+            self.data_cross_flow[var] = xr.DataArray( points[var].values, dims=['r_dim'] )
+        self.data_cross_flow['latitude'].attrs = {'standard_name':'Latitude at \
+                the contour-normal velocity grid points'}
+        self.data_cross_flow['longitude'].attrs = {'standard_name':'Longitude at \
+                the contour-normal velocity grid points'}
         
         
 class Contour_t(Contour):
@@ -768,41 +543,19 @@ class Contour_t(Contour):
             z_levels = self.gen_z_levels( self.data_contour.bathymetry.max().item() )
         
         shape_ds = ( self.data_contour.t_dim.size, len(z_levels), self.data_contour.r_dim.size )
-        salinity_z = np.ma.zeros( shape_ds )
-        temperature_z = np.ma.zeros( shape_ds ) 
-        salinity_s = self.data_contour.salinity.to_masked_array()
-        temperature_s = self.data_contour.temperature.to_masked_array()
-        s_levels = self.data_contour.depth_0.values
-        
-        # Interpolate salinity and temperature onto z-levels
-        # Note. At the current time there does not appear to be a good algorithm for 
-        # performing this type of interpolation without loops, which can be a bottleneck.
-        # Griddata is an option but does not support extrapolation and did not 
-        # have noticable performance benefit.
-        for it in self.data_contour.t_dim:
-            for ir in self.data_contour.r_dim:
-                if not np.all(np.isnan(salinity_s[it,:,ir].data)):  
-                    # Need to remove the levels below the (envelope) bathymetry which are NaN
-                    salinity_s_r = salinity_s[it,:,ir].compressed()
-                    temperature_s_r = temperature_s[it,:,ir].compressed()
-                    s_levels_r = s_levels[:len(salinity_s_r),ir]
-                    
-                    sal_func = interpolate.interp1d( s_levels_r, salinity_s_r, 
-                                 kind='linear', fill_value="extrapolate")
-                    temp_func = interpolate.interp1d( s_levels_r, temperature_s_r, 
-                                 kind='linear', fill_value="extrapolate")
-                    
-                    if extrapolate is True:
-                        salinity_z[it,:,ir] = sal_func(z_levels)
-                        temperature_z[it,:,ir] = temp_func(z_levels)                        
-                    else:
-                        # set levels below the bathymetry to nan
-                        salinity_z[it,:,ir] = np.where( z_levels <= self.data_contour.bathymetry.values[ir], 
-                                sal_func(z_levels), np.nan )
-                        temperature_z[it,:,ir] = np.where( z_levels <= self.data_contour.bathymetry.values[ir], 
-                                temp_func(z_levels), np.nan ) 
-                    
+        salinity_s = self.data_contour.salinity.transpose('t_dim', 'z_dim', 'r_dim').values
+        temperature_s = self.data_contour.temperature.transpose('t_dim', 'z_dim', 'r_dim').values
+        s_levels = self.data_contour.depth_0.transpose('z_dim', 'r_dim').values
+        
+        # Interpolate salinity and temperature onto z-levels, for all profiles at once
+        salinity_z = section_util.interpolate_columns_to_z( salinity_s, s_levels, z_levels )
+        temperature_z = section_util.interpolate_columns_to_z( temperature_s, s_levels, z_levels )
         if extrapolate is False:
+            # set levels below the bathymetry to nan
+            below_bathymetry = ( ~(z_levels[:,np.newaxis] <= self.data_contour.bathymetry.values)
+                                 & ~np.all(np.isnan(salinity_s), axis=1)[:,np.newaxis,:] )
+            salinity_z[below_bathymetry] = np.nan
+            temperature_z[below_bathymetry] = np.nan
             # remove redundent levels    
             active_z_levels = np.count_nonzero(~np.isnan(salinity_z),axis=1).max() 
             salinity_z = salinity_z[:,:active_z_levels,:]
@@ -811,11 +564,11 @@ class Contour_t(Contour):
         
         # Absolute Pressure (depth must be negative)   
         pressure_absolute = np.ma.masked_invalid(
-            gsw.p_from_z( -z_levels[:,np.newaxis], self.data_contour.latitude ) )         
+            gsw.p_from_z( -z_levels[:,np.newaxis], self.data_contour.latitude.values ) )         
         # Absolute Salinity           
         salinity_absolute = np.ma.masked_invalid(
-            gsw.SA_from_SP( salinity_z, pressure_absolute, self.data_contour.longitude, 
-            self.data_contour.latitude ) )
+            gsw.SA_from_SP( salinity_z, pressure_absolute, self.data_contour.longitude.values, 
+            self.data_contour.latitude.values ) )
         salinity_absolute = np.ma.masked_less(salinity_absolute,0)
         # Conservative Temperature
         temp_conservative = np.ma.masked_invalid(
@@ -825,8 +578,8 @@ class Contour_t(Contour):
             salinity_absolute, temp_conservative, pressure_absolute ) )
         
         coords={'depth_z_levels': (('depth_z_levels'), z_levels),
-                'latitude': (('r_dim'), self.data_contour.latitude),
-                'longitude': (('r_dim'), self.data_contour.longitude)}
+                'latitude': (('r_dim'), self.data_contour.latitude.values),
+                'longitude': (('r_dim'), self.data_contour.longitude.values)}
         dims=['depth_z_levels', 'r_dim']
         attributes = {'units': 'kg / m^3', 'standard name': 'In-situ density on the z-level vertical grid'}
         
@@ -849,8 +602,195 @@ class Contour_t(Contour):
         self.data_contour['pressure_s'] = ref_density * self.GRAVITY * self.data_contour.ssh.squeeze()
         self.data_contour.pressure_s.attrs = {'units': 'kg m^{-1} s^{-2}', 
                                   'standard_name': 'Surface perturbation pressure'}
-        
+
+
+
+class Isobaths():
+    '''
+    Isobath contours of a model domain for many depths. The contours of each
+    depth are extracted once with skimage.measure.find_contours and cached
+    for the domain and depth, so later Isobaths objects (and
+    Contour.get_contours) for the same domain reuse them. Only the
+    ISOBATH_CACHE_SIZE most recently extracted domain and depth pairs are
+    kept. The contour vertices are indexed once per Isobaths object in
+    BallTrees for trimming contours to segments.
+    
+    The contours of each depth are stored compactly in an xarray.Dataset
+    (Isobaths.contours_by_depth[depth]) with the integer indices of all the
+    contours end to end along point and per-contour metadata along contour:
+        y_ind, x_ind (point) : indices of the contour points on the model grid
+        contour_start (contour) : index of the first point of each contour
+        n_points (contour) : number of points of each contour
+        closed (contour) : True for closed contours, False for open
+        length (contour) : length along the contour points (km)
+        area (contour) : area enclosed by closed contours, in grid cells
+    
+    Example usage:
+        isobaths = coast.Isobaths( nemo_f, [200, 500, 1000] )
+        isobaths.contours_by_depth[200].length.argmax()
+        y_ind, x_ind, contour = isobaths.get_segment( 200, [50,-10], [60,3] )
+        cont_f = coast.Contour_f( nemo_f, y_ind, x_ind, 200 )
+    
+    Parameters
+    ----------
+    nemo : COAsT
+        The Nemo object containing the dataset with the 'bathymetry' variable
+    depths : int or list of ints
+        Depths of the isobaths
+    '''
+    
+    def __init__(self, nemo: COAsT, depths):
+        bathymetry = nemo.dataset.bathymetry.values
+        self.latitude = nemo.dataset.latitude.values
+        self.longitude = nemo.dataset.longitude.values
+        digest = hashlib.sha1()
+        for array in [bathymetry, self.latitude, self.longitude]:
+            digest.update( np.ascontiguousarray(array).tobytes() )
+        self.domain_key = (bathymetry.shape, digest.hexdigest())
+        self.depths = list(np.atleast_1d(depths))
+        self.contours_by_depth = {}
+        self._trees = {}
+        for depth in self.depths:
+            key = (self.domain_key, float(depth))
+            if key not in _isobath_cache:
+                debug(f"Extracting the {depth} m isobaths for {get_slug(self)}")
+                while len(_isobath_cache) >= ISOBATH_CACHE_SIZE:
+                    _isobath_cache.pop(next(iter(_isobath_cache)))
+                _isobath_cache[key] = self._extract( bathymetry, depth )
+            self.contours_by_depth[depth] = _isobath_cache[key]
     
+    
+    def _extract(self, bathymetry, depth):
+        contours = measure.find_contours( bathymetry, depth )
+        n_points = np.array( [len(contour) for contour in contours], dtype=int )
+        offsets = np.concatenate( ([0], np.cumsum(n_points)) )
+        if len(contours) > 0:
+            points = np.concatenate( contours )
+        else:
+            points = np.zeros( (0, 2) )
+        # The find_contours method returns indices that have been interpolated
+        # between grid points so we must round and cast to integer 
+        index = np.round(points).astype(np.int32)
+        
+        # Sums of terms between consecutive points within each contour
+        within = np.ones( len(points), dtype=bool )
+        within[offsets[1:] - 1] = False
+        def sum_per_contour(values):
+            values = np.append( np.where(within[:-1], values, 0), 0 )
+            return np.add.reduceat( values, offsets[:-1] ) if len(contours) > 0 else np.zeros(0)
+        
+        closed = np.all( points[offsets[:-1]] == points[offsets[1:] - 1], axis=1 ) & (n_points > 2)
+        cross = points[:-1,1] * points[1:,0] - points[1:,1] * points[:-1,0]
+        area = np.where( closed, 0.5 * np.abs(sum_per_contour(cross)), np.nan )
+        lat = self.latitude[index[:,0], index[:,1]]
+        lon = self.longitude[index[:,0], index[:,1]]
+        distance = geodesy.haversine( lon[:-1], lat[:-1], lon[1:], lat[1:] )
+        length = sum_per_contour( distance )
+        
+        return xr.Dataset( {'y_ind': (('point'), index[:,0]), 'x_ind': (('point'), index[:,1]),
+                            'contour_start': (('contour'), offsets[:-1]),
+                            'n_points': (('contour'), n_points), 'closed': (('contour'), closed),
+                            'length': (('contour'), length, {'units':'km'}), 
+                            'area': (('contour'), area, {'units':'grid cells'})},
+                            attrs={'depth': depth} )
+    
+    
+    def get_contour(self, depth, contour: int):
+        '''
+        One contour as a 2d ndarray of indices, contour[:,0] the y indices
+        and contour[:,1] the x indices on the model grid.
+        '''
+        ds = self.contours_by_depth[depth]
+        start = ds.contour_start.values[contour]
+        end = start + ds.n_points.values[contour]
+        return np.stack( (ds.y_ind.values[start:end], ds.x_ind.values[start:end]),
+                         axis=1 ).astype(int)
+    
+    
+    def get_contours(self, depth):
+        '''
+        All the contours of a depth, as returned by Contour.get_contours().
+        '''
+        ds = self.contours_by_depth[depth]
+        y_ind = ds.y_ind.values.astype(int)
+        x_ind = ds.x_ind.values.astype(int)
+        contours = [ np.stack( (y_ind[start:start+n], x_ind[start:start+n]), axis=1 ) 
+                     for start, n in zip(ds.contour_start.values, ds.n_points.values) ]
+        return contours, len(contours)
+    
+    
+    def get_segment(self, depth, start_coords, end_coords, contour: int=None):
+        '''
+        Trims a contour to start and end at the contour points closest to
+        supplied (lat,lon) coordinates, as Contour.get_contour_segment(). 
         
+        Parameters
+        ----------
+        depth : depth of the isobath
+        start_coords : 1d array containing [latitude,longitude] of the start point
+        end_coords : 1d array containing [latitude,longitude] of the end point
+        contour : (optional) index of the contour to trim. If None the contour 
+            passing closest to start_coords is used.
         
-    
\ No newline at end of file
+        Returns
+        -------
+        y_ind, x_ind, contour as Contour.get_contour_segment()
+        '''
+        ds = self.contours_by_depth[depth]
+        if contour is None:
+            nearest = self._tree( depth ).query( np.deg2rad([start_coords]) )[1][0][0]
+            contour = np.searchsorted( ds.contour_start.values, nearest, side='right' ) - 1
+        points = self.get_contour( depth, contour )
+        return _trim_contour( points[:,0], points[:,1], self._tree(depth, contour), 
+                              start_coords, end_coords )
+    
+    
+    def _tree(self, depth, contour=None):
+        ''' BallTree of the points of one contour, or all contours if None. '''
+        key = (float(depth), contour)
+        if key not in self._trees:
+            if contour is None:
+                ds = self.contours_by_depth[depth]
+                y_ind, x_ind = ds.y_ind.values, ds.x_ind.values
+            else:
+                points = self.get_contour( depth, contour )
+                y_ind, x_ind = points[:,0], points[:,1]
+            self._trees[key] = BallTree( np.deg2rad( list( zip( self.latitude[y_ind, x_ind], 
+                    self.longitude[y_ind, x_ind] ) ) ), metric='haversine' )
+        return self._trees[key]
+    
+    
+    @staticmethod
+    def clear_cache():
+        ''' Empties the cache of isobaths for all domains. '''
+        _isobath_cache.clear()
+
+
+def _trim_contour(y_ind, x_ind, tree, start_coords, end_coords):
+    ''' 
+    Trims contour indices to the points closest to start_coords and end_coords
+    using a BallTree of the contour points, with the start point closer to
+    the southern (or western) boundary of the domain.
+    '''
+    # Get start and end indices for contour and subset accordingly
+    start_idx = tree.query( np.deg2rad( [start_coords]) )[1][0][0]
+    end_idx = tree.query( np.deg2rad([end_coords]) )[1][0][0]   
+    if start_idx > end_idx:
+        y_ind = y_ind[end_idx:start_idx+1] 
+        x_ind = x_ind[end_idx:start_idx+1]
+    else:
+        y_ind = y_ind[start_idx:end_idx+1] 
+        x_ind = x_ind[start_idx:end_idx+1]
+        
+    # Ensure that the start point is closer to southern boundary of domain.
+    # If start and end point have same latitude then ensure start point is 
+    # closer to the western boundary of the domain.
+    if y_ind[0] > y_ind[-1]:
+        y_ind = y_ind[::-1]
+        x_ind = x_ind[::-1]
+    elif y_ind[0] == y_ind[-1]:
+        if x_ind[0] > x_ind[-1]:
+            y_ind = y_ind[::-1]
+            x_ind = x_ind[::-1]
+            
+    return y_ind, x_ind, np.vstack((y_ind,x_ind)).T
@@ -1,10 +1,50 @@
 from .COAsT import COAsT
+import os
+import hashlib
 import xarray as xr
 import numpy as np
 import skimage.draw as draw
-from . import general_utils
+from . import geodesy
+from .logging_util import get_slug, debug, info, warn, error
+
+# Polygon masks by (grid, region), see MASK_MAKER.region_masks(). Only the
+# REGION_MASK_CACHE_SIZE most recently made or read masks are kept.
+REGION_MASK_CACHE_SIZE = 16
+_region_mask_cache = {}
 
 class MASK_MAKER(): 
+    '''
+    Methods for making 2D masks of regions on a model grid, from polygons
+    in index space or in longitude and latitude.
+
+    The Northwest European Shelf regions are defined in NWS_REGIONS, by the
+    vertices of a polygon and the range of bathymetry (exclusive, positive
+    with depth) within the region. region_masks() makes the masks of many
+    regions at once and caches them, in memory and optionally on disk.
+    '''
+
+    NWS_REGIONS = {
+        'north_sea': {
+            'vertices_lon': [-5.34,  -0.7,   7.5,    7.5,   9,     9, 
+                             6.3,    6.3,    5,      5,     4.126, 4.126, -1.071],
+            'vertices_lat': [56.93,  54.09,  54.09,  56,    56,    57.859, 
+                             57.859, 58.121, 58.121, 58.59, 58.59, 60.5,  60.5],
+            'depth_range': (0, 200)},
+        'outer_shelf': {
+            'vertices_lon': [-4,    -9.5,  -1,   3.171, 3.171, -3.76, -3.76, -12, 
+                             -12,   -12,   -4],
+            'vertices_lat': [50.5,  52.71, 60.5, 60.45, 63.3,  63.3,  60.45, 60.45, 
+                             55.28, 48,    48],
+            'depth_range': (0, 200)},
+        'norwegian_trench': {
+            'vertices_lon': [10.65, 1.12,  1.12, 10.65],
+            'vertices_lat': [61.83, 61.83, 48,   48],
+            'depth_range': (200, np.inf)},
+        'english_channel': {
+            'vertices_lon': [7.57, 7.57,  -0.67,  -2,   -3.99, -3.99, -3.5, 12, 14],
+            'vertices_lat': [56,   54.08, 54.08,  50.7, 50.7,  48.8,  48,   48, 56],
+            'depth_range': (0, 200)}
+        }
 
     def __init__(self):
         
@@ -43,100 +83,228 @@ class MASK_MAKER():
     @staticmethod
     def fill_polygon_by_lonlat(array_to_fill, longitude, latitude, 
                                vertices_lon, vertices_lat, fill_value = 1,
-                               additive = False):
+                               additive = False, spherical = False):
         """
         Draws and fills a polygon onto an existing numpy array based on 
-        vertices defined by longitude and latitude locations. This does NOT
-        draw a polygon on a sphere, but instead based on straight lines 
-        between points. This is OK for small regional areas, but not advisable
-        for large and global regions.
+        vertices defined by longitude and latitude locations. Grid points
+        are filled if their longitude and latitude are inside the polygon
+        (see points_in_polygon). By default the edges of the polygon are
+        straight lines in longitude and latitude. This is OK for small
+        regional areas; use spherical=True for great circle edges in large
+        regions.
         Polygon vertices are drawn in the order given.
         
         Parameters
         ----------
         array_to_fill (2D array): Array onto which to fill polygon
-        vertices_r (1D array): Row indices for polygon vertices
-        vertices_c (1D_array): Column indices for polygon vertices
+        longitude (2D array): Longitudes of the grid
+        latitude (2D array): Latitudes of the grid
+        vertices_lon (1D array): Longitudes of polygon vertices
+        vertices_lat (1D_array): Latitudes of polygon vertices
         fill_value (float, bool or int): Fill value for polygon (Default: 1)
         additive (bool): If true, add fill value to existing array. Otherwise
                          indices will be overwritten. (Default: False)
+        spherical (bool): If true, the edges are great circles (Default: False)
 
         Returns
         -------
         Filled 2D array
         """
         array_to_fill = np.array(array_to_fill)
-        ind2D = general_utils.nearest_indices_2D(longitude, latitude, 
-                                                 vertices_lon, vertices_lat)
-        
-        polygon_ind = draw.polygon(ind2D[1], ind2D[0], array_to_fill.shape)
+        inside = MASK_MAKER.points_in_polygon(longitude, latitude, vertices_lon,
+                                              vertices_lat, spherical)
         if additive:
-            array_to_fill[polygon_ind[0], polygon_ind[1]] += fill_value
+            array_to_fill[inside] += fill_value
         else:
-            array_to_fill[polygon_ind[0], polygon_ind[1]] = fill_value
+            array_to_fill[inside] = fill_value
         return array_to_fill
-    
+
+    @staticmethod
+    def points_in_polygon(longitude, latitude, vertices_lon, vertices_lat,
+                          spherical = False):
+        """
+        Tests which points are inside a polygon, using the even-odd rule
+        vectorised over the points. Only points inside the bounding box of
+        the polygon are tested against its edges.
+
+        If spherical is True the edges are great circle arcs. The points
+        and vertices are then projected with a gnomonic projection about
+        the centre of the polygon, which maps great circles to straight
+        lines, so the polygon must lie within a hemisphere. Otherwise the
+        edges are straight lines in longitude and latitude.
+
+        Parameters
+        ----------
+        longitude, latitude (arrays): Locations to test (degrees), any shape
+        vertices_lon, vertices_lat (1D arrays): Polygon vertices (degrees)
+        spherical (bool): If true, the edges are great circles
+
+        Returns
+        -------
+        Boolean array like longitude, True inside the polygon
+        """
+        longitude = np.asarray(longitude)
+        latitude = np.asarray(latitude)
+        if spherical:
+            x, y, vertices_x, vertices_y = MASK_MAKER._gnomonic(
+                longitude, latitude, vertices_lon, vertices_lat)
+        else:
+            x, y = longitude.ravel(), latitude.ravel()
+            vertices_x = np.asarray(vertices_lon, dtype=float)
+            vertices_y = np.asarray(vertices_lat, dtype=float)
+
+        candidates = np.flatnonzero( (x >= vertices_x.min()) & (x <= vertices_x.max())
+                                     & (y >= vertices_y.min()) & (y <= vertices_y.max()) )
+        x = x[candidates]
+        y = y[candidates]
+        inside = np.zeros(len(candidates), dtype=bool)
+        for x1, y1, x2, y2 in zip(vertices_x, vertices_y,
+                                  np.roll(vertices_x, -1), np.roll(vertices_y, -1)):
+            if y1 == y2:
+                continue
+            crosses = (y1 > y) != (y2 > y)
+            inside ^= crosses & (x < x1 + (y - y1) * (x2 - x1) / (y2 - y1))
+
+        mask = np.zeros(longitude.size, dtype=bool)
+        mask[candidates[inside]] = True
+        return mask.reshape(longitude.shape)
+
     @classmethod
-    def region_def_nws_north_sea(cls, longitude, latitude, bath):
+    def region_masks(cls, longitude, latitude, bath, regions = None,
+                     spherical = False, cache_dir = None):
+        """
+        Masks of many regions on a grid, made in one pass. The polygon
+        mask of each region is cached by grid and region, in memory and,
+        if cache_dir is given, as .npy files on disk, so later calls for
+        the same grid only apply the bathymetry ranges. The memory cache
+        keeps the REGION_MASK_CACHE_SIZE most recent masks.
+
+        Example usage:
+            masks = coast.MASK_MAKER.region_masks(nemo.dataset.longitude,
+                        nemo.dataset.latitude, nemo.dataset.bathymetry,
+                        cache_dir='mask_cache')
+            north_sea = masks['north_sea']
+
+        Parameters
+        ----------
+        longitude, latitude (2D arrays): Model coordinates
+        bath (2D array): Model bathymetry, positive with depth
+        regions: List of names from NWS_REGIONS, or a dictionary of region
+                 definitions like NWS_REGIONS. Default is all NWS_REGIONS.
+        spherical (bool): If true, polygon edges are great circles
+        cache_dir (str): Directory for cached masks. None for no disk cache.
+
+        Returns
+        -------
+        Dictionary of region name -> mask, 1 inside the region and 0 outside
+        """
+        if regions is None:
+            regions = cls.NWS_REGIONS
+        elif not isinstance(regions, dict):
+            regions = {name: cls.NWS_REGIONS[name] for name in regions}
+        longitude = np.asarray(longitude)
+        latitude = np.asarray(latitude)
+        digest = hashlib.sha1()
+        for array in [longitude, latitude]:
+            digest.update(np.ascontiguousarray(array).tobytes())
+        grid_key = f"{longitude.shape[0]}x{longitude.shape[-1]}_{digest.hexdigest()[:16]}"
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        in_water = (bath > 0) & ~np.isnan(bath)
+        masks = {}
+        for name, region in regions.items():
+            digest = hashlib.sha1(repr((name, list(region['vertices_lon']),
+                                        list(region['vertices_lat']), spherical)).encode())
+            key = (grid_key, digest.hexdigest()[:16])
+            fn_cache = None if cache_dir is None else os.path.join(cache_dir, 
+                                                                   f"mask_{key[0]}_{key[1]}.npy")
+            if key not in _region_mask_cache:
+                while len(_region_mask_cache) >= REGION_MASK_CACHE_SIZE:
+                    _region_mask_cache.pop(next(iter(_region_mask_cache)))
+                if fn_cache is not None and os.path.isfile(fn_cache):
+                    debug(f"Reading cached {name} mask from {fn_cache}")
+                    _region_mask_cache[key] = np.load(fn_cache)
+                else:
+                    debug(f"Making {name} mask on a {longitude.shape} grid")
+                    _region_mask_cache[key] = cls.points_in_polygon(
+                        longitude, latitude, region['vertices_lon'],
+                        region['vertices_lat'], spherical)
+                    if fn_cache is not None:
+                        np.save(fn_cache, _region_mask_cache[key])
+            min_depth, max_depth = region.get('depth_range', (-np.inf, np.inf))
+            masks[name] = ( _region_mask_cache[key] * (bath > min_depth) * (bath < max_depth)
+                            * in_water ).astype(float)
+        return masks
+
+    @staticmethod
+    def clear_cache():
+        """ Empties the in memory cache of region masks. """
+        _region_mask_cache.clear()
+
+    @classmethod
+    def region_def_nws_north_sea(cls, longitude, latitude, bath, cache_dir=None):
         '''
         Regional definition for the North Sea (Northwest European Shelf)
         Longitude, latitude and bath should be 2D arrays corresponding to model
         coordinates and bathymetry. Bath should be positive with depth.
         '''
-        vertices_lon = [-5.34,  -0.7,   7.5,    7.5,   9,     9, 
-                        6.3,    6.3,    5,      5,     4.126, 4.126, -1.071]
-        vertices_lat = [56.93,  54.09,  54.09,  56,    56,    57.859, 
-                        57.859, 58.121, 58.121, 58.59, 58.59, 60.5,  60.5]
-
-        mask = cls.fill_polygon_by_lonlat(np.zeros(longitude.shape),
-                                      longitude, latitude,
-                                      vertices_lon, vertices_lat)
-        mask = mask * (bath<200) * (bath>0) * (~xr.ufuncs.isnan(bath))
-        return mask
+        return cls.region_masks(longitude, latitude, bath, ['north_sea'],
+                                cache_dir=cache_dir)['north_sea']
 
     @classmethod
-    def region_def_nws_outer_shelf(cls, longitude, latitude, bath):
+    def region_def_nws_outer_shelf(cls, longitude, latitude, bath, cache_dir=None):
         '''
         Regional definition for the Outher Shelf (Northwest European Shelf)
         Longitude, latitude and bath should be 2D arrays corresponding to model
         coordinates and bathymetry. Bath should be positive with depth.
         '''
-        vertices_lon = [-4,    -9.5,  -1,   3.171, 3.171, -3.76, -3.76, -12, 
-                        -12,   -12,   -4]
-        vertices_lat = [50.5,  52.71, 60.5, 60.45, 63.3,  63.3,  60.45, 60.45, 
-                        55.28, 48,    48]
-        mask = cls.fill_polygon_by_lonlat(np.zeros(longitude.shape),
-                                      longitude, latitude,
-                                      vertices_lon, vertices_lat)
-        mask = mask * (bath<200) * (bath>0) * (~xr.ufuncs.isnan(bath))
-        return mask
+        return cls.region_masks(longitude, latitude, bath, ['outer_shelf'],
+                                cache_dir=cache_dir)['outer_shelf']
 
     @classmethod
-    def region_def_nws_norwegian_trench(cls, longitude, latitude, bath):
+    def region_def_nws_norwegian_trench(cls, longitude, latitude, bath, cache_dir=None):
         '''
         Regional definition for the Norwegian Trench (Northwest European Shelf)
         Longitude, latitude and bath should be 2D arrays corresponding to model
         coordinates and bathymetry. Bath should be positive with depth.
         '''
-        vertices_lon = [10.65, 1.12,  1.12, 10.65]
-        vertices_lat = [61.83, 61.83, 48,   48]
-        mask = cls.fill_polygon_by_lonlat(np.zeros(longitude.shape),
-                                      longitude, latitude,
-                                      vertices_lon, vertices_lat)
-        mask = mask * (bath>200) * (bath>0) * (~xr.ufuncs.isnan(bath))
-        return mask
+        return cls.region_masks(longitude, latitude, bath, ['norwegian_trench'],
+                                cache_dir=cache_dir)['norwegian_trench']
 
     @classmethod    
-    def region_def_nws_english_channel(cls, longitude, latitude, bath):
+    def region_def_nws_english_channel(cls, longitude, latitude, bath, cache_dir=None):
         '''
         Regional definition for the English Channel (Northwest European Shelf)
         Longitude, latitude and bath should be 2D arrays corresponding to model
         coordinates and bathymetry. Bath should be positive with depth.
         '''
-        vertices_lon = [7.57, 7.57,  -0.67,  -2,   -3.99, -3.99, -3.5, 12, 14]
-        vertices_lat = [56,   54.08, 54.08,  50.7, 50.7,  48.8,  48,   48, 56]
-        mask = cls.fill_polygon_by_lonlat(np.zeros(longitude.shape),
-                                      longitude, latitude,
-                                      vertices_lon, vertices_lat)
-        mask = mask * (bath<200) * (bath>0) * (~xr.ufuncs.isnan(bath))
-        return mask
\ No newline at end of file
+        return cls.region_masks(longitude, latitude, bath, ['english_channel'],
+                                cache_dir=cache_dir)['english_channel']
+
+    @staticmethod
+    def _gnomonic(longitude, latitude, vertices_lon, vertices_lat):
+        '''
+        Gnomonic projection of points and polygon vertices about the centre
+        of the polygon. Points more than 90 degrees from the centre are put
+        at infinity, outside any polygon.
+        '''
+        points = geodesy.unit_vectors(longitude, latitude)
+        vertices = geodesy.unit_vectors(vertices_lon, vertices_lat)
+        centre = vertices.sum(axis=0)
+        centre = centre / np.linalg.norm(centre)
+        east = np.cross([0, 0, 1], centre)
+        if np.linalg.norm(east) < 1e-12:
+            east = np.array([0., 1., 0.])
+        east = east / np.linalg.norm(east)
+        north = np.cross(centre, east)
+        if np.any(vertices @ centre <= 0):
+            raise ValueError("Polygon does not lie within a hemisphere, "
+                             + "so cannot be used with spherical=True")
+        with np.errstate(divide='ignore', invalid='ignore'):
+            height = points @ centre
+            height = np.where(height > 0, height, np.nan)
+            x = np.where(np.isnan(height), np.inf, (points @ east) / height)
+            y = np.where(np.isnan(height), np.inf, (points @ north) / height)
+        height = vertices @ centre
+        return x, y, (vertices @ east) / height, (vertices @ north) / height
@@ -1,5 +1,5 @@
 from .COAsT import COAsT
-from . import general_utils, stats_util
+from . import general_utils, stats_util, tide_util, section_util
 import xarray as xr
 import numpy as np
 # from dask import delayed, compute, visualize
@@ -269,9 +269,35 @@ class NEMO(COAsT):  # TODO Complete this docstring
         :return: the y and x coordinates for the NEMO object's grid_ref, i.e. t,u,v,f,w.
         """
         debug(f"Finding j,i for {lat},{lon} from {get_slug(self)}")
-        dist2 = xr.ufuncs.square(self.dataset.latitude - lat) + xr.ufuncs.square(self.dataset.longitude - lon)
-        [y, x] = np.unravel_index(dist2.argmin(), dist2.shape)
-        return [y, x]
+        y, x = self.grid_index().nearest_j_i(lat, lon)
+        return [y[0], x[0]]
+
+    def find_j_i_list(self, lat, lon):
+        """
+        As find_j_i, for many latitudes and longitudes in one batched query
+        of the cached grid index.
+        Usage: y, x = find_j_i_list([49, 50, 51], [-12, -11, -10])
+
+        :param lat: latitudes
+        :param lon: longitudes
+        :return: arrays of the y and x coordinates for the NEMO object's grid_ref
+        """
+        debug(f"Finding j,i for {np.size(lat)} points from {get_slug(self)}")
+        return self.grid_index().nearest_j_i(lat, lon)
+
+    def grid_index(self):
+        """
+        A general_utils.GridIndex of the latitude and longitude of this grid,
+        built on first use and cached. It is rebuilt if the dataset or its
+        latitude or longitude are replaced.
+        """
+        latitude = self.dataset.variables['latitude']
+        longitude = self.dataset.variables['longitude']
+        cached = getattr(self, '_grid_index_cache', None)
+        if cached is None or cached[0] is not latitude or cached[1] is not longitude:
+            index = general_utils.GridIndex(longitude.values, latitude.values)
+            self._grid_index_cache = (latitude, longitude, index)
+        return self._grid_index_cache[2]
 
     def find_j_i_domain(self, lat: float, lon: float, dataset_domain: xr.DataArray):
         # TODO add dataset_domain to docstring and remove nonexistent grid_ref
@@ -302,15 +328,10 @@ class NEMO(COAsT):  # TODO Complete this docstring
         :return: array of y indices, array of x indices, number of indices in transect
         """
         debug(f"Fetching transect indices for {start} to {end} from {get_slug(self)}")
-        [j1, i1] = self.find_j_i(start[0], start[1])  # lat , lon
-        [j2, i2] = self.find_j_i(end[0], end[1])  # lat , lon
+        jj, ii = self.find_j_i_list([start[0], end[0]], [start[1], end[1]])  # lat , lon
+        jj1, ii1 = section_util.polyline_indices(jj, ii)
 
-        line_length = max(np.abs(j2 - j1), np.abs(i2 - i1)) + 1
-
-        jj1 = [int(jj) for jj in np.round(np.linspace(j1, j2, num=line_length))]
-        ii1 = [int(ii) for ii in np.round(np.linspace(i1, i2, num=line_length))]
-
-        return jj1, ii1, line_length
+        return jj1.tolist(), ii1.tolist(), len(jj1)
     
     @staticmethod
     def interpolate_in_space(model_array, new_lon, new_lat, mask=None):
@@ -626,9 +647,10 @@ class NEMO(COAsT):  # TODO Complete this docstring
         Input variable is expected to be hourly.
         Output is saved back to original dataset as {var_str}_dxo
         
-        !!WARNING: Will load in entire variable to memory. If dataset large,
-        then subset before using this method or ensure you have enough free 
-        RAM to hold the variable (twice). 
+        If the variable is a dask array (e.g. the dataset was loaded with 
+        chunks) the filtered variable is also a lazy dask array, computed
+        chunk by chunk with a 19 hour overlap along t_dim. Otherwise the 
+        filter is applied to the whole variable in memory.
         
         DB:: Currently not tested in unit_test.py'''
         var = self.dataset[var_str]
@@ -639,6 +661,52 @@ class NEMO(COAsT):  # TODO Complete this docstring
         if filtered is not None:
             self.dataset[new_var_str] = (old_dims, filtered)
         return
+
+    def apply_filter_bank(self, var_str, filters=('doodson',), dt_hours=None):
+        ''' Applies one or more low-pass tidal filters to a variable in a 
+        single pass. See stats_util.apply_filter_bank() for the available
+        filters and their arguments.
+        
+        Output is saved back to original dataset as {var_str}_{filter name}.
+        If the variable is a dask array, the filtered variables are lazy.'''
+        filtered = stats_util.apply_filter_bank(self.dataset[var_str], filters,
+                                                time_dim_name='t_dim',
+                                                dt_hours=dt_hours)
+        for name, da in filtered.data_vars.items():
+            self.dataset[var_str + '_' + name] = da
+        return
+
+    def find_high_and_low_water(self, var_str='ssh', refine=True, 
+                                max_events=None):
+        ''' Finds high and low waters of a variable in every model column at
+        once. See stats_util.find_extrema_grid() for details.
+        
+        Returns an xarray dataset of padded high and low water heights and
+        times, e.g. {var_str}_highs(highs_dim, y_dim, x_dim). If the variable
+        is a dask array this is lazy. Tidal range, for example, is then
+            (hlw.ssh_highs.mean('highs_dim') - hlw.ssh_lows.mean('lows_dim'))'''
+        return stats_util.find_extrema_grid(self.dataset[var_str], 
+                                            time_dim_name='t_dim',
+                                            time_var_name='time',
+                                            refine=refine, 
+                                            max_events=max_events)
+
+    def harmonic_analysis(self, constituents, var_str='ssh', time_chunk=None):
+        ''' Least squares harmonic analysis of a variable at every model
+        point. See tide_util.harmonic_analysis() for details.
+        
+        Returns a new NEMO object containing harmonic_x, harmonic_y,
+        harmonic_a, harmonic_g and z0, in the same form as the output of
+        harmonics_combine() and harmonics_convert(). Longitude and latitude
+        are kept as coordinates. '''
+        harmonics = tide_util.harmonic_analysis(self.dataset[var_str], 
+                                                constituents,
+                                                time_dim_name='t_dim',
+                                                time_var_name='time',
+                                                time_chunk=time_chunk)
+        nemo_harmonics = NEMO()
+        nemo_harmonics.dataset = harmonics
+        return nemo_harmonics
        
     
     @staticmethod
@@ -893,6 +961,29 @@ class NEMO(COAsT):  # TODO Complete this docstring
         
         return
 
+    def predict_tide(self, times, time_chunk=None, dtype=np.float64,
+                     include_z0=True):
+        '''
+        Predicted tide at every model point from combined harmonic variables,
+        as obtained using harmonics_combine() or harmonic_analysis(). See
+        tide_util.predict_tide() for details.
+        
+        Parameters
+        ----------
+        times (array)    : Times to predict at, e.g. nemo.dataset.time
+        time_chunk (int) : If given, the prediction is a lazy dask array
+                           with this many times per chunk. Default None.
+        dtype            : Output data type. Default np.float64.
+        include_z0 (bool): Add the mean level z0 if present. Default True.
+
+        Returns
+        -------
+        xarray DataArray of the predicted tide, dimensions (t_dim, ...)
+        '''
+        return tide_util.predict_tide(self.dataset, times, 
+                                      time_chunk=time_chunk, dtype=dtype,
+                                      include_z0=include_z0)
+
         
         
         
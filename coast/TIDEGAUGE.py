@@ -3,10 +3,14 @@ import xarray as xr
 import matplotlib.pyplot as plt
 import pandas as pd
 import glob
+import os
+import json
+import hashlib
 import re
 import pytz
 import sklearn.metrics as metrics
-from . import general_utils, plot_util, crps_util, stats_util
+from concurrent.futures import ThreadPoolExecutor
+from . import general_utils, plot_util, crps_util, stats_util, ea_util
 from .logging_util import get_slug, debug, error, info
 
 class TIDEGAUGE():
@@ -47,6 +51,14 @@ class TIDEGAUGE():
            objects from a list of filenames or directory and returns them
            in a list.
 
+        *Parsed file cache*
+        Set TIDEGAUGE.cache_dir to a directory to cache parsed GESLA, BODC
+        and HLW files. The first read of a file stores its columns there as
+        .npy files, keyed by path, size and modification time. Later reads
+        memory-map the columns and slice out the date window without
+        parsing any text. Changing the file invalidates its cache entry.
+            coast.TIDEGAUGE.cache_dir = 'tidegauge_cache'
+
         *Plotting*
         -> plot_on_map: Plots location of TIDEGAUGE object on map.
         -> plot_timeseries: Plots a specified time series.
@@ -68,12 +80,19 @@ class TIDEGAUGE():
         -> resample_mean(): For resampling data in time using averaging
         -> apply_doodson_xo_filter(): Remove tidal signal using Doodson XO
         -> find_high_and_low_water(): Find maxima and minima of time series
+
+        *Tide Tables*
+        -> get_tidetabletimes(): Tide table events near a time
+        -> get_tidetabletimes_many(): As above for an array of times
     '''
 
 ##############################################################################
 ###                ~ Initialisation and File Reading ~                     ###
 ##############################################################################
 
+    # Directory for the parsed file cache. None to always parse files.
+    cache_dir = None
+
     def __init__(self, file_path = None, date_start=None, date_end=None):
         '''
         Initialise TIDEGAUGE object either as empty (no arguments) or by
@@ -132,8 +151,11 @@ class TIDEGAUGE():
         '''
         debug(f"Reading \"{fn_gesla}\" as a GESLA file with {get_slug(cls)}")  # TODO Maybe include start/end dates
         try:
-            header_dict = cls.read_gesla_header_v3(fn_gesla)
-            dataset = cls.read_gesla_data_v3(fn_gesla, date_start, date_end)
+            header_dict, dataset = cls._read_with_cache(fn_gesla, 'gesla_v3',
+                cls.read_gesla_header_v3,
+                lambda header_dict, date0, date1: 
+                    cls.read_gesla_data_v3(fn_gesla, date0, date1),
+                date_start, date_end)
         except:
             raise Exception('Problem reading GESLA file: ' + fn_gesla)
         # Attributes
@@ -248,10 +270,10 @@ class TIDEGAUGE():
         end_index = len(time)
         if date_start is not None:
             date_start = np.datetime64(date_start)
-            start_index = np.argmax(time>=date_start)
+            start_index = np.searchsorted(time, date_start, side='left')
         if date_end is not None:
             date_end = np.datetime64(date_end)
-            end_index = np.argmax(time>date_end)
+            end_index = np.searchsorted(time, date_end, side='right')
         time = time[start_index:end_index]
         sea_level = sea_level[start_index:end_index]
         qc_flags=qc_flags[start_index:end_index]
@@ -269,6 +291,33 @@ class TIDEGAUGE():
         # Assign local dataset to object-scope dataset
         return dataset
 
+    @classmethod
+    def _read_with_cache(cls, filename, kind, read_header, read_data,
+                         date_start=None, date_end=None):
+        '''
+        Reads the header and data of a file with read_header(filename) and
+        read_data(header_dict, date_start, date_end), through the parsed
+        file cache if TIDEGAUGE.cache_dir is set. On a cache miss the whole
+        file is parsed and stored. The date window is then applied to the
+        memory-mapped cached columns by binary search on time.
+
+        Returns the header dictionary and a Dataset of the data variables
+        along the time dimension.
+        '''
+        if cls.cache_dir is None:
+            header_dict = read_header(filename)
+            return header_dict, read_data(header_dict, date_start, date_end)
+
+        dn_entry = _cache_entry(cls.cache_dir, filename, kind)
+        if not os.path.isdir(dn_entry):
+            debug(f"Parsing \"{filename}\" into cache {dn_entry}")
+            header_dict = read_header(filename)
+            dataset = read_data(header_dict, None, None)
+            _store_columns(dn_entry, header_dict, dataset)
+        else:
+            debug(f"Reading \"{filename}\" from cache {dn_entry}")
+        return _load_columns(dn_entry, date_start, date_end)
+
     @classmethod
     def create_multiple_tidegauge(cls, file_list, date_start=None,
                                   date_end=None):
@@ -345,8 +394,11 @@ class TIDEGAUGE():
         '''
         debug(f"Reading \"{fn_hlw}\" as a HLW file with {get_slug(cls)}")  # TODO Maybe include start/end dates
         try:
-            header_dict = cls.read_HLW_header(fn_hlw)
-            dataset = cls.read_HLW_data(fn_hlw, header_dict, date_start, date_end)
+            header_dict, dataset = cls._read_with_cache(fn_hlw, 'hlw',
+                cls.read_HLW_header,
+                lambda header_dict, date0, date1:
+                    cls.read_HLW_data(fn_hlw, header_dict, date0, date1),
+                date_start, date_end)
             if header_dict['field'] == 'TZ:UT(GMT)/BST':
                 debug('Read in as BST, stored as UTC')
             elif header_dict['field'] == 'TZ:GMTonly':
@@ -410,7 +462,11 @@ class TIDEGAUGE():
     def read_HLW_data(filnam, header_dict, date_start=None, date_end=None,
                            header_length:int=1):
         '''
-        Reads HLW data from a tidetable file.
+        Reads HLW data from a tidetable file. The file is parsed in columns
+        and all timestamps are converted in one vectorised call. If the
+        header gives the time zone as UT(GMT)/BST, times are converted from
+        UK local time to UTC using a table of BST transitions, so the result
+        does not depend on the time zone of the machine.
 
         Parameters
         ----------
@@ -423,59 +479,113 @@ class TIDEGAUGE():
         -------
         xarray.Dataset containing times, High and Low water values
         '''
-        import datetime
-        # Initialise empty dataset and lists
         debug(f"Reading HLW data from \"{filnam}\"")
-        dataset = xr.Dataset()
-        time = []
-        sea_level = []
-
         if header_dict['field'] == 'TZ:UT(GMT)/BST':
             localtime_flag = True
         else:
             localtime_flag = False
 
-        # Open file and loop until EOF
-        with open(filnam) as file:
-            line_count = 1
-            for line in file:
-                # Read all data. Date boundaries are set later.
-                if line_count>header_length:
-                    working_line = line.split()
-                    if working_line[0] != '#':
-                        time_str = working_line[0] + ' ' + working_line[1]
-                        # Read time as datetime.datetime because it can handle local timezone easily AND the unusual date format
-                        datetime_obj = datetime.datetime.strptime( time_str , '%d/%m/%Y %H:%M')
-                        if localtime_flag == True:
-                            time.append( np.datetime64(datetime_obj.astimezone() ))
-                        else:
-                            time.append( np.datetime64(datetime_obj) )
-                        sea_level.append(float(working_line[2]))
-                line_count = line_count + 1
-            debug(f"Read done, close file \"{filnam}\"")
+        # Read all data. Date boundaries are set later. Lines starting
+        # with # are skipped.
+        data = pd.read_csv(filnam, skiprows=header_length, sep=r'\s+',
+                           header=None, usecols=[0, 1, 2], comment='#',
+                           names=['date', 'time', 'sea_level'],
+                           dtype={'date':str, 'time':str, 'sea_level':float})
+        time = pd.to_datetime(data['date'] + ' ' + data['time'],
+                              format='%d/%m/%Y %H:%M').values
+        if localtime_flag == True:
+            time = general_utils.uk_local_to_utc(time)
+        sea_level = data['sea_level'].values
+        debug(f"Read done, close file \"{filnam}\"")
 
         # Return only values between stated dates
-        start_index = 0
-        end_index = len(time)
+        keep = np.ones(len(time), dtype=bool)
         if date_start is not None:
-            #start_index = general_utils.nearest_datetime_ind(time, date_start)
             date_start = np.datetime64(date_start)
-            start_index = np.argmax(time>=date_start)
-            debug(f"date_start: {date_start}. start_index: {start_index}")
+            keep = keep & (time >= date_start)
+            debug(f"date_start: {date_start}")
         if date_end is not None:
-            #end_index = general_utils.nearest_datetime_ind(time, date_end)
             date_end = np.datetime64(date_end)
-            end_index = np.argmax(time>date_end)
-            debug(f"date_end: {date_end}. end_index: {end_index}")
-        time = time[start_index:end_index]
-        sea_level = sea_level[start_index:end_index]
+            keep = keep & (time <= date_end)
+            debug(f"date_end: {date_end}")
+        time = time[keep]
+        sea_level = sea_level[keep]
         debug(f"sea_level: {sea_level}")
         # Assign arrays to Dataset
+        dataset = xr.Dataset()
         dataset['sea_level'] = xr.DataArray(sea_level, dims=['time'])
         dataset = dataset.assign_coords(time = ('time', time))
         # Assign local dataset to object-scope dataset
         return dataset
 
+    @classmethod
+    def read_HLW_multiple_to_xarray(cls, file_list, date_start=None, 
+                                    date_end=None, n_workers=None):
+        '''
+        Reads many HLW tide table files (file_list can include wildcards)
+        in parallel threads into one multi-port dataset. Ports have
+        different event times, so the dataset has dimensions
+        (port_dim, event_dim) with a time(port_dim, event_dim) coordinate.
+        Ports with fewer events are padded with NaN and NaT. Header
+        information is stored in variables along port_dim (site_name,
+        units, datum, field). Files that cannot be read are skipped.
+
+        Example usage:
+        --------------
+            tg = coast.TIDEGAUGE()
+            tg.dataset = tg.read_HLW_multiple_to_xarray('tables/*_HLW.txt')
+            tg.dataset.sea_level.sel(port_dim=0)
+
+        Parameters
+        ----------
+        file_list (str or list of str) : paths to tabulated HLW files
+        date_start (datetime) : start date for returning data
+        date_end (datetime) : end date for returning data
+        n_workers (int) : Number of threads. Default from concurrent.futures
+
+        Returns
+        -------
+        xarray.Dataset object.
+        '''
+        if type(file_list) is str:
+            file_list = [file_list]
+        file_to_read = []
+        for file in file_list:
+            if '*' in file:
+                file_to_read = file_to_read + sorted(glob.glob(file))
+            else:
+                file_to_read.append(file)
+
+        def read_one(fn_hlw):
+            try:
+                return cls.read_HLW_to_xarray(fn_hlw, date_start, date_end)
+            except Exception as err:
+                error(f"Problem reading HLW file {fn_hlw}: {err}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            datasets = list(executor.map(read_one, file_to_read))
+        files = [fn for fn, ds in zip(file_to_read, datasets) if ds is not None]
+        datasets = [ds for ds in datasets if ds is not None]
+
+        # Pad each port to the largest number of events
+        n_ports = len(datasets)
+        n_events = max([ds.dims['time'] for ds in datasets], default=0)
+        sea_level = np.full((n_ports, n_events), np.nan)
+        time = np.full((n_ports, n_events), np.datetime64('NaT'), 
+                       dtype='datetime64[ns]')
+        for ii, ds in enumerate(datasets):
+            sea_level[ii, :ds.dims['time']] = ds.sea_level.values
+            time[ii, :ds.dims['time']] = ds.time.values
+
+        dataset = xr.Dataset()
+        dataset['sea_level'] = (('port_dim', 'event_dim'), sea_level)
+        dataset = dataset.assign_coords(time=(('port_dim', 'event_dim'), time))
+        for key in ['site_name', 'field', 'units', 'datum']:
+            dataset[key] = ('port_dim', [ds.attrs.get(key) for ds in datasets])
+        dataset['filename'] = ('port_dim', files)
+        return dataset
+
     def show(self, timezone:str=None):
         """
         Print out the values in the xarray
@@ -519,39 +629,31 @@ class TIDEGAUGE():
             guess value.
 
         """
+        if time_guess is None:
+            debug("Use today's date")
+            time_guess = np.datetime64('now')
+
         # Ensure the date objects are datetime
         if type(time_guess) is not np.datetime64:
             debug('Convert date to np.datetime64')
             time_guess = np.datetime64(time_guess)
 
-        if time_guess == None:
-            debug("Use today's date")
-            time_guess = np.datetime64('now')
-
         if method == 'window':
             if winsize==None: winsize=2
-            # initialise start_index and end_index
-            start_index = 0
-            end_index = len(self.dataset[time_var])
-
-            date_start = time_guess - np.timedelta64(winsize, 'h')
-            start_index = np.argmax(self.dataset[time_var].values>=date_start)
-
-            date_end = time_guess + np.timedelta64(winsize, 'h')
-            end_index = np.argmax(self.dataset[time_var].values>date_end)
-
-            sea_level = self.dataset[measure_var][start_index:end_index]
+            start, end = self._tidetable_window(time_guess, time_var, winsize)
+            order = self._tidetable_index(time_var)[1]
+            sea_level = self.dataset[measure_var][order[start[0]:end[0]]]
 
             return sea_level
 
         elif method == 'nearest_1':
-            dt = np.abs(self.dataset[time_var] - time_guess)
-            index = np.argsort(dt).values
+            index, dt = self._tidetable_nearest(time_guess, time_var)
             if winsize is not None: # if search window trucation exists
-                if np.timedelta64(dt[index[0]].values,'m').astype('int') <= 60*winsize: # compare in minutes
-                    debug(f"dt:{np.timedelta64(dt[index[0]].values,'m').astype('int')}")
+                dt_minutes = dt[0, 0] // np.timedelta64(1, 'm')
+                if dt_minutes <= 60*winsize: # compare in minutes
+                    debug(f"dt:{dt_minutes}")
                     debug(f"winsize:{winsize}")
-                    return self.dataset[measure_var][index[0]]
+                    return self.dataset[measure_var][index[0, 0]]
                 else:
                     # return a NaN in an xr.Dataset
                     # The rather odd trailing zero is to remove the array layer
@@ -559,22 +661,154 @@ class TIDEGAUGE():
                     # alternative for a return object
                     return xr.DataArray([np.NaN], dims=(time_var), coords={time_var: [time_guess]})[0]
             else: # give the closest without window search truncation
-                return self.dataset[measure_var][index[0]]
+                return self.dataset[measure_var][index[0, 0]]
 
         elif method == 'nearest_2':
-            index = np.argsort(np.abs(self.dataset[time_var] - time_guess)).values
-            nearest_2 =  self.dataset[measure_var][ index[0:1+1] ] #, self.dataset.time[index[0:1+1]]
+            index, _ = self._tidetable_nearest(time_guess, time_var)
+            # Drop missing events (-1), which would index the last event
+            index = index[0][index[0] >= 0]
+            nearest_2 =  self.dataset[measure_var][ index ] #, self.dataset.time[index[0:1+1]]
             return nearest_2
 
         elif method == 'nearest_HW':
-            index = np.argsort(np.abs(self.dataset[time_var] - time_guess)).values
-            #return self.dataset.sea_level[ index[np.argmax( self.dataset.sea_level[index[0:1+1]]] )] #, self.dataset.time[index[0:1+1]]
-            nearest_2 =  self.dataset[measure_var][index[0:1+1]] #, self.dataset.time[index[0:1+1]]
+            index, _ = self._tidetable_nearest(time_guess, time_var)
+            index = index[0][index[0] >= 0]
+            nearest_2 =  self.dataset[measure_var][index] #, self.dataset.time[index[0:1+1]]
             return nearest_2[ nearest_2.argmax() ]
 
         else:
             print('Not expecting that option / method')
 
+    def get_tidetabletimes_many(self, time_guesses,
+                                time_var:str='time',
+                                measure_var:str='sea_level',
+                                method: str='window', winsize=None):
+        """
+        Batched version of get_tidetabletimes(). Looks up an array of guess
+        times against the tide table in one vectorised call, with the same
+        methods and semantics.
+
+        input:
+        time_guesses : array of np.datetime64 (or convertible), assumes utc
+        time_var, measure_var, method, winsize : as get_tidetabletimes()
+
+        returns: xr.DataArray( measure_var ) with dimension guess_dim and
+            coordinate time_guess.
+            nearest_1, nearest_HW: one event per guess. Where no event is
+                found (nearest_1 outside winsize) the value is NaN and the
+                time is the guess time, as in get_tidetabletimes().
+            nearest_2, window: an extra dimension event_dim. nearest_2 has
+                the nearest event first. window is padded with NaN values
+                and NaT times after the last event in each window.
+        """
+        time_guesses = np.atleast_1d(np.asarray(time_guesses, 
+                                                dtype='datetime64[ns]'))
+        values = self.dataset[measure_var].values
+        times = self.dataset[time_var].values
+
+        if method == 'window':
+            if winsize==None: winsize=2
+            start, end = self._tidetable_window(time_guesses, time_var, 
+                                                winsize)
+            order = self._tidetable_index(time_var)[1]
+            counts = end - start
+            n_events = max(int(counts.max(initial=0)), 1)
+            index = start[:, np.newaxis] + np.arange(n_events)
+            found = np.arange(n_events) < counts[:, np.newaxis]
+            index = order[np.where(found, index, 0)] if len(order) > 0 \
+                        else np.zeros(index.shape, dtype=int)
+            dims = ('guess_dim', 'event_dim')
+
+        elif method in ['nearest_1', 'nearest_2', 'nearest_HW']:
+            index, dt = self._tidetable_nearest(time_guesses, time_var)
+            found = index >= 0
+            if method == 'nearest_1':
+                index, found = index[:, 0], found[:, 0]
+                if winsize is not None:
+                    dt_minutes = dt[:, 0] // np.timedelta64(1, 'm')
+                    found = found & (dt_minutes <= 60*winsize)
+                dims = ('guess_dim',)
+            elif method == 'nearest_2':
+                dims = ('guess_dim', 'event_dim')
+            else:
+                heights = np.where(found, values[index], -np.inf)
+                highest = np.argmax(heights, axis=1)[:, np.newaxis]
+                index = np.take_along_axis(index, highest, axis=1)[:, 0]
+                found = np.take_along_axis(found, highest, axis=1)[:, 0]
+                dims = ('guess_dim',)
+
+        else:
+            print('Not expecting that option / method')
+            return
+
+        index = np.where(found, index, 0)
+        if len(values) > 0:
+            event_values = np.where(found, values[index], np.nan)
+            event_times = np.where(found, times[index], np.datetime64('NaT'))
+        else:
+            event_values = np.full(index.shape, np.nan)
+            event_times = np.full(index.shape, np.datetime64('NaT', 'ns'))
+        if method == 'nearest_1':
+            event_times = np.where(found, event_times, time_guesses)
+
+        return xr.DataArray(event_values, dims=dims, name=measure_var,
+                            coords={time_var:(dims, event_times),
+                                    'time_guess':('guess_dim', time_guesses)})
+
+    def _tidetable_index(self, time_var='time'):
+        '''
+        Sorted tide table times and the order that sorts them. Cached against
+        the time variable so that repeated lookups do not re-sort; the index
+        is rebuilt if the dataset or its time variable is replaced.
+        '''
+        variable = self.dataset.variables[time_var]
+        cache = getattr(self, '_tidetable_cache', {})
+        if time_var not in cache or cache[time_var][0] is not variable:
+            times = variable.values
+            order = np.argsort(times, kind='stable')
+            cache[time_var] = (variable, times[order], order)
+            self._tidetable_cache = cache
+        return cache[time_var][1:]
+
+    def _tidetable_window(self, time_guesses, time_var, winsize):
+        '''
+        Start and end (exclusive) positions in the sorted tide table of the
+        events within +/- winsize hours of each guess.
+        '''
+        sorted_times, _ = self._tidetable_index(time_var)
+        time_guesses = np.atleast_1d(time_guesses)
+        window = np.timedelta64(winsize, 'h')
+        start = np.searchsorted(sorted_times, time_guesses - window, 'left')
+        end = np.searchsorted(sorted_times, time_guesses + window, 'right')
+        return start, end
+
+    def _tidetable_nearest(self, time_guesses, time_var):
+        '''
+        Indices into the tide table of the two events nearest each guess, 
+        nearest first, and their absolute time differences. Both are arrays
+        of shape (n_guesses, 2). Index is -1 if the table has too few events.
+        The nearest events are neighbours of the guess in the sorted table,
+        so only four candidates per guess are compared.
+        '''
+        sorted_times, order = self._tidetable_index(time_var)
+        time_guesses = np.atleast_1d(time_guesses)
+        n_times = len(sorted_times)
+        position = np.searchsorted(sorted_times, time_guesses)
+        candidates = position[:, np.newaxis] + np.arange(-2, 2)
+        valid = (candidates >= 0) & (candidates < n_times)
+        candidates = np.clip(candidates, 0, max(n_times - 1, 0))
+        if n_times > 0:
+            dt = np.abs(sorted_times[candidates] - time_guesses[:, np.newaxis])
+        else:
+            dt = np.zeros(candidates.shape, dtype='timedelta64[ns]')
+        dt = np.where(valid, dt, np.timedelta64('NaT'))
+        # NaT sorts last, ties go to the earlier event
+        rank = np.argsort(dt, axis=1, kind='stable')[:, :2]
+        index = np.take_along_axis(candidates, rank, axis=1)
+        dt = np.take_along_axis(dt, rank, axis=1)
+        index = np.where(np.isnat(dt), -1, order[index] if n_times > 0 else -1)
+        return index, dt
+
 
 ############ environment.data.gov.uk gauge methods ###########################
     @classmethod
@@ -582,7 +816,8 @@ class TIDEGAUGE():
                                 ndays: int=5,
                                 date_start: np.datetime64=None,
                                 date_end: np.datetime64=None,
-                                stationId='E70124'):
+                                stationId='E70124',
+                                client=None):
         """
         load gauge data via environment.data.gov.uk EA API
         Either loads last ndays, or from date_start:date_end
@@ -601,82 +836,76 @@ class TIDEGAUGE():
             date_end : datetime
             stationId : int. Station id. Also referred to as stationReference in
              EA API. Default value is for Liverpool.
+            client : ea_util.EAClient. Reuse a client (pooled session, disk
+             cache) across calls. A new client is made if None.
         OUTPUT:
             sea_level, time : xr.Dataset
         """
-        import requests,json
+        import requests
+        if client is None:
+            client = ea_util.EAClient()
 
-        cls.ndays=ndays
-        cls.date_start=date_start
-        cls.date_end=date_end
-        cls.stationId=stationId # EA id: stationReference
+        if (date_start is not None or date_end is not None) and \
+            not ((type(date_start) is np.datetime64) & (type(date_end) is np.datetime64)):
+            debug('Expecting date_start and date_end as datetime objects')
+            date_start, date_end = None, None
 
-        #%% Obtain and process header information
-        info("load station info")
-        url = 'https://environment.data.gov.uk/flood-monitoring/id/stations/'+cls.stationId+'.json'
+        #%% Obtain header information and data
+        info(f"load station info and data for {stationId}")
         try:
-            request_raw = requests.get(url)
-            header_dict = json.loads(request_raw.content)
-        except ValueError:
-            print(f"Failed request for station {cls.stationId}")
+            header_dict = client.get_station(stationId)
+            time, sea_level = client.get_readings(stationId, date_start, 
+                                                  date_end, ndays, 
+                                                  station=header_dict)
+        except (requests.RequestException, ValueError, KeyError) as err:
+            error(f"Failed request for station {stationId}: {err}")
             return
 
+        return cls._EA_to_xarray(header_dict, time, sea_level)
+
+    @classmethod
+    def read_EA_API_multiple(cls, stationIds, ndays: int=5,
+                             date_start: np.datetime64=None,
+                             date_end: np.datetime64=None, client=None):
+        """
+        As read_EA_API_to_xarray() for many stations, fetched concurrently
+        over one pooled session. Stations that fail are left out.
+
+        INPUTS:
+            stationIds : list of str. EA stationReference of each gauge.
+            ndays, date_start, date_end, client : see read_EA_API_to_xarray()
+        OUTPUT:
+            List of TIDEGAUGE objects, in the order of stationIds
+        """
+        if client is None:
+            client = ea_util.EAClient()
+        readings = client.get_many(stationIds, date_start, date_end, ndays)
+        tidegauge_list = []
+        for stationId in stationIds:
+            if stationId in readings:
+                new_object = TIDEGAUGE()
+                new_object.dataset = cls._EA_to_xarray(*readings[stationId])
+                tidegauge_list.append(new_object)
+        return tidegauge_list
+
+    @staticmethod
+    def _EA_to_xarray(header_dict, time, sea_level):
+        '''
+        Dataset of EA readings with the station information as attributes.
+        '''
         try:
             header_dict['site_name'] = header_dict['items']['label']
             header_dict['latitude'] = header_dict['items']['lat']
             header_dict['longitude'] = header_dict['items']['long']
         except:
             info(f"possible missing some header info: site_name,latitude,longitude")
-        try:
-            # Define url call with parameter from station info
-            htmlcall_stationId = header_dict['items']['measures']['@id']+'/readings?'
-        except:
-            debug(f"problem defining the parameter to read")
-
-        #%% Construct API request for data recovery
-        info("load station data")
-        if (cls.date_start == None) & (cls.date_end == None):
-            info(f"GETting ndays= {cls.ndays} of data")
-            url  = htmlcall_stationId+'since='+ \
-            (np.datetime64('now')-np.timedelta64(ndays,'D')).item().strftime('%Y-%m-%dT%H:%M:%SZ')
-            debug(f"url request: {url}")
-        else:
-            # Check date_start and date_end are timetime objects
-            if (type(cls.date_start) is np.datetime64) & (type(cls.date_end) is np.datetime64):
-                info(f"GETting data from {cls.date_start} to {cls.date_end}")
-                startdate = cls.date_start.item().strftime('%Y-%m-%d')
-                enddate = cls.date_end.item().strftime('%Y-%m-%d')
-                url   = htmlcall_stationId+'startdate='+startdate+'&enddate='+enddate
-                debug(f"url request: {url}")
-
-            else:
-                debug('Expecting date_start and date_end as datetime objects')
-
-        #%% Get the data
-        try:
-            request_raw = requests.get(url)
-            request = json.loads(request_raw.content)
-            debug(f"EA API request: {request_raw.text}")
-        except ValueError:
-            debug(f"Failed request: {request_raw}")
-            return
-
-        #%% Process timeseries data
-        dataset = xr.Dataset()
-        time = []
-        sea_level = []
-        nvals = len(request['items'])
-        time = np.array([np.datetime64(request['items'][i]['dateTime']) for i in range(nvals)])
-        sea_level = np.array([request['items'][i]['value'] for i in range(nvals)])
 
         #%% Assign arrays to Dataset
+        dataset = xr.Dataset()
         dataset['sea_level'] = xr.DataArray(sea_level, dims=['time'])
         dataset = dataset.assign_coords(time = ('time', time))
         dataset.attrs = header_dict
         debug(f"EA API request headers: {header_dict}")
-        #debug(f"EA API request 1st time: {time[0]} and value: {sea_level[0]}")
-
-        # Assign local dataset to object-scope dataset
         return dataset
 
 ############ BODC tide gauge methods ##############################################
@@ -724,8 +953,11 @@ class TIDEGAUGE():
         '''
         debug(f"Reading \"{fn_bodc}\" as a BODC file with {get_slug(cls)}")  # TODO Maybe include start/end dates
         try:
-            header_dict = cls.read_bodc_header(fn_bodc)
-            dataset = cls.read_bodc_data(fn_bodc, date_start, date_end)
+            header_dict, dataset = cls._read_with_cache(fn_bodc, 'bodc',
+                cls.read_bodc_header,
+                lambda header_dict, date0, date1:
+                    cls.read_bodc_data(fn_bodc, date0, date1),
+                date_start, date_end)
         except:
             raise Exception('Problem reading BODC file: ' + fn_bodc)
         # Attributes
@@ -766,8 +998,8 @@ class TIDEGAUGE():
                 header_dict[key] = val
                 debug(f"Header key: {key} and value: {val}")
             else:
-                #print('No colon')
-                header = False
+                # End of header, no need to read the data lines
+                break
         header_dict['site_name'] = header_dict['site'] # duplicate as standard name
         debug(f"Read done, close file \"{fn_bodc}\"")
         fid.close()
@@ -794,68 +1026,43 @@ class TIDEGAUGE():
         -------
         xarray.Dataset containing times, sealevel and quality control flags
         '''
-        # Initialise empty dataset and lists
         debug(f"Reading BODC data from \"{fn_bodc}\"")
-        dataset = xr.Dataset()
-        time = []
-        sea_level = []
-        qc_flags = []
-        residual = []
-        # Open file and loop until EOF
-        with open(fn_bodc) as file:
-            line_count = 1
-            for line in file:
-                # Read all data. Date boundaries are set later.
-                if line_count>header_length:
-                    try:
-                        working_line = line.split()
-                        time_str = working_line[1] + ' ' + working_line[2] # Empty lines cause trouble
-                        sea_level_str = working_line[3]
-                        residual_str = working_line[4]
-                        if sea_level_str[-1].isalpha():
-                            qc_flag_str = sea_level_str[-1]
-                            sea_level_str = sea_level_str.replace(qc_flag_str,'')
-                            residual_str = residual_str.replace(qc_flag_str,'')
-                        elif residual_str[-1].isalpha(): # sometimes residual has a
-                            #flag when elevation does not
-                            qc_flag_str = residual_str[-1]
-                            sea_level_str = sea_level_str.replace(qc_flag_str,'')
-                            residual_str = residual_str.replace(qc_flag_str,'')
-                        else:
-                            qc_flag_str = ''
-                        #print(line_count-header_length, residual_str, float(residual_str))
-                        #print(working_line, sea_level_str, qc_flag_str)
-                        time.append(time_str)
-                        qc_flags.append(qc_flag_str)
-                        sea_level.append(float(sea_level_str))
-                        residual.append(float(residual_str))
-                    except:
-                        debug(f"{file} probably empty line at end. Breaks split()")
-                line_count = line_count + 1
-            debug(f"Read done, close file \"{fn_bodc}\"")
+        # Read all data columns in one pass. Date boundaries are set later.
+        columns = _read_bodc_fixed_width(fn_bodc, header_length)
+        if columns is None:
+            debug("Not a fixed width layout, splitting lines on whitespace")
+            columns = _read_bodc_columns(fn_bodc, header_length)
+        dates, times, sea_level_str, residual_str = columns
+
+        # QC flags are a letter after the elevation or, sometimes, only
+        # after the residual
+        sea_level, sea_level_flag = _split_bodc_flags(sea_level_str)
+        residual, residual_flag = _split_bodc_flags(residual_str)
+        qc_flags = np.where(sea_level_flag != b'', sea_level_flag, 
+                            residual_flag).astype(str)
+        time = _parse_bodc_times(dates, times)
+        valid = ~np.isnan(sea_level) & ~np.isnan(residual) & ~np.isnat(time)
+        debug(f"Read done, close file \"{fn_bodc}\"")
 
-        # Convert time list to datetimes using pandas
-        time = np.array(pd.to_datetime(time))
+        time = time[valid]
+        sea_level = sea_level[valid]
+        qc_flags = qc_flags[valid]
 
         # Return only values between stated dates
         start_index = 0
         end_index = len(time)
         if date_start is not None:
             date_start = np.datetime64(date_start)
-            start_index = np.argmax(time>=date_start)
+            start_index = np.searchsorted(time, date_start, side='left')
         if date_end is not None:
             date_end = np.datetime64(date_end)
-            end_index = np.argmax(time>date_end)
+            end_index = np.searchsorted(time, date_end, side='right')
         time = time[start_index:end_index]
         sea_level = sea_level[start_index:end_index]
-        qc_flags=qc_flags[start_index:end_index]
-
-        # Set null values to nan
-        sea_level = np.array(sea_level)
-        qc_flags = np.array(qc_flags)
-        #sea_level[qc_flags==5] = np.nan
+        qc_flags = qc_flags[start_index:end_index]
 
         # Assign arrays to Dataset
+        dataset = xr.Dataset()
         dataset['sea_level'] = xr.DataArray(sea_level, dims=['time'])
         dataset['qc_flags'] = xr.DataArray(qc_flags, dims=['time'])
         dataset = dataset.assign_coords(time = ('time', time))
@@ -1278,3 +1485,198 @@ class TIDEGAUGE():
         new_object.dataset = new_dataset
 
         return new_object
+
+
+
+def _read_bodc_fixed_width(fn_bodc, header_length):
+    '''
+    Reads the date, time, elevation and residual columns of a BODC file as
+    byte strings by slicing a (lines x characters) array at fixed column
+    positions, found from the first data line. Elevation and residual keep
+    any trailing flag letter. Returns None if the lines do not all share
+    the layout of the first line (e.g. blank lines within the data), in
+    which case _read_bodc_columns() should be used.
+    '''
+    with open(fn_bodc, 'rb') as file:
+        lines = file.read().splitlines()[header_length:]
+    while len(lines) > 0 and lines[-1].strip() == b'':
+        lines.pop()
+    if len(lines) == 0:
+        return None
+    match = re.match(rb'\s*\d+\)\s+(\d{4}/\d\d/\d\d)\s+(\d\d:\d\d:\d\d)'
+                     rb'\s+(-?\d*\.\d+)[A-Za-z]?\s+(-?\d*\.\d+)[A-Za-z]?\s*$', 
+                     lines[0])
+    if match is None:
+        return None
+
+    # Numbers are right aligned, so the decimal points and the flag
+    # letters that follow the numbers are in fixed columns
+    date_col, time_col = match.start(1), match.start(2)
+    sea_level_end, residual_end = match.end(3), match.end(4)
+    sea_level_dot = match.start(3) + match.group(3).index(b'.')
+    residual_dot = match.start(4) + match.group(4).index(b'.')
+
+    lines = np.array(lines)
+    width = max(lines.dtype.itemsize, residual_end + 1)
+    chars = np.zeros((len(lines), width), dtype=np.uint8)
+    chars[:, :lines.dtype.itemsize] = \
+        lines.view(np.uint8).reshape((len(lines), -1))
+    layout = (np.all(chars[:, [date_col + 4, date_col + 7]] == ord('/'))
+              and np.all(chars[:, [time_col + 2, time_col + 5]] == ord(':'))
+              and np.all(chars[:, [sea_level_dot, residual_dot]] == ord('.')))
+    if not layout:
+        return None
+
+    def column(first, last):
+        block = np.ascontiguousarray(chars[:, first:last])
+        return block.view(f'S{last - first}').ravel()
+
+    return (column(date_col, date_col + 10),
+            column(time_col, time_col + 8),
+            column(time_col + 8, sea_level_end + 1),
+            column(sea_level_end + 1, residual_end + 1))
+
+
+def _read_bodc_columns(fn_bodc, header_length):
+    '''
+    As _read_bodc_fixed_width() but splits lines on whitespace, so the
+    columns need not be aligned. Lines without all five columns (e.g.
+    empty lines) give b'nan' entries.
+    '''
+    data = pd.read_csv(fn_bodc, skiprows=header_length, sep=r'\s+',
+                       header=None, usecols=[1, 2, 3, 4], dtype=str,
+                       names=['cycle', 'date', 'time', 'sea_level', 
+                              'residual'],
+                       on_bad_lines='skip')
+    return tuple(data[key].values.astype('S16') for key in 
+                 ['date', 'time', 'sea_level', 'residual'])
+
+
+def _split_bodc_flags(strings):
+    '''
+    Splits BODC byte strings such as b'5.354M' into floats and single
+    letter QC flags (b'' where there is no flag). Works on the bytes of all
+    strings at once rather than string by string. Strings that are not
+    numbers once the flag is removed become NaN.
+    '''
+    values = np.array(strings)
+    n_values, width = len(values), values.dtype.itemsize
+    chars = values.view(np.uint8).reshape((n_values, width))
+    rows = np.arange(n_values)
+    last = np.maximum(width - 1 - np.argmax(chars[:, ::-1] > 32, axis=1), 0)
+    last_char = chars[rows, last]
+    lower = last_char | 32
+    is_flag = (lower >= ord('a')) & (lower <= ord('z')) & (values != b'nan')
+    flags = np.where(is_flag, last_char, 0).astype(np.uint8).view('S1')
+    chars[rows[is_flag], last[is_flag]] = ord(' ')
+    try:
+        numbers = values.astype(float)
+    except ValueError:
+        numbers = pd.to_numeric(np.char.decode(values), errors='coerce')
+    return np.asarray(numbers, dtype=float), flags
+
+
+def _parse_bodc_times(dates, times):
+    '''
+    Converts BODC date (b'yyyy/mm/dd') and time (b'hh:mi:ss') byte strings
+    to datetime64[ns]. The digits are read straight from the bytes of all
+    strings at once. If any string does not have this layout, falls back
+    to pd.to_datetime with an explicit format, giving NaT where parsing
+    fails.
+    '''
+    dates = np.asarray(dates).astype('S10')
+    times = np.asarray(times).astype('S8')
+    date_chars = dates.view(np.uint8).reshape((-1, 10)).astype(np.int64) - 48
+    time_chars = times.view(np.uint8).reshape((-1, 8)).astype(np.int64) - 48
+    digits = np.concatenate([date_chars[:, [0, 1, 2, 3, 5, 6, 8, 9]], 
+                             time_chars[:, [0, 1, 3, 4, 6, 7]]], axis=1)
+    layout = (np.all((digits >= 0) & (digits <= 9))
+              and np.all(date_chars[:, [4, 7]] == ord('/') - 48)
+              and np.all(time_chars[:, [2, 5]] == ord(':') - 48))
+    if not layout:
+        strings = pd.Series(np.char.decode(dates)) + ' ' \
+                  + np.char.decode(times)
+        return pd.to_datetime(strings, format='%Y/%m/%d %H:%M:%S', 
+                              errors='coerce').values
+
+    # Pairs of digits: century, year, month, day, hour, minute, second
+    pairs = digits[:, 0::2]*10 + digits[:, 1::2]
+    year = pairs[:, 0]*100 + pairs[:, 1]
+    months = (year - 1970)*12 + pairs[:, 2] - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]') \
+           + (pairs[:, 3] - 1).astype('timedelta64[D]')
+    seconds = pairs[:, 4]*3600 + pairs[:, 5]*60 + pairs[:, 6]
+    return days.astype('datetime64[ns]') + seconds.astype('timedelta64[s]')
+
+
+def _cache_entry(cache_dir, filename, kind):
+    '''
+    Cache directory for a file, keyed by reader kind, absolute path, size
+    and modification time, so a changed file gets a new entry.
+    '''
+    stat = os.stat(filename)
+    key = f"{kind}|{os.path.abspath(filename)}|{stat.st_size}|{stat.st_mtime_ns}"
+    name = os.path.basename(filename) + '_' \
+           + hashlib.sha1(key.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, name)
+
+
+def _store_columns(dn_entry, header_dict, dataset):
+    '''
+    Stores the header as JSON and each time-dimension variable of a
+    dataset (and time itself) as a .npy file in dn_entry. Written to a
+    temporary directory first, so readers never see a partial entry.
+    '''
+    os.makedirs(os.path.dirname(dn_entry) or '.', exist_ok=True)
+    dn_tmp = f"{dn_entry}.tmp{os.getpid()}"
+    os.makedirs(dn_tmp, exist_ok=True)
+    header = {key:({'timestamp':value.isoformat()} 
+                   if isinstance(value, (pd.Timestamp, np.datetime64)) 
+                   else value.item() if isinstance(value, np.generic) 
+                   else value)
+              for key, value in header_dict.items()}
+    with open(os.path.join(dn_tmp, 'header.json'), 'w') as file:
+        json.dump({'header':header, 'variables':list(dataset.data_vars)}, 
+                  file)
+    np.save(os.path.join(dn_tmp, 'time.npy'), 
+            dataset.time.values.astype('datetime64[ns]'))
+    for name, variable in dataset.data_vars.items():
+        np.save(os.path.join(dn_tmp, name + '.npy'), variable.values)
+    try:
+        os.rename(dn_tmp, dn_entry)
+    except OSError:
+        # Another process stored the same entry first
+        for fn in os.listdir(dn_tmp):
+            os.remove(os.path.join(dn_tmp, fn))
+        os.rmdir(dn_tmp)
+
+
+def _load_columns(dn_entry, date_start=None, date_end=None):
+    '''
+    Loads a cache entry written by _store_columns(). Columns are memory
+    mapped and only the rows between date_start and date_end (inclusive,
+    found by binary search on time) are read.
+    '''
+    with open(os.path.join(dn_entry, 'header.json')) as file:
+        contents = json.load(file)
+    header_dict = {key:(pd.Timestamp(value['timestamp']) 
+                        if isinstance(value, dict) and 'timestamp' in value 
+                        else value)
+                   for key, value in contents['header'].items()}
+
+    time = np.load(os.path.join(dn_entry, 'time.npy'), mmap_mode='r')
+    start_index = 0
+    end_index = len(time)
+    if date_start is not None:
+        start_index = np.searchsorted(time, np.datetime64(date_start), 'left')
+    if date_end is not None:
+        end_index = np.searchsorted(time, np.datetime64(date_end), 'right')
+
+    dataset = xr.Dataset()
+    for name in contents['variables']:
+        column = np.load(os.path.join(dn_entry, name + '.npy'), mmap_mode='r')
+        dataset[name] = xr.DataArray(np.array(column[start_index:end_index]),
+                                     dims=['time'])
+    dataset = dataset.assign_coords(time = ('time', 
+                                    np.array(time[start_index:end_index])))
+    return header_dict, dataset
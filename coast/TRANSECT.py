@@ -1,5 +1,6 @@
 from .COAsT import COAsT
 from .NEMO import NEMO
+from . import section_util
 from scipy.ndimage import convolve1d
 from scipy import interpolate
 import gsw
@@ -71,19 +72,11 @@ class Transect:
         ----------
         max_depth : int, bottom level depth 
         '''
-        
-        max_depth = max_depth + 650
-        z_levels_0_50 = np.arange(0,55,5)
-        z_levels_60_290 = np.arange(60,300,10)
-        z_levels_300_600 = np.arange(300,650,50)
-        z_levels_650_ = np.arange(650,max_depth+150,150)
-        z_levels = np.concatenate( (z_levels_0_50, z_levels_60_290, 
-                                    z_levels_300_600, z_levels_650_) )
-        z_levels = z_levels[z_levels <= max_depth] 
-        return z_levels
+        return section_util.gen_z_levels(max_depth)
     
     
-    def __init__(self, nemo: COAsT, point_A: tuple=None, point_B: tuple=None, y_indices=None, x_indices=None):
+    def __init__(self, nemo: COAsT, point_A: tuple=None, point_B: tuple=None, y_indices=None, x_indices=None,
+                 waypoints=None, great_circle=False, spacing=None):
         '''
         Class defining a generic transect type, which is a 3d dataset along 
         a linear path between a point A and a point B, with a time dimension,
@@ -93,16 +86,25 @@ class Transect:
         Note that Point A should be closer to the southern boundary of the model domain.
         
         The user can either supply the start and end (lat,lon) coordinates of the
-        transect, point_A and point_B respectively, or the model y, x indices defining it.
+        transect, point_A and point_B respectively, a list of (lat,lon) waypoints,
+        or the model y, x indices defining it.
         In the latter case the user must ensure that the indices define a continuous
         transect, e.g. y=[10,11,11,12], x=[5,5,6,6].
         Only limited checks are performed on the suitability of the indices.
         
+        Between points or waypoints the transect is a straight line in index space,
+        or follows the great circle if great_circle is True. All the points are
+        found on the grid with one batched query of the grid index (NEMO.grid_index).
+        
         Example usage:
             point_A = (54,-15)
             point_B = (56,-12)
             transect = coast.Transect( nemo_t, point_A, point_B )
             or 
+            transect = coast.Transect( nemo_t, waypoints=[(54,-15), (55,-14), (56,-12)] )
+            or 
+            transect = coast.Transect( nemo_t, point_A, point_B, great_circle=True )
+            or 
             transect = coast.Transect( nemo_f, y_indices=y_ind, x_indices=x_ind )
             
         Parameters
@@ -112,6 +114,11 @@ class Transect:
         point_B : tuple, (lat,lon)
         y_indices : 1d array of model y indices defining the points of the transect 
         x_indices : 1d array of model x indices defining the points of the transect 
+        waypoints : list of (lat,lon) tuples, the transect passes through each in turn
+        great_circle : boolean, default False. If True follow great circles 
+            between the points
+        spacing : (optional) distance (km) between the points sampled along great
+            circles. Default is half the median grid spacing.
 
         '''
         debug(f"Creating a new {get_slug(self)}")
@@ -121,26 +128,32 @@ class Transect:
             if point_A is not None and point_B is not None:
                 # point A should be of lower latitude than point B
                 if abs(point_B[0]) < abs(point_A[0]):
-                    self.point_A = point_B
-                    self.point_B = point_A
-                else:
-                    self.point_A = point_A
-                    self.point_B = point_B
-                   
+                    point_A, point_B = point_B, point_A
+                waypoints = [point_A, point_B]
+                
+            if waypoints is not None:
                 # Get points on transect    
-                tran_y_ind, tran_x_ind, tran_len = nemo.transect_indices(self.point_A, self.point_B)
-                tran_y_ind, tran_x_ind = self.process_transect_indices( nemo, \
-                                        np.asarray(tran_y_ind), np.asarray(tran_x_ind) )
+                lat, lon = np.asarray(waypoints, dtype=float).T
+                if great_circle:
+                    if spacing is None:
+                        spacing = 0.5 * np.nanmedian( np.concatenate( (nemo.dataset.e1.values.ravel(),
+                                                nemo.dataset.e2.values.ravel()) ) ) / 1000.
+                    lat, lon = section_util.great_circle_points( lat, lon, spacing )
+                y_points, x_points = nemo.find_j_i_list( lat, lon )
+                tran_y_ind, tran_x_ind = section_util.polyline_indices( y_points, x_points )
+                if point_A is None and tran_y_ind[0] > tran_y_ind[-1]:
+                    waypoints = waypoints[::-1]
+                    tran_y_ind = tran_y_ind[::-1]
+                    tran_x_ind = tran_x_ind[::-1]
+                point_A = tuple(waypoints[0])
+                point_B = tuple(waypoints[-1])
+                tran_y_ind, tran_x_ind = self.process_transect_indices( nemo, tran_y_ind, tran_x_ind )
             elif y_indices is not None and x_indices is not None:
                 if y_indices[0] > y_indices[-1]:
                     y_indices = y_indices[::-1]
                     x_indices = x_indices[::-1]
                 tran_y_ind, tran_x_ind = self.process_transect_indices( nemo, \
-                                        y_indices, x_indices )
-                self.point_A = (nemo.dataset.latitude[tran_y_ind[0],tran_x_ind[0]],
-                                nemo.dataset.longitude[tran_y_ind[0],tran_x_ind[0]])
-                self.point_B = (nemo.dataset.latitude[tran_y_ind[-1],tran_x_ind[-1]],
-                                nemo.dataset.longitude[tran_y_ind[-1],tran_x_ind[-1]])
+                                        np.asarray(y_indices), np.asarray(x_indices) )
             else:
                 raise ValueError("Must supply both point_A and point_B of transect \
                                  or the indices defining it.")
@@ -156,6 +169,13 @@ class Transect:
             da_tran_y_ind = xr.DataArray( tran_y_ind, dims=['r_dim'])
             da_tran_x_ind = xr.DataArray( tran_x_ind, dims=['r_dim'])
             self.data = nemo.dataset.isel(y_dim = da_tran_y_ind, x_dim = da_tran_x_ind)
+            
+            if waypoints is not None:
+                self.point_A = point_A
+                self.point_B = point_B
+            else:
+                self.point_A = (self.data.latitude[0], self.data.longitude[0])
+                self.point_B = (self.data.latitude[-1], self.data.longitude[-1])
     
             debug(f"{get_slug(self)} initialised")
         except ValueError:
@@ -179,23 +199,10 @@ class Transect:
         debug(f"Fetching transect indices for {get_slug(self)} with {get_slug(nemo)}")
         try:
             # Redefine transect so that each point on the transect is seperated
-            # from its neighbours by a single index change in y or x, but not both
-            dist_option_1 = nemo.dataset.e2.values[tran_y_ind, tran_x_ind] + nemo.dataset.e1.values[tran_y_ind+1, tran_x_ind]
-            dist_option_2 = nemo.dataset.e2.values[tran_y_ind, tran_x_ind+1] + nemo.dataset.e1.values[tran_y_ind, tran_x_ind]
-            spacing = np.abs( np.diff(tran_y_ind) ) + np.abs( np.diff(tran_x_ind) )
-            if spacing.max() > 2:
-                raise ValueError("The transect is not continuous. The transect must be defined on " 
-                                     "adjacent grid points.")
-            spacing[spacing!=2]=0
-            doublespacing = np.nonzero( spacing )[0]
-            for ispacing in doublespacing[::-1]:
-                if dist_option_1[ispacing] < dist_option_2[ispacing]:
-                    tran_y_ind = np.insert( tran_y_ind, ispacing+1, tran_y_ind[ispacing+1] )
-                    tran_x_ind = np.insert( tran_x_ind, ispacing+1, tran_x_ind[ispacing] )
-                else:
-                    tran_y_ind = np.insert( tran_y_ind, ispacing+1, tran_y_ind[ispacing] )
-                    tran_x_ind = np.insert( tran_x_ind, ispacing+1, tran_x_ind[ispacing+1] ) 
-            return tran_y_ind, tran_x_ind
+            # from its neighbours by a single index change in y or x, but not both,
+            # taking the shorter of the two routes around each diagonal step
+            rule = section_util.shortest_path_rule( nemo.dataset.e1.values, nemo.dataset.e2.values )
+            return section_util.four_connected( tran_y_ind, tran_x_ind, y_first=rule )
         except ValueError:
             print(traceback.format_exc())
         
@@ -260,9 +267,9 @@ class Transect_f(Transect):
     Note that Point A should be closer to the southern boundary of the model domain.
     
     The user can either supply the start and end (lat,lon) coordinates of the
-    transect, point_A and point_B respectively, or the model y, x indices defining it.
-    In the latter case the user must ensure that the indices define a continuous
-    transect, e.g. y=[10,11,11,12], x=[5,5,6,6].
+    transect, point_A and point_B respectively, a list of (lat,lon) waypoints, 
+    or the model y, x indices defining it. In the latter case the user must 
+    ensure that the indices define a continuous transect, e.g. y=[10,11,11,12], x=[5,5,6,6].
     Only limited checks are performed on the suitability of the indices.
     
     Example usage:
@@ -270,6 +277,9 @@ class Transect_f(Transect):
         point_B = (56,-12)
         transect = coast.Transect_f( nemo_f, point_A, point_B )
         or 
+        transect = coast.Transect_f( nemo_f, waypoints=[(54,-15), (55,-14), (56,-12)],
+                                     great_circle=True )
+        or 
         transect = coast.Transect_f( nemo_f, y_indices=y_ind, x_indices=x_ind )
         
     Parameters
@@ -279,17 +289,19 @@ class Transect_f(Transect):
     point_B : tuple, (lat,lon)
     y_indices : 1d array of model y indices defining the points of the transect 
     x_indices : 1d array of model x indices defining the points of the transect 
+    waypoints : list of (lat,lon) tuples, the transect passes through each in turn
+    great_circle : boolean, default False. If True follow great circles 
+        between the points
+    spacing : (optional) distance (km) between the points sampled along great circles
 
     '''
     
-    def __init__(self, nemo_f: COAsT, point_A: tuple=None, point_B: tuple=None, 
-                 y_indices=None, x_indices=None):
-        super().__init__(nemo_f, point_A, point_B, y_indices, x_indices)
+    def __init__(self, nemo_f: COAsT, point_A: tuple=None, point_B: tuple=None,
+                 y_indices=None, x_indices=None, waypoints=None, great_circle=False, spacing=None):
+        super().__init__(nemo_f, point_A, point_B, y_indices, x_indices, waypoints, great_circle, spacing)
         
         
-    def calc_flow_across_transect(self, nemo_u: COAsT, nemo_v: COAsT): 
-        #TODO the code here has become a little messy, could do with being 
-        # rewritten as in similar function in CONTOUR
+    def calc_flow_across_transect(self, nemo_u: COAsT, nemo_v: COAsT, time_chunk=None):
         """
     
         Computes the flow through the transect at each segment and creates a new 
@@ -306,130 +318,64 @@ class Transect_f(Transect):
         present in the nemo_u and nemo_v datasets they will be used, if they 
         are not then the initial cell thicknesses (e3_0) will be used.
         
+        The calculation is lazy: if the velocities are dask arrays (or 
+        time_chunk is given) the results are dask arrays with the same time 
+        chunks, which can be written to disk without loading the time series.
+        
         parameters
         ----------
         nemo_u : Nemo object on the u-grid containing the i-component velocities
         nemo_v : Nemo object on the v-gridc ontaining the j-component velocities
+        time_chunk : (optional) number of time steps in each dask chunk
         
         """
         debug(f"Computing flow across the transect for {get_slug(self)}")
         
-        # compute transports flag; set to false if suitable e3 not found
-        compute_transports = True
-                
-        # subset the u and v datasets 
-        da_y_ind = xr.DataArray( self.y_ind, dims=['r_dim'] )
-        da_x_ind = xr.DataArray( self.x_ind, dims=['r_dim'] )
-        u_ds = nemo_u.dataset.isel(y_dim = da_y_ind, x_dim = da_x_ind)
-        v_ds = nemo_v.dataset.isel(y_dim = da_y_ind, x_dim = da_x_ind)
+        # The u or v point normal to each segment, read with one isel on each grid
+        dy, dx, normal_point = section_util.segment_steps(self.y_ind, self.x_ind)
+        da_y_ind = xr.DataArray( self.y_ind[normal_point], dims=['r_dim'] )
+        da_x_ind = xr.DataArray( self.x_ind[normal_point], dims=['r_dim'] )
+        u_ds = nemo_u.dataset.reset_coords().isel(y_dim = da_y_ind, x_dim = da_x_ind)
+        v_ds = nemo_v.dataset.reset_coords().isel(y_dim = da_y_ind, x_dim = da_x_ind)
+        if time_chunk is not None:
+            u_ds = u_ds.chunk({'t_dim':time_chunk})
+            v_ds = v_ds.chunk({'t_dim':time_chunk})
         
         # use time varying if e3 is present, if not default to e3_0
-        if 'e3' not in u_ds.data_vars:
-            if 'e3_0' not in u_ds.data_vars:
-                warn("e3 not found, transports will not be calculated")
-                compute_transports = False
-            else:
-                u_ds['e3'] = u_ds.e3_0.broadcast_like(u_ds.u_velocity) 
-        if 'e3' not in v_ds.data_vars:
-            if 'e3_0' not in v_ds.data_vars:
-                warn("e3 not found, transports will not be calculated")
-                compute_transports = False
-            else:
-                v_ds['e3'] = v_ds.e3_0.broadcast_like(v_ds.v_velocity) 
-        
-        # If there is no time dimension, add one. This is so
-        # indexing can assume a time dimension exists
-        droptime=False
-        if 't_dim' not in u_ds.dims:
-            u_ds["u_velocity"] = u_ds.u_velocity.expand_dims(dim={'t_dim':1},axis=0)
-            if compute_transports:
-                u_ds["e3"] = u_ds.e3.expand_dims(dim={'t_dim':1},axis=0)
-            droptime=True
-        if 't_dim' not in v_ds.dims:
-            v_ds["v_velocity"] = v_ds.v_velocity.expand_dims(dim={'t_dim':1},axis=0)
-            if compute_transports:
-                v_ds["e3"] = v_ds.e3.expand_dims(dim={'t_dim':1},axis=0)
-        
-        velocity = np.ma.zeros( (u_ds.t_dim.size, u_ds.z_dim.size, u_ds.r_dim.size-1) )
-        vol_transport = np.ma.zeros( (u_ds.t_dim.size, u_ds.z_dim.size, u_ds.r_dim.size-1) )
-        depth_0 = np.ma.zeros( (u_ds.z_dim.size, u_ds.r_dim.size-1) )
-        latitude = np.ma.zeros( (u_ds.r_dim.size-1) )
-        longitude = np.ma.zeros( (u_ds.r_dim.size-1) )
-        e1 = np.ma.zeros( (u_ds.r_dim.size-1) )
-        e2 = np.ma.zeros( (u_ds.r_dim.size-1) )
-        e3 = np.ma.zeros( (u_ds.t_dim.size, u_ds.z_dim.size, u_ds.r_dim.size-1) )
-        
-        # Find the indices where the derivative of the transect in the north, south, east and west
-        # directions are positive.
-        dr_n = np.where(np.diff(self.y_ind)>0, np.arange(0,self.data.r_dim.size-1), np.nan )
-        dr_n = dr_n[~np.isnan(dr_n)].astype(int)
-        dr_e = np.where(np.diff(self.x_ind)>0, np.arange(0,self.data.r_dim.size-1), np.nan )
-        dr_e = dr_e[~np.isnan(dr_e)].astype(int)
-        dr_w = np.where(np.diff(self.x_ind)<0, np.arange(0,self.data.r_dim.size-1), np.nan )   
-        dr_w = dr_w[~np.isnan(dr_w)].astype(int)
-        
-        # u flux (+ in)
-        velocity[:,:,dr_n] = u_ds.u_velocity.to_masked_array()[:,:,dr_n+1]
-        if compute_transports:
-            vol_transport[:,:,dr_n] = ( velocity[:,:,dr_n] * u_ds.e2.to_masked_array()[dr_n+1] *
-                                          u_ds.e3.to_masked_array()[:,:,dr_n+1] )
-            e3[:,:,dr_n] = u_ds.e3.values[:,:,dr_n+1]
-        depth_0[:,dr_n] = u_ds.depth_0.to_masked_array()[:,dr_n+1]
-        latitude[dr_n] = u_ds.latitude.values[dr_n+1]
-        longitude[dr_n] = u_ds.longitude.values[dr_n+1]
-        e1[dr_n] = u_ds.e1.values[dr_n+1]
-        e2[dr_n] = u_ds.e2.values[dr_n+1]
-               
-        # v flux (- in) 
-        velocity[:,:,dr_e] = - v_ds.v_velocity.to_masked_array()[:,:,dr_e+1]
-        if compute_transports:
-            vol_transport[:,:,dr_e] = ( velocity[:,:,dr_e] * v_ds.e1.to_masked_array()[dr_e+1] *
-                                  v_ds.e3.to_masked_array()[:,:,dr_e+1] )
-            e3[:,:,dr_e] = v_ds.e3.values[:,:,dr_e+1]
-        depth_0[:,dr_e] = v_ds.depth_0.to_masked_array()[:,dr_e+1]
-        latitude[dr_e] = v_ds.latitude.values[dr_e+1]
-        longitude[dr_e] = v_ds.longitude.values[dr_e+1]
-        e1[dr_e] = v_ds.e1.values[dr_e+1]
-        e2[dr_e] = v_ds.e2.values[dr_e+1]
-               
-        # v flux (+ in)
-        velocity[:,:,dr_w] = v_ds.v_velocity.to_masked_array()[:,:,dr_w]
-        if compute_transports:
-            vol_transport[:,:,dr_w] = ( velocity[:,:,dr_w] * v_ds.e1.to_masked_array()[dr_w] *
-                                  v_ds.e3.to_masked_array()[:,:,dr_w] )
-            e3[:,:,dr_w] = v_ds.e3.values[:,:,dr_w]
-        depth_0[:,dr_w] = v_ds.depth_0.to_masked_array()[:,dr_w]
-        latitude[dr_w] = v_ds.latitude.values[dr_w]
-        longitude[dr_w] = v_ds.longitude.values[dr_w]
-        e1[dr_w] = v_ds.e1.values[dr_w]
-        e2[dr_w] = v_ds.e2.values[dr_w]
+        compute_transports = True
+        for ds in [u_ds, v_ds]:
+            if 'e3' not in ds.data_vars:
+                if 'e3_0' not in ds.data_vars:
+                    warn("e3 not found, transports will not be calculated")
+                    compute_transports = False
+                else:
+                    ds['e3'] = ds.e3_0
+        
+        # u flux (+ north, - south), v flux (- east, + west)
+        is_u = xr.DataArray( dy != 0, dims=['r_dim'] )
+        sign = xr.DataArray( np.where(dy != 0, np.sign(dy), -np.sign(dx)), dims=['r_dim'] )
+        velocity = ( sign * xr.where( is_u, u_ds.u_velocity, v_ds.v_velocity ) 
+                    ).transpose(..., 'z_dim', 'r_dim')
+        depth_0 = xr.where( is_u, u_ds.depth_0, v_ds.depth_0 ).transpose('z_dim', 'r_dim').values
+        latitude = xr.where( is_u, u_ds.latitude, v_ds.latitude ).values
+        longitude = xr.where( is_u, u_ds.longitude, v_ds.longitude ).values
+        e1 = xr.where( is_u, u_ds.e1, v_ds.e1 )
+        e2 = xr.where( is_u, u_ds.e2, v_ds.e2 )
                    
         # Add DataArrays to dataset 
-        if droptime:
-            self.data_cross_tran_flow['normal_velocities'] = xr.DataArray( velocity.squeeze(), 
-                    coords={'depth_0': (('z_dim','r_dim'), depth_0) 
-                            ,'latitude': (('r_dim'), latitude), 'longitude': (('r_dim'), longitude) },
-                    dims=['z_dim', 'r_dim'] ) 
-            if compute_transports:
-                self.data_cross_tran_flow['normal_transports'] \
-                    = xr.DataArray( np.sum(vol_transport.squeeze(), axis=0) / 1000000., \
-                    coords={'latitude': (('r_dim'), latitude), 'longitude': (('r_dim'), longitude)},\
-                    dims=['r_dim'] ).squeeze() 
-        else:
-            self.data_cross_tran_flow['normal_velocities'] = xr.DataArray( velocity, 
-                        coords={'time': (('t_dim'), u_ds.time.values),'depth_0': (('z_dim','r_dim'), depth_0)
-                                ,'latitude': (('r_dim'), latitude), 'longitude': (('r_dim'), longitude) },
-                        dims=['t_dim', 'z_dim', 'r_dim'] )   
-            if compute_transports:
-                self.data_cross_tran_flow['normal_transports'] \
-                        = xr.DataArray( np.sum(vol_transport, axis=1) / 1000000.,
-                        coords={'time': (('t_dim'), u_ds.time.values)
-                                ,'latitude': (('r_dim'), latitude), 'longitude': (('r_dim'), longitude)},
-                        dims=['t_dim', 'r_dim'] ).squeeze()          
-        self.data_cross_tran_flow['e1'] = xr.DataArray( e1, dims=['r_dim'] ) 
-        self.data_cross_tran_flow['e2'] = xr.DataArray( e2, dims=['r_dim'] ) 
+        coords = {'depth_0': (('z_dim','r_dim'), depth_0), 
+                  'latitude': (('r_dim'), latitude), 'longitude': (('r_dim'), longitude)}
+        if 't_dim' in velocity.dims and 'time' in u_ds:
+            coords['time'] = (('t_dim'), u_ds.time.values)
+        self.data_cross_tran_flow['normal_velocities'] = velocity.assign_coords(coords)
         if compute_transports:
-            self.data_cross_tran_flow['e3'] = xr.DataArray( e3, dims=['t_dim','z_dim','r_dim'] ) 
+            e3 = xr.where( is_u, u_ds.e3, v_ds.e3 ).broadcast_like(velocity).transpose(*velocity.dims)
+            e_horiz = xr.where( is_u, e2, e1 )
+            self.data_cross_tran_flow['normal_transports'] = ( (velocity * e_horiz * e3)
+                        .sum(dim='z_dim', min_count=1) / 1000000. )
+            self.data_cross_tran_flow['e3'] = e3
+        self.data_cross_tran_flow['e1'] = e1
+        self.data_cross_tran_flow['e2'] = e2
         # DataArray attributes   
         self.data_cross_tran_flow.normal_velocities.attrs['units'] = 'm/s'
         self.data_cross_tran_flow.normal_velocities.attrs['standard_name'] = 'velocity across the transect'
@@ -443,75 +389,8 @@ class Transect_f(Transect):
         self.data_cross_tran_flow.depth_0.attrs['long_name'] = 'Initial depth at time zero defined at the normal velocity grid points'
         self.data_cross_tran_flow = self.data_cross_tran_flow.squeeze()
   
-    def __pressure_grad_fpoint(self, ds_T, ds_T_j1, ds_T_i1, ds_T_j1i1, r_ind, velocity_component):
-        """
-        Calculates the hydrostatic and surface pressure gradients at a set of f-points
-        along the transect, i.e. at a set of specific values of r_dim (but for all time and depth).
-        The caller must supply four datasets that contain the variables which define
-        the hydrostatic and surface pressure at all vertical z_levels and all time 
-        on the t-points around the transect i.e. for a set of f-points on the transect 
-        defined at (j+1/2, i+1/2), t-points are supplied at (j,i), (j+1,i), (j,i+1), (j+1,i+1), 
-        corresponding to ds_T, ds_T_j1, ds_T_i1, ds_T_j1i1, respectively. 
-        
-        The velocity_component defines whether u or v is normal to the transect 
-        for the segments of the transect. A segment of transect is 
-        defined as being r_dim to r_dim+1 where r_dim is the along transect dimension.
-
-        Parameters
-        ----------
-        ds_T : coast.Transect_t on y=self.y_ind, x=self.x_ind
-        ds_T_j1 : coast.Transect_t on y=self.y_ind+1, x=self.x_ind
-        ds_T_i1 : coast.Transect_t on y=self.y_ind, x=self.x_ind+1
-        ds_T_j1i1 : coast.Transect_t on y=self.y_ind+1, x=self.x_ind+1
-        r_ind: 1d array, along transect indices 
-        velocity_component : str, normal velocity at r_ind
-        
-        Returns
-        -------
-        hpg_f : DataArray with dimensions in time and depth and along transect
-            hydrostatic pressure gradient at a set of f-points along the transect
-            for all time and depth
-        spg_f : DataArray with dimensions in time and depth and along transect
-            surface pressure gradient at a set of f-points along the transect
-
-        """
-        if velocity_component == "u":
-            # required scale factors for derivative and averaging
-            e2v = 0.5*( ds_T_j1.e2.data[r_ind] + ds_T.e2.data[r_ind] )
-            e2v_i1 = 0.5*( ds_T_j1i1.e2.data[r_ind] + ds_T_i1.e2.data[r_ind] )
-            e1v = 0.5*( ds_T_j1.e1.data[r_ind] + ds_T.e1.data[r_ind] )
-            e1v_i1 = 0.5*( ds_T_j1i1.e1.data[r_ind] + ds_T_i1.e1.data[r_ind] )
-            e1f = 0.5*( e1v + e1v_i1 )            
-            # calculate gradients at v-points either side of f-point
-            hpg = (ds_T_j1.pressure_h_zlevels.data[:,:,r_ind] - ds_T.pressure_h_zlevels.data[:,:,r_ind]) / e2v
-            hpg_i1 = (ds_T_j1i1.pressure_h_zlevels.data[:,:,r_ind] - ds_T_i1.pressure_h_zlevels.data[:,:,r_ind]) / e2v_i1   
-            # average onto f-point
-            hpg_f = 0.5 * ( ( e1v * hpg ) + ( e1v_i1 * hpg_i1 ) ) / e1f 
-            # as aboave            
-            spg = (ds_T_j1.pressure_s.data[:,r_ind] - ds_T.pressure_s.data[:,r_ind]) / e2v
-            spg_i1 = (ds_T_j1i1.pressure_s.data[:,r_ind] - ds_T_i1.pressure_s.data[:,r_ind]) / e2v_i1
-            spg_f = 0.5 * ( (e1v * spg) + (e1v_i1 * spg_i1) ) / e1f 
-        elif velocity_component == "v":
-            # required scale factors for derivative and averaging
-            e1u = 0.5 * ( ds_T_i1.e1.data[r_ind] + ds_T.e1.data[r_ind] ) 
-            e1u_j1 = 0.5 * ( ds_T_j1i1.e1.data[r_ind] + ds_T_j1.e1.data[r_ind] )
-            e2u = 0.5 * ( ds_T_i1.e2.data[r_ind] + ds_T.e2.data[r_ind] )
-            e2u_j1 = 0.5 * ( ds_T_j1i1.e2.data[r_ind] + ds_T_j1.e2.data[r_ind] )
-            e2f = 0.5 * ( e2u + e2u_j1 )
-            # calculate gradients at u-points either side of f-point
-            hpg = (ds_T_i1.pressure_h_zlevels.data[:,:,r_ind] - ds_T.pressure_h_zlevels.data[:,:,r_ind]) / e1u
-            hpg_j1 = (ds_T_j1i1.pressure_h_zlevels.data[:,:,r_ind] - ds_T_j1.pressure_h_zlevels.data[:,:,r_ind]) / e1u_j1 
-            # average onto f-point
-            hpg_f = 0.5 * ( (e2u * hpg) + (e2u_j1 * hpg_j1) ) / e2f
-            # as above
-            spg = (ds_T_i1.pressure_s.data[:,r_ind] - ds_T.pressure_s.data[:,r_ind]) / e1u
-            spg_j1 = (ds_T_j1i1.pressure_s.data[:,r_ind] - ds_T_j1.pressure_s.data[:,r_ind]) / e1u_j1 
-            spg_f = 0.5 * ( (e2u * spg) + (e2u_j1 * spg_j1) ) / e2f
-        
-        return (hpg_f, spg_f)
-    
-  
-    def calc_geostrophic_flow(self, nemo_t: COAsT, ref_density=None):
+    def calc_geostrophic_flow(self, nemo_t: COAsT, ref_density=None, nemo_u: COAsT=None,
+                              nemo_v: COAsT=None, time_chunk=None):
         """
         This method will calculate the geostrophic velocity and volume transport
         (due to the geostrophic current) across the transect. 
@@ -528,7 +407,10 @@ class Transect_f(Transect):
         The implementation works by regridding from the native vertical grid to 
         horizontal z_levels in order to perform the horizontal gradients.
         Currently the level depths are assumed fixed at their initial depths,
-        i.e. at time zero.
+        i.e. at time zero. The t-point columns around the transect are read
+        once and density and pressure are calculated once per column (see
+        section_util.geostrophic_flow). If nemo_t is dask-backed, or time_chunk
+        is given, the new variables are lazy.
         
         Parameters
         ----------
@@ -538,174 +420,47 @@ class Transect_f(Transect):
         ref_density : float, optional
             reference density value. If None a transect mean density will be calculated 
             and used.
+        nemo_u, nemo_v : COAsT, optional
+            nemo objects on the u and v grids, e.g. those passed to 
+            calc_flow_across_transect(). Used for the coordinates of the normal
+            velocity points. If not supplied they are loaded from the domain file.
+        time_chunk : int, optional
+            Number of times in each dask chunk of the calculation.
 
 
         """
         debug(f"Calculating geostrophic velocity and volume transport for {get_slug(self)} with "
               f"{get_slug(nemo_t)}")
 
-        # If there is no time dimension, add one then remove at end. This is so
-        # indexing can assume a time dimension exists
-        nemo_t_local = nemo_t.copy()
-        if 't_dim' not in nemo_t_local.dataset.dims:
-            nemo_t_local.dataset = nemo_t_local.dataset.expand_dims(dim={'t_dim':1},axis=0)
-            
-        #We need to calculate the pressure at four t-points to get an
-        # average onto the pressure gradient at the f-points, which will then
-        # be averaged onto the normal velocity points. Here we subset the nemo_t 
-        # data around the transect so we have these four t-grid points at each 
-        # point along the transect        
-        tran_t = Transect_t(nemo_t_local, y_indices=self.y_ind, x_indices=self.x_ind)            # j,i
-        tran_t_j1 = Transect_t(nemo_t_local, y_indices=self.y_ind+1, x_indices=self.x_ind)       # j+1,i
-        tran_t_i1 = Transect_t(nemo_t_local, y_indices=self.y_ind, x_indices=self.x_ind+1)       # j,i+1
-        tran_t_j1i1 = Transect_t(nemo_t_local, y_indices=self.y_ind+1, x_indices=self.x_ind+1)   # j+1,i+1
-        
-        bath_max = np.max([tran_t.data.bathymetry.max().item(), 
-                           tran_t_j1.data.bathymetry.max().item(),
-                           tran_t_i1.data.bathymetry.max().item(), 
-                           tran_t_j1i1.data.bathymetry.max().item()])
-                
-        z_levels = Transect.gen_z_levels(bath_max) 
-        
-        tran_t.construct_pressure(ref_density, z_levels, extrapolate=True)
-        tran_t_j1.construct_pressure(ref_density, z_levels, extrapolate=True)
-        tran_t_i1.construct_pressure(ref_density, z_levels, extrapolate=True)
-        tran_t_j1i1.construct_pressure(ref_density, z_levels, extrapolate=True)   
-                  
-        # Remove the mean hydrostatic pressure on each z_level from the hydrostatic pressure.
-        # This helps to reduce the noise when taking the horizontal gradients of hydrostatic pressure.
-        # Also catch and ignore nan-slice warning
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore", category=RuntimeWarning)
-            pressure_h_zlevel_mean = xr.concat( (tran_t.data.pressure_h_zlevels, tran_t_j1.data.pressure_h_zlevels, 
-                                 tran_t_i1.data.pressure_h_zlevels, tran_t_j1i1.data.pressure_h_zlevels), 
-                                 dim='concat_dim' ).mean(dim=('concat_dim','r_dim','t_dim'),skipna=True)
-            
-            if ref_density is None:
-                ref_density = ( xr.concat( (tran_t.data.density_zlevels, 
-                            tran_t_j1.data.density_zlevels, 
-                            tran_t_i1.data.density_zlevels, 
-                            tran_t_j1i1.data.density_zlevels), dim='concat_dim' )
-                            .mean(dim=('concat_dim','r_dim','t_dim','depth_z_levels'),skipna=True).item() )
-                
-        tran_t.data['pressure_h_zlevels'] = tran_t.data.pressure_h_zlevels - pressure_h_zlevel_mean
-        tran_t_j1.data['pressure_h_zlevels'] = tran_t_j1.data.pressure_h_zlevels - pressure_h_zlevel_mean
-        tran_t_i1.data['pressure_h_zlevels'] = tran_t_i1.data.pressure_h_zlevels - pressure_h_zlevel_mean
-        tran_t_j1i1.data['pressure_h_zlevels'] = tran_t_j1i1.data.pressure_h_zlevels - pressure_h_zlevel_mean
-                
-        # Coriolis parameter
-        f = 2 * self.EARTH_ROT_RATE * np.sin( np.deg2rad(self.data.latitude) )
-        
-        # Find the indices where the derivative of the transect in the north, south, east and west
-        # directions are positive.
-        dr_n = np.where(np.diff(self.y_ind)>0, np.arange(0,self.data.r_dim.size-1), np.nan )
-        dr_e = np.where(np.diff(self.x_ind)>0, np.arange(0,self.data.r_dim.size-1), np.nan )
-        dr_w = np.where(np.diff(self.x_ind)<0, np.arange(0,self.data.r_dim.size-1), np.nan )        
-        dr_list = [dr_n[~np.isnan(dr_n)].astype(int),
-                   dr_e[~np.isnan(dr_e)].astype(int), dr_w[~np.isnan(dr_w)].astype(int)]
-        
-        # horizontal scale factors on the relevent u and v grids that are
-        # normal to the transect for dr_n, dr_e, dr_w
-        e2u_j1  = 0.5 * ( tran_t_j1.data.e2.data[dr_list[0]] + tran_t_j1i1.data.e2.data[dr_list[0]] )
-        e1v_i1  = 0.5 * ( tran_t_i1.data.e1.data[dr_list[1]] + tran_t_j1i1.data.e1.data[dr_list[1]] )
-        e1v     = 0.5 * ( tran_t.data.e1.data[dr_list[2]] + tran_t_j1.data.e1.data[dr_list[2]] )
-        e_horiz_vel = [e2u_j1, e1v_i1, e1v] 
-        # Horizontal scale factors on f-grid for dr_n, dr_e, dr_w
-        e_horiz_f   = [self.data.e2,  
-                       self.data.e1, self.data.e1]
-        # velocity component normal to transect for dr_n, dr_s, dr_e, dr_w
-        velocity_component = ["u","v","v"]
-        # Geostrophic flow direction across transect
-        flow_direction = [-1,-1,1]   
-        
+        flow = section_util.geostrophic_flow(nemo_t, self.data, self.y_ind, self.x_ind,
+                                             ref_density, time_chunk)
         # The cross transect flow is defined on the u and v points that are across
         # the transect, i.e. between f points, therefore the attributes of the
         # data_cross_flow dataset need to be on these points.
-        da_y_ind = xr.DataArray( self.y_ind, dims=['r_dim'] )
-        da_x_ind = xr.DataArray( self.x_ind, dims=['r_dim'] )
-        u_ds = NEMO( fn_domain=self.filename_domain, grid_ref='u-grid' ).dataset \
-            .isel(y_dim=da_y_ind, x_dim=da_x_ind)
-        v_ds = NEMO( fn_domain=self.filename_domain, grid_ref='v-grid' ).dataset \
-            .isel(y_dim=da_y_ind, x_dim=da_x_ind)
-        ds = [u_ds,v_ds,v_ds]
-        
-        # Drop the last point because the normal velocity points are defined at
-        # the middle of a segment and there is as a result one less point.
-        normal_velocity_hpg = np.zeros_like(tran_t.data.pressure_h_zlevels)[:,:,:-1] 
-        normal_velocity_spg = np.zeros_like(tran_t.data.pressure_s)[:,:-1]
-        latitude = np.zeros( (u_ds.r_dim.size-1) )
-        longitude = np.zeros( (u_ds.r_dim.size-1) )
-        depth_0 = np.ma.zeros( (u_ds.z_dim.size, u_ds.r_dim.size-1) )
-        # horizontal scale factors for each segmant of transect
-        e_horiz = np.zeros( (tran_t.data.t_dim.size, tran_t.data.r_dim.size-1) ) 
-        # Contruct geostrophic flow
-        for dr, vel_comp, flow_dir, e_hor_vel, e_hor_f, i_ds in \
-                zip(dr_list, velocity_component, flow_direction, e_horiz_vel, e_horiz_f, ds) :
-            hpg, spg        = self.__pressure_grad_fpoint( tran_t.data, 
-                                tran_t_j1.data, tran_t_i1.data, 
-                                tran_t_j1i1.data, dr, vel_comp )
-            hpg_r1, spg_r1  = self.__pressure_grad_fpoint( tran_t.data,
-                                tran_t_j1.data,
-                                tran_t_i1.data, 
-                                tran_t_j1i1.data, dr+1, vel_comp )
-            normal_velocity_hpg[:,:,dr] = ( flow_dir * 0.5 * (e_hor_f.data[dr]*hpg/f.data[dr] 
-                                            + e_hor_f.data[dr+1]*hpg_r1/f.data[dr+1]) 
-                                            / (e_hor_vel * ref_density) )
-            normal_velocity_spg[:,dr]   = ( flow_dir * 0.5 * (e_hor_f.data[dr]*spg/f.data[dr] 
-                                            + e_hor_f.data[dr+1]*spg_r1/f.data[dr+1]) 
-                                            / (e_hor_vel * ref_density) ) 
-            e_horiz[:,dr] = e_hor_vel
-            depth_0[:,dr] = i_ds.depth_0.to_masked_array()[:,dr]
-            latitude[dr]  = i_ds.latitude.data[dr]
-            longitude[dr] = i_ds.longitude.data[dr]
-            
-        # Bathymetry at normal velocity points             
-        #H = np.zeros_like( self.data.bathymetry.values )[:-1]
-        H = 0.5*(self.data.bathymetry.values[:-1] + self.data.bathymetry.values[1:])
-        # Remove redundent levels below bathymetry
-        normal_velocity_hpg = np.where( z_levels[:,np.newaxis] <= H, 
-                                       normal_velocity_hpg, np.nan )           
-        active_z_levels = np.count_nonzero(~np.isnan(normal_velocity_hpg),axis=1).max() 
-        normal_velocity_hpg = normal_velocity_hpg[:,:active_z_levels,:]
-        z_levels = z_levels[:active_z_levels]
-        
-        # DataArray attributes
-        coords_hpg={'depth_z_levels': (('depth_z_levels'), z_levels),
-                'latitude': (('r_dim'), latitude),
-                'longitude': (('r_dim'), longitude)}
-        dims_hpg=['depth_z_levels', 'r_dim']
-        attributes_hpg = {'units': 'm/s', 'standard name': 'velocity across the \
+        points = section_util.normal_point_metrics(self.y_ind, self.x_ind, nemo_u, nemo_v,
+                    ['latitude', 'longitude', 'depth_0'], fn_domain=self.filename_domain)
+        latitude = points.latitude.values
+        longitude = points.longitude.values
+        coords = {'latitude': (('r_dim'), latitude), 'longitude': (('r_dim'), longitude)}
+
+        # Add DataArrays  to dataset
+        self.data_cross_tran_flow['normal_velocity_hpg'] = flow.normal_velocity_hpg.assign_coords(coords)
+        self.data_cross_tran_flow.normal_velocity_hpg.attrs = {'units': 'm/s', 'standard name': 'velocity across the \
                           transect due to the hydrostatic pressure gradient'}
-        coords_spg={'latitude': (('r_dim'), latitude),
-                'longitude': (('r_dim'), longitude)}
-        dims_spg=['r_dim']
-        attributes_spg = {'units': 'm/s', 'standard name': 'velocity across the \
+        self.data_cross_tran_flow['normal_velocity_spg'] = flow.normal_velocity_spg.assign_coords(coords)
+        self.data_cross_tran_flow.normal_velocity_spg.attrs = {'units': 'm/s', 'standard name': 'velocity across the \
                           transect due to the surface pressure gradient'}
-                
-        # Add time if required
-        if 't_dim' in tran_t.data.dims:
-            coords_hpg['time'] = (('t_dim'), tran_t.data.time)
-            dims_hpg.insert(0, 't_dim')
-            coords_spg['time'] = (('t_dim'), tran_t.data.time)
-            dims_spg.insert(0, 't_dim')
-        
-        # Add DataArrays  to dataset
-        self.data_cross_tran_flow['normal_velocity_hpg'] = xr.DataArray( np.squeeze(normal_velocity_hpg),
-                coords=coords_hpg, dims=dims_hpg, attrs=attributes_hpg)
-        self.data_cross_tran_flow['normal_velocity_spg'] = xr.DataArray( np.squeeze(normal_velocity_spg),
-                coords=coords_spg, dims=dims_spg, attrs=attributes_spg)
-        self.data_cross_tran_flow['normal_transport_hpg'] = ( self.data_cross_tran_flow
-                .normal_velocity_hpg.fillna(0).integrate(dim='depth_z_levels') ) * e_horiz / 1000000   
+        self.data_cross_tran_flow['normal_transport_hpg'] = flow.normal_transport_hpg
         self.data_cross_tran_flow.normal_transport_hpg.attrs = {'units': 'Sv', 
                 'standard_name': 'volume transport across transect due to the hydrostatic pressure gradient'}        
-        self.data_cross_tran_flow['normal_transport_spg'] = self.data_cross_tran_flow.normal_velocity_spg * H * e_horiz / 1000000
+        self.data_cross_tran_flow['normal_transport_spg'] = flow.normal_transport_spg
         self.data_cross_tran_flow.normal_transport_spg.attrs = {'units': 'Sv', 
                 'standard_name': 'volume transport across transect due to the surface pressure gradient'}       
                     
         self.data_cross_tran_flow['latitude'] = xr.DataArray( latitude, dims=['r_dim'] ) 
         self.data_cross_tran_flow['longitude'] = xr.DataArray( longitude, dims=['r_dim'] ) 
-        self.data_cross_tran_flow['e12'] = xr.DataArray( e_horiz[0,:], dims=['r_dim'] ) 
-        self.data_cross_tran_flow['depth_0_original'] = xr.DataArray( depth_0, dims=['z_dim','r_dim'] ) 
+        self.data_cross_tran_flow['e12'] = flow.e12
+        self.data_cross_tran_flow['depth_0_original'] = points.depth_0.transpose('z_dim', 'r_dim')
         self.data_cross_tran_flow.depth_0_original.attrs['units'] = 'm'
         self.data_cross_tran_flow.depth_0_original.attrs['standard_name'] = 'original depth coordinate'
         self.data_cross_tran_flow.e12.attrs['standard_name'] = \
@@ -746,6 +501,12 @@ class Transect_f(Transect):
             _ , r_dim_2d = xr.broadcast( depth, data.r_dim  )
                     
         import matplotlib.pyplot as plt
+        from . import plot_util
+        # No point drawing more cells than there are pixels
+        dpi = plt.rcParams['figure.dpi']
+        normal_velocities, depth, r_dim = plot_util.decimate_section( normal_velocities, depth,
+                        np.asarray(r_dim_2d)[0], plot_info['fig_size'][0]*dpi, plot_info['fig_size'][1]*dpi )
+        r_dim_2d = np.broadcast_to( r_dim, normal_velocities.shape )
         plt.close('all')
         fig = plt.figure(figsize=plot_info['fig_size'])
         ax = fig.gca()
@@ -816,9 +577,9 @@ class Transect_t(Transect):
     Note that Point A should be closer to the southern boundary of the model domain.
     
     The user can either supply the start and end (lat,lon) coordinates of the
-    transect, point_A and point_B respectively, or the model y, x indices defining it.
-    In the latter case the user must ensure that the indices define a continuous
-    transect, e.g. y=[10,11,11,12], x=[5,5,6,6].
+    transect, point_A and point_B respectively, a list of (lat,lon) waypoints, 
+    or the model y, x indices defining it. In the latter case the user must 
+    ensure that the indices define a continuous transect, e.g. y=[10,11,11,12], x=[5,5,6,6].
     Only limited checks are performed on the suitability of the indices.
     
     Example usage:
@@ -826,6 +587,9 @@ class Transect_t(Transect):
         point_B = (56,-12)
         transect = coast.Transect_t( nemo_t, point_A, point_B )
         or 
+        transect = coast.Transect_t( nemo_t, waypoints=[(54,-15), (55,-14), (56,-12)],
+                                     great_circle=True )
+        or 
         transect = coast.Transect_t( nemo_t, y_indices=y_ind, x_indices=x_ind )
         
     Parameters
@@ -835,12 +599,16 @@ class Transect_t(Transect):
     point_B : tuple, (lat,lon)
     y_indices : 1d array of model y indices defining the points of the transect 
     x_indices : 1d array of model x indices defining the points of the transect 
+    waypoints : list of (lat,lon) tuples, the transect passes through each in turn
+    great_circle : boolean, default False. If True follow great circles 
+        between the points
+    spacing : (optional) distance (km) between the points sampled along great circles
 
     '''
     
     def __init__(self, nemo_t: COAsT, point_A: tuple=None, point_B: tuple=None,
-                 y_indices=None, x_indices=None):
-        super().__init__(nemo_t, point_A, point_B, y_indices, x_indices)
+                 y_indices=None, x_indices=None, waypoints=None, great_circle=False, spacing=None):
+        super().__init__(nemo_t, point_A, point_B, y_indices, x_indices, waypoints, great_circle, spacing)
         
         
     def construct_pressure( self, ref_density=None, z_levels=None, extrapolate=False ):   
@@ -890,41 +658,19 @@ class Transect_t(Transect):
             z_levels = Transect.gen_z_levels( self.data.bathymetry.max().item() )
         
         shape_ds = ( self.data.t_dim.size, len(z_levels), self.data.r_dim.size )
-        salinity_z = np.ma.zeros( shape_ds )
-        temperature_z = np.ma.zeros( shape_ds ) 
-        salinity_s = self.data.salinity.to_masked_array()
-        temperature_s = self.data.temperature.to_masked_array()
-        s_levels = self.data.depth_0.values
-        
-        # Interpolate salinity and temperature onto z-levels
-        # Note. At the current time there does not appear to be a good algorithm for 
-        # performing this type of interpolation without loops, which can be a bottleneck.
-        # Griddata is an option but does not support extrapolation and did not 
-        # have noticable performance benefit.
-        for it in self.data.t_dim:
-            for ir in self.data.r_dim:
-                if not np.all(np.isnan(salinity_s[it,:,ir].data)):  
-                    # Need to remove the levels below the (envelope) bathymetry which are NaN
-                    salinity_s_r = salinity_s[it,:,ir].compressed()
-                    temperature_s_r = temperature_s[it,:,ir].compressed()
-                    s_levels_r = s_levels[:len(salinity_s_r),ir]
-                    
-                    sal_func = interpolate.interp1d( s_levels_r, salinity_s_r, 
-                                 kind='linear', fill_value="extrapolate")
-                    temp_func = interpolate.interp1d( s_levels_r, temperature_s_r, 
-                                 kind='linear', fill_value="extrapolate")
-                    
-                    if extrapolate is True:
-                        salinity_z[it,:,ir] = sal_func(z_levels)
-                        temperature_z[it,:,ir] = temp_func(z_levels)                        
-                    else:
-                        # set levels below the bathymetry to nan
-                        salinity_z[it,:,ir] = np.where( z_levels <= self.data.bathymetry.values[ir], 
-                                sal_func(z_levels), np.nan )
-                        temperature_z[it,:,ir] = np.where( z_levels <= self.data.bathymetry.values[ir], 
-                                temp_func(z_levels), np.nan ) 
-                    
+        salinity_s = self.data.salinity.transpose('t_dim', 'z_dim', 'r_dim').values
+        temperature_s = self.data.temperature.transpose('t_dim', 'z_dim', 'r_dim').values
+        s_levels = self.data.depth_0.transpose('z_dim', 'r_dim').values
+        
+        # Interpolate salinity and temperature onto z-levels, for all profiles at once
+        salinity_z = section_util.interpolate_columns_to_z( salinity_s, s_levels, z_levels )
+        temperature_z = section_util.interpolate_columns_to_z( temperature_s, s_levels, z_levels )
         if extrapolate is False:
+            # set levels below the bathymetry to nan
+            below_bathymetry = ( ~(z_levels[:,np.newaxis] <= self.data.bathymetry.values)
+                                 & ~np.all(np.isnan(salinity_s), axis=1)[:,np.newaxis,:] )
+            salinity_z[below_bathymetry] = np.nan
+            temperature_z[below_bathymetry] = np.nan
             # remove redundent levels    
             active_z_levels = np.count_nonzero(~np.isnan(salinity_z),axis=1).max() 
             salinity_z = salinity_z[:,:active_z_levels,:]
@@ -933,11 +679,11 @@ class Transect_t(Transect):
         
         # Absolute Pressure (depth must be negative)   
         pressure_absolute = np.ma.masked_invalid(
-            gsw.p_from_z( -z_levels[:,np.newaxis], self.data.latitude ) )         
+            gsw.p_from_z( -z_levels[:,np.newaxis], self.data.latitude.values ) )         
         # Absolute Salinity           
         salinity_absolute = np.ma.masked_invalid(
-            gsw.SA_from_SP( salinity_z, pressure_absolute, self.data.longitude, 
-            self.data.latitude ) )
+            gsw.SA_from_SP( salinity_z, pressure_absolute, self.data.longitude.values, 
+            self.data.latitude.values ) )
         salinity_absolute = np.ma.masked_less(salinity_absolute,0)
         # Conservative Temperature
         temp_conservative = np.ma.masked_invalid(
@@ -947,8 +693,8 @@ class Transect_t(Transect):
             salinity_absolute, temp_conservative, pressure_absolute ) )
         
         coords={'depth_z_levels': (('depth_z_levels'), z_levels),
-                'latitude': (('r_dim'), self.data.latitude),
-                'longitude': (('r_dim'), self.data.longitude)}
+                'latitude': (('r_dim'), self.data.latitude.values),
+                'longitude': (('r_dim'), self.data.longitude.values)}
         dims=['depth_z_levels', 'r_dim']
         attributes = {'units': 'kg / m^3', 'standard name': 'In-situ density on the z-level vertical grid'}
         
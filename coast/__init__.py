@@ -14,5 +14,9 @@ from . import logging_util
 from . import general_utils
 from . import plot_util
 from . import crps_util
-from .CONTOUR import Contour, Contour_f, Contour_t
+from . import tide_util
+from . import ea_util
+from . import section_util
+from . import geodesy
+from .CONTOUR import Contour, Contour_f, Contour_t, Isobaths
 from .eof import *
@@ -226,17 +226,16 @@ def crps_sonf_moving( mod_array, obs_lon, obs_lat, obs_var, obs_time,
     crps_list     = np.zeros( n_neighbourhoods )*np.nan
     n_model_pts   = np.zeros( n_neighbourhoods )*np.nan
     contains_land = np.zeros( n_neighbourhoods , dtype=bool)
+    # Get all model neighbourhoods in one query
+    offsets, ind_y, ind_x = general_utils.subset_indices_by_distance_BT(
+                                mod_array.longitude.values, mod_array.latitude.values,
+                                np.asarray(obs_lon), np.asarray(obs_lat), nh_radius, csr=True)
     # Loop over neighbourhoods
     neighbourhood_indices = np.arange(0,n_neighbourhoods)
     for ii in neighbourhood_indices:
-        # Neighbourhood centre
-        cntr_lon = obs_lon[ii]
-        cntr_lat = obs_lat[ii]
-    
-        # Get model neighbourhood subset using specified method
-        subset_ind = general_utils.subset_indices_by_distance(
-                         mod_array.longitude, mod_array.latitude, 
-                         cntr_lon, cntr_lat, nh_radius)
+        # Model neighbourhood subset
+        subset_ind = ( xr.DataArray(ind_y[offsets[ii]:offsets[ii+1]]),
+                       xr.DataArray(ind_x[offsets[ii]:offsets[ii+1]]) )
         # Check that the model neighbourhood contains points
         if subset_ind[0].shape[0] == 0 or subset_ind[1].shape[0] == 0:
             crps_list[ii] = np.nan
@@ -0,0 +1,213 @@
+'''
+Client for the Environment Agency (EA) flood-monitoring API, used to read
+tide gauge data from https://environment.data.gov.uk/flood-monitoring.
+API reference:
+    https://environment.data.gov.uk/flood-monitoring/doc/reference
+
+*Methods Overview*
+    -> EAClient.get_station(): Station information for a stationReference
+    -> EAClient.get_readings(): Times and values for a station, as arrays
+    -> EAClient.get_many(): As get_readings() for many stations concurrently
+    -> parse_readings(): Convert a list of JSON readings to NumPy columns
+
+The requests package is needed to use EAClient.
+'''
+
+import os
+import json
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from .logging_util import get_slug, debug, info, warn, error
+
+EA_API_URL = 'https://environment.data.gov.uk/flood-monitoring'
+
+
+class EAClient():
+    '''
+    A client for the EA flood-monitoring API. One pooled HTTP session is
+    shared by all requests, failed requests are retried with backoff,
+    readings are paged through with _limit and _offset and, if cache_dir
+    is given, responses are cached on disk by station and date range.
+
+    Example usage:
+        client = coast.ea_util.EAClient(cache_dir='ea_cache')
+        header = client.get_station('E70124')
+        time, sea_level = client.get_readings('E70124',
+                                              date_start=np.datetime64('2020-10-01'),
+                                              date_end=np.datetime64('2020-10-05'))
+        readings = client.get_many(['E70124', 'E71524'], ndays=2)
+
+    Parameters
+    ----------
+    base_url (str) : API root. Default is the EA flood-monitoring API. Point
+        this at a local server for testing.
+    cache_dir (str) : Directory for cached responses. None for no caching.
+    page_size (int) : Maximum readings per request (_limit)
+    max_workers (int) : Threads used by get_many(), also the pool size
+    retries (int) : Retries for connection errors and 429/5xx responses
+    backoff_factor (float) : Backoff between retries, in seconds
+    timeout (float) : Timeout for each request, in seconds
+    '''
+
+    def __init__(self, base_url=EA_API_URL, cache_dir=None, page_size=10000,
+                 max_workers=8, retries=3, backoff_factor=0.5, timeout=60):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.base_url = base_url.rstrip('/')
+        self.cache_dir = cache_dir
+        self.page_size = page_size
+        self.max_workers = max_workers
+        self.timeout = timeout
+
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=['GET'])
+        adapter = HTTPAdapter(pool_connections=max_workers,
+                              pool_maxsize=max_workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        debug(f"{get_slug(self)} initialised for {self.base_url}")
+
+    def close(self):
+        ''' Close the HTTP session. '''
+        self.session.close()
+
+    def _get_json(self, url, params=None):
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def get_station(self, station_id):
+        '''
+        Station information for a stationReference, as the JSON dictionary
+        returned by the API ('items' holds label, lat, long and measures).
+        Cached on disk if cache_dir is set.
+        '''
+        fn_cache = self._cache_file(f"{station_id}_station.json")
+        if fn_cache is not None and os.path.isfile(fn_cache):
+            with open(fn_cache) as file:
+                return json.load(file)
+        station = self._get_json(f"{self.base_url}/id/stations/{station_id}.json")
+        if fn_cache is not None:
+            with open(fn_cache, 'w') as file:
+                json.dump(station, file)
+        return station
+
+    def get_readings(self, station_id, date_start=None, date_end=None,
+                     ndays=5, station=None):
+        '''
+        Readings of the (first) measure of a station, either from date_start
+        to date_end (inclusive dates) or for the last ndays. Pages through
+        the readings until all have been read.
+
+        Readings for a date range are cached on disk if cache_dir is set.
+        Readings for the last ndays are never cached as they change.
+
+        Parameters
+        ----------
+        station_id (str) : stationReference, e.g. 'E70124' for Liverpool
+        date_start, date_end (np.datetime64) : Date range. Both or neither.
+        ndays (int) : Number of days before now, if no dates are given
+        station (dict) : Output of get_station(), if already known
+
+        Returns
+        -------
+        time (datetime64[ns] array) and value (float array), sorted in time
+        '''
+        by_date = date_start is not None and date_end is not None
+        if by_date:
+            startdate = np.datetime64(date_start).item().strftime('%Y-%m-%d')
+            enddate = np.datetime64(date_end).item().strftime('%Y-%m-%d')
+            params = {'startdate': startdate, 'enddate': enddate}
+            fn_cache = self._cache_file(f"{station_id}_{startdate}_{enddate}.npz")
+            if fn_cache is not None and os.path.isfile(fn_cache):
+                debug(f"Reading cached readings from {fn_cache}")
+                with np.load(fn_cache) as cached:
+                    return cached['time'], cached['value']
+        else:
+            since = np.datetime64('now') - np.timedelta64(ndays, 'D')
+            params = {'since': since.item().strftime('%Y-%m-%dT%H:%M:%SZ')}
+            fn_cache = None
+
+        if station is None:
+            station = self.get_station(station_id)
+        measures = station['items']['measures']
+        if isinstance(measures, list):
+            measures = measures[0]
+        url = measures['@id'] + '/readings'
+        if not url.startswith(self.base_url):
+            # Follow the measure from the configured server
+            url = self.base_url + url[url.index('/id/'):]
+
+        items = []
+        offset = 0
+        while True:
+            page = self._get_json(url, dict(params, _sorted='',
+                                            _limit=self.page_size,
+                                            _offset=offset))['items']
+            items.extend(page)
+            debug(f"{station_id}: {len(page)} readings from offset {offset}")
+            if len(page) < self.page_size:
+                break
+            offset = offset + len(page)
+
+        time, value = parse_readings(items)
+        if fn_cache is not None:
+            np.savez(fn_cache, time=time, value=value)
+        return time, value
+
+    def get_many(self, station_ids, date_start=None, date_end=None, ndays=5):
+        '''
+        get_station() and get_readings() for many stations concurrently in
+        a thread pool, sharing the pooled session. Stations that fail are
+        logged and left out.
+
+        Returns
+        -------
+        dict of station_id -> (station, time, value)
+        '''
+        import requests
+
+        def read_one(station_id):
+            try:
+                station = self.get_station(station_id)
+                time, value = self.get_readings(station_id, date_start,
+                                                date_end, ndays, station)
+                return station_id, (station, time, value)
+            except (requests.RequestException, ValueError, KeyError) as err:
+                error(f"Failed request for station {station_id}: {err}")
+                return station_id, None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(read_one, station_ids)
+        return {station_id:result for station_id, result in results
+                if result is not None}
+
+    def _cache_file(self, name):
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, name)
+
+
+def parse_readings(items):
+    '''
+    Converts the 'items' list of a readings response into a datetime64[ns]
+    time array and a float value array, sorted in time. Values that are
+    not numbers (the API occasionally gives a list) become NaN.
+    '''
+    if len(items) == 0:
+        return np.array([], dtype='datetime64[ns]'), np.array([], dtype=float)
+    time = pd.to_datetime(list(map(itemgetter('dateTime'), items)),
+                          format='%Y-%m-%dT%H:%M:%SZ').values
+    value = pd.to_numeric(pd.Series(list(map(itemgetter('value'), items)),
+                                    dtype=object),
+                          errors='coerce').values.astype(float)
+    order = np.argsort(time, kind='stable')
+    return time[order], value[order]
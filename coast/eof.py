@@ -1,5 +1,6 @@
 import xarray as xr
 import numpy as np
+import dask.array as da
 from scipy import linalg
 from scipy.signal import hilbert
 
@@ -81,7 +82,8 @@ def eofs(variable:xr.DataArray, full_matrices:bool=False, time_dim_name:str='t_d
     return dataset
 
     
-def hilbert_eofs(variable:xr.DataArray, full_matrices=False, time_dim_name:str='t_dim'):
+def hilbert_eofs(variable:xr.DataArray, full_matrices=False, time_dim_name:str='t_dim',
+                 chunk_points:int=None, n_modes:int=None, dtype=np.complex128):
     '''
     Computes the complex Hilbert Empirical Orthogonal Functions (HEOFs) of a 
     variable (time series) that has 3 dimensions where one is time, i.e. (x,y,time).
@@ -106,6 +108,15 @@ def hilbert_eofs(variable:xr.DataArray, full_matrices=False, time_dim_name:str='
     full_matrices : (boolean, default False) if false computes only first K EOFs 
     where K=min(I*J,T), where T is total number of time points.
     time_dim_name : (string, default 't_dim') the name of the time dimension.
+    chunk_points : (int, default None) if given, the Hilbert transform is 
+    applied lazily with dask in blocks of chunk_points time series and the 
+    result is passed directly to a tall-and-skinny complex SVD. Only one 
+    block of the analytic signal is held in memory at a time. Ignored if 
+    full_matrices is True.
+    n_modes : (int, default None) number of modes to return when using 
+    chunk_points. If None, K=min(I*J,T) modes are returned.
+    dtype : (numpy complex type, default np.complex128) precision of the 
+    analytic signal when using chunk_points. np.complex64 halves the memory.
 
     Returns
     -------
@@ -117,19 +128,24 @@ def hilbert_eofs(variable:xr.DataArray, full_matrices=False, time_dim_name:str='
     '''
     variable = variable.transpose(...,time_dim_name,transpose_coords=False)
     I,J,T = np.shape(variable.data)
-    signal = np.reshape(variable.data,(I*J, T))
-                  
-    # Remove constant zero point such as land points
-    active_ind = np.where( np.nan_to_num(signal).any(axis=1))[0] 
-    signal = signal[active_ind,:]
-    # Remove time mean at each grid point
-    mean = np.mean(signal,axis=1)
-    signal = signal - mean[:, np.newaxis]
-    # Apply Hilbert transform
-    signal = hilbert(signal, axis=1)
-    # Compute EOFs
-    EOFs, projections, variance_explained, mode_count = \
-                                _compute( signal, full_matrices, active_ind, I*J )
+    
+    if chunk_points is not None and not full_matrices:
+        EOFs, projections, variance_explained, mode_count = \
+            _compute_chunked_hilbert( variable.data, chunk_points, n_modes, dtype )
+    else:
+        signal = np.reshape(variable.data,(I*J, T))
+                      
+        # Remove constant zero point such as land points
+        active_ind = np.where( np.nan_to_num(signal).any(axis=1))[0] 
+        signal = signal[active_ind,:]
+        # Remove time mean at each grid point
+        mean = np.mean(signal,axis=1)
+        signal = signal - mean[:, np.newaxis]
+        # Apply Hilbert transform
+        signal = hilbert(signal, axis=1)
+        # Compute EOFs
+        EOFs, projections, variance_explained, mode_count = \
+                                    _compute( signal, full_matrices, active_ind, I*J )
     
     # Extract the amplitude and phase of the projections    
     projection_amp = np.absolute(projections)
@@ -213,7 +229,64 @@ def _compute(signal, full_matrices, active_ind, number_points):
       
     return EOFs, projections, variance_explained, mode_count
 
-   
-                
-        
-        
\ No newline at end of file
+
+def _hilbert_block(block, dtype):
+    '''
+    Hilbert transform of a block of time series along axis 1. If a single
+    precision result is requested the FFT is also done in single precision.
+    '''
+    if np.dtype(dtype) == np.complex64:
+        block = block.astype(np.float32)
+    return hilbert(block, axis=1).astype(dtype, copy=False)
+
+
+def _compute_chunked_hilbert(data, chunk_points, n_modes, dtype):
+    '''
+    Compute Hilbert eofs, projections and variance explained lazily. The signal
+    is split into blocks of chunk_points time series, de-meaned and Hilbert
+    transformed block by block using dask, then decomposed using a 
+    tall-and-skinny complex SVD (TSQR). Only the leading n_modes are returned.
+
+    Parameters
+    ----------
+    data : (array) numpy or dask array of shape (I,J,T)
+    chunk_points : (int) number of time series in each block
+    n_modes : (int) number of modes to return. If None, all K=min(I*J,T)
+    dtype : (numpy complex type) precision of the analytic signal
+
+    Returns
+    -------
+    EOFs : (array) the EOFs in 2d form 
+    projections : (array) the projectsion of the EOFs
+    variance_explained : (array) variance explained by each mode
+    mode_count : (int) number of modes computed
+
+    '''
+    I,J,T = data.shape
+    signal = da.asarray(data).reshape((I*J, T))
+
+    # Remove constant zero point such as land points
+    active_ind = np.where( da.nan_to_num(signal).any(axis=1).compute() )[0]
+    signal = signal[active_ind,:].rechunk({0:chunk_points, 1:-1})
+    # Remove time mean at each grid point
+    signal = signal - signal.mean(axis=1)[:, np.newaxis]
+    # Apply Hilbert transform one block of points at a time
+    signal = signal.map_blocks(_hilbert_block, dtype, dtype=dtype, 
+                               meta=np.array((), dtype=dtype))
+
+    P, D, Q = da.linalg.svd(signal)
+    if n_modes is not None:
+        P, D, Q = P[:,:n_modes], D[:n_modes], Q[:n_modes,:]
+    # Total variance from the same pass over the signal as the SVD
+    total = (np.abs(signal)**2).sum()
+    P, D, Q, total = da.compute(P, D, Q, total)
+    mode_count = P.shape[-1]
+
+    EOFs = np.full( (I*J, mode_count), np.nan, dtype=P.dtype)
+    EOFs[active_ind,:] = P
+    variance_explained = 100.*( D**2 / total )
+
+    # Extract EOF projections
+    projections = np.transpose(Q) * D
+
+    return EOFs, projections, variance_explained, mode_count
@@ -8,13 +8,23 @@ import copy
 import scipy as sp
 from .logging_util import get_slug, debug, info, warn, error
 import sklearn.neighbors as nb
+from scipy.spatial import cKDTree
+from functools import lru_cache
+import hashlib
+from . import geodesy
+
+# GridIndex objects by grid, for cached_grid_index()
+GRID_INDEX_CACHE_SIZE = 8
+_grid_index_cache = {}
 
 def subset_indices_by_distance_BT(longitude, latitude, centre_lon, centre_lat, 
-        radius: float, mask=None
+        radius: float, mask=None, csr=False
     ):
     """
     Returns the indices of points that lie within a specified radius (km) of
-    central latitude and longitudes. This makes use of BallTree.query_radius.
+    central latitude and longitudes. All centres are found in one query of
+    a grid index (see GridIndex.within_radius), which is cached for the
+    grid. None of the inputs are modified.
     
     Parameters
     ----------
@@ -25,6 +35,8 @@ def subset_indices_by_distance_BT(longitude, latitude, centre_lon, centre_lat,
     radius      : (float) Radius in km within which to find indices
     mask        : (numpy.ndarray) of same dimension as longitude and latitude.
                   If specified, will mask out points from the routine.
+    csr         : (bool) If True, return the indices for all centres
+                  together, in compressed sparse row form (see Returns).
     Returns
     -------
         Returns an array of indices corresponding to points within radius.
@@ -35,59 +47,24 @@ def subset_indices_by_distance_BT(longitude, latitude, centre_lon, centre_lat,
     If longitude is 2D:
         Returns arrays of x and y indices per central location.
         ind_y corresponds to row indices of the original input arrays.
+    If csr is True:
+        Returns offsets (n_centres + 1) followed by the index array(s) as
+        above, concatenated over centres. The indices for centre i are
+        ind[offsets[i]:offsets[i+1]].
     """
-    # change inputs to numpy
-    longitude = np.array(longitude)
-    latitude = np.array(latitude)
-    centre_lon = np.array(centre_lon)
-    centre_lat = np.array(centre_lat)
-    # Calculate radius in radians
-    earth_radius = 6371
-    r_rad = radius/earth_radius
-    # For reshaping indices at the end
-    original_shape = longitude.shape
-    # Check if radius centres are numpy arrays. If not, make them into ndarrays
-    if not isinstance(centre_lon, (np.ndarray)):
-        centre_lat = np.array(centre_lat)
-        centre_lon = np.array(centre_lon)
-    # Determine number of centres provided
-    n_pts = 1 if centre_lat.shape==() else len(centre_lat)
-    # If a mask is supplied, remove indices from arrays. Flatten input ready
-    # for BallTree
-    if mask is None:
-        longitude = longitude.flatten()
-        latitude = latitude.flatten()
-    else:
-        longitude[mask] = np.nan
-        latitude[mask] = np.nan
-        longitude = longitude.flatten()
-        latitude = latitude.flatten()
-    # Put lons and lats into 2D location arrays for BallTree: [lat, lon]
-    locs = np.vstack((latitude, longitude)).transpose()
-    locs = np.radians(locs)
-    # Construct central input to BallTree.query_radius
-    if n_pts==1:
-        centre = np.array([[centre_lat, centre_lon]])
-    else:
-        centre = np.vstack((centre_lat, centre_lon)).transpose()
-    centre = np.radians(centre)
-    # Do nearest neighbour interpolation using BallTree (gets indices)
-    tree = nb.BallTree(locs, leaf_size=2, metric='haversine')
-    ind_1d = tree.query_radius(centre, r = r_rad)
-    if len(original_shape) == 1:
-        return ind_1d
+    index = cached_grid_index(longitude, latitude)
+    n_pts = 1 if np.ndim(centre_lat) == 0 else len(centre_lat)
+    offsets, ind_1d = index.within_radius(centre_lon, centre_lat, radius, mask)
+    if len(index.shape) == 1:
+        ind = (ind_1d,)
     else:
-        # Get 2D indices from 1D index output from BallTree
-        ind_y = []
-        ind_x = []
-        for ii in np.arange(0,n_pts):
-            x_tmp, y_tmp = np.unravel_index(ind_1d[ii], original_shape)
-            ind_x.append(x_tmp.squeeze())
-            ind_y.append(y_tmp.squeeze())
-        if n_pts==1:
-            return ind_x[0], ind_y[0]
-        else:
-            return ind_x, ind_y
+        ind = np.unravel_index(ind_1d, index.shape)
+    if csr:
+        return (offsets,) + tuple(ind)
+    ind = [np.split(array, offsets[1:-1]) for array in ind]
+    if n_pts == 1:
+        ind = [array[0] for array in ind]
+    return ind[0] if len(ind) == 1 else tuple(ind)
 
 def subset_indices_by_distance(
         longitude, latitude, centre_lon: float, centre_lat: float, 
@@ -105,9 +82,8 @@ def subset_indices_by_distance(
     """
 
     # Calculate the distances between every model point and the specified
-    # centre. Calls another routine dist_haversine.
-    dist = calculate_haversine_distance(centre_lon, centre_lat, 
-                                        longitude, latitude)
+    # centre.
+    dist = geodesy.point_to_grid(centre_lon, centre_lat, longitude, latitude)
     indices_bool = dist < radius
     indices = np.where(indices_bool)
 
@@ -175,22 +151,7 @@ def calculate_haversine_distance(lon1, lat1, lon2, lat2):
     # lon2, lat2 :: Location(s) 2.
     '''
 
-    # Convert to radians for calculations
-    lon1 = xr.ufuncs.deg2rad(lon1)
-    lat1 = xr.ufuncs.deg2rad(lat1)
-    lon2 = xr.ufuncs.deg2rad(lon2)
-    lat2 = xr.ufuncs.deg2rad(lat2)
-
-    # Latitude and longitude differences
-    dlat = (lat2 - lat1) / 2
-    dlon = (lon2 - lon1) / 2
-
-    # Haversine function.
-    distance = xr.ufuncs.sin(dlat) ** 2 + xr.ufuncs.cos(lat1) * \
-               xr.ufuncs.cos(lat2) * xr.ufuncs.sin(dlon) ** 2
-    distance = 2 * 6371.007176 * xr.ufuncs.arcsin(xr.ufuncs.sqrt(distance))
-
-    return distance
+    return geodesy.haversine(lon1, lat1, lon2, lat2)
 
 def remove_indices_by_mask(A, mask):
     '''
@@ -294,6 +255,124 @@ def nearest_indices_2D(mod_lon, mod_lat, new_lon, new_lat,
         
     return ind_x, ind_y
 
+class GridIndex():
+    '''
+    A spatial index of the points of a 2D model grid, built once and reused
+    for any number of nearest point lookups and radius queries. See NEMO.grid_index() for an
+    index cached against a NEMO object.
+
+    nearest_j_i() uses the same distance as NEMO.find_j_i(), the Euclidean
+    distance in degrees of latitude and longitude computed in the precision
+    of the grid, and picks the first point of the grid (in C order) if
+    several are equally close. Points with NaN coordinates are left out.
+
+    Example usage:
+        index = coast.general_utils.GridIndex(nemo.dataset.longitude,
+                                              nemo.dataset.latitude)
+        y, x = index.nearest_j_i([54, 55, 56], [-15, -13.5, -12])
+
+    Parameters
+    ----------
+    longitude, latitude : arrays of the grid (degrees), usually 2D
+    '''
+    N_CANDIDATES = 8
+
+    def __init__(self, longitude, latitude):
+        self.longitude = np.asarray(longitude).ravel()
+        self.latitude = np.asarray(latitude).ravel()
+        self.shape = np.shape(longitude)
+        self.points = np.flatnonzero(np.isfinite(self.longitude) & np.isfinite(self.latitude))
+        debug(f"Building a grid index of {len(self.points)} points")
+        self.tree = cKDTree(np.column_stack((self.latitude[self.points],
+                                             self.longitude[self.points])))
+        # Built by within_radius() when first needed
+        self.sphere_tree = None
+
+    def nearest_j_i(self, lat, lon):
+        '''
+        The y and x indices of the nearest grid points to many locations,
+        found in one batched query.
+
+        Parameters
+        ----------
+        lat, lon : latitudes and longitudes (degrees), scalars or 1D arrays
+
+        Returns
+        -------
+        y, x : int arrays of the grid indices, one per location
+        '''
+        lat = np.atleast_1d(np.asarray(lat, dtype=float))
+        lon = np.atleast_1d(np.asarray(lon, dtype=float))
+        n_candidates = min(self.N_CANDIDATES, len(self.points))
+        _, candidates = self.tree.query(np.column_stack((lat, lon)), k=n_candidates)
+        candidates = self.points[np.reshape(candidates, (len(lat), n_candidates))]
+        # Choose between the nearest candidates as find_j_i does, in the
+        # precision of the grid and taking the first of equal distances
+        candidates = np.sort(candidates, axis=1)
+        dtype = np.result_type(self.latitude.dtype, np.float32)
+        dist2 = ( np.square(self.latitude[candidates] - lat.astype(dtype)[:, np.newaxis])
+                  + np.square(self.longitude[candidates] - lon.astype(dtype)[:, np.newaxis]) )
+        nearest = candidates[np.arange(len(lat)), np.argmin(dist2, axis=1)]
+        return np.unravel_index(nearest, self.shape)
+
+    def within_radius(self, centre_lon, centre_lat, radius, mask=None,
+                      return_distance=False):
+        '''
+        All grid points within radius (km) of many centres, found in one
+        query of a spherical index of the grid that is built on first use
+        and kept. See geodesy.within_radius().
+
+        Example usage:
+            offsets, indices = index.within_radius(track_lon, track_lat, 20)
+            y, x = np.unravel_index(indices, index.shape)
+            y_near_0, x_near_0 = y[offsets[0]:offsets[1]], x[offsets[0]:offsets[1]]
+
+        Parameters
+        ----------
+        centre_lon, centre_lat : centres (degrees), single values or 1D arrays
+        radius : distance (km) within which to find points
+        mask : boolean array like the grid, True for points to leave out
+        return_distance : if True, also return the distance to each point
+
+        Returns
+        -------
+        offsets (n_centres + 1), indices into the flattened grid and, if
+        requested, distances. The points near centre i are
+        indices[offsets[i]:offsets[i+1]].
+        '''
+        if self.sphere_tree is None:
+            self.sphere_tree = geodesy.build_tree(self.longitude, self.latitude)
+        offsets, indices, distances = geodesy.within_radius(
+            self.longitude, self.latitude, centre_lon, centre_lat, radius,
+            tree=self.sphere_tree, return_distance=True)
+        if mask is not None:
+            keep = ~np.asarray(mask, dtype=bool).ravel()[indices]
+            offsets = np.concatenate(([0], np.cumsum(keep)))[offsets]
+            indices, distances = indices[keep], distances[keep]
+        if return_distance:
+            return offsets, indices, distances
+        return offsets, indices
+
+
+def cached_grid_index(longitude, latitude):
+    '''
+    A GridIndex of longitude and latitude arrays, reused for later calls
+    with the same arrays. The arrays are identified by their contents, so
+    it does not matter if they are copies. Only the most recent
+    GRID_INDEX_CACHE_SIZE grids are kept.
+    '''
+    longitude = np.asarray(longitude)
+    latitude = np.asarray(latitude)
+    digest = hashlib.sha1()
+    for array in [longitude, latitude]:
+        digest.update(np.ascontiguousarray(array).tobytes())
+    key = (longitude.shape, longitude.dtype.str, latitude.dtype.str, digest.hexdigest())
+    if key not in _grid_index_cache:
+        while len(_grid_index_cache) >= GRID_INDEX_CACHE_SIZE:
+            _grid_index_cache.pop(next(iter(_grid_index_cache)))
+        _grid_index_cache[key] = GridIndex(longitude, latitude)
+    return _grid_index_cache[key]
+
 def dataarray_time_slice(data_array, date0, date1):
     ''' Takes an xr.DataArray object and returns a new object with times
     sliced between dates date0 and date1. date0 and date1 may be a string or
@@ -332,3 +411,54 @@ def dayoweek( date:np.datetime64=None):
         return 'Tue'
     elif val == 6:
         return 'Wed'
+
+
+def uk_local_to_utc(times):
+    '''
+    Converts an array of UK local times (GMT in winter, BST in summer) to
+    UTC. BST runs from 01:00 UTC on the last Sunday in March to 01:00 UTC
+    on the last Sunday in October (the rule since 1996). Local times in
+    the repeated hour at the end of BST are taken as BST; times in the
+    skipped hour at the start of BST are taken as GMT.
+
+    Parameters
+    ----------
+    times (array) : np.datetime64 array of local times
+
+    Returns
+    -------
+    np.datetime64[ns] array of UTC times
+    '''
+    times = np.asarray(times, dtype='datetime64[ns]')
+    valid = ~np.isnat(times)
+    if not valid.any():
+        return times
+    years = times[valid].astype('datetime64[Y]').astype(int) + 1970
+    boundaries = _bst_boundaries(int(years.min()), int(years.max()))
+    # Odd number of boundaries at or before a time means it is in BST
+    in_bst = np.searchsorted(boundaries, times, side='right') % 2 == 1
+    return np.where(valid & in_bst, times - np.timedelta64(1, 'h'), times)
+
+
+@lru_cache(maxsize=None)
+def _bst_boundaries(first_year, last_year):
+    '''
+    Local (wall clock) start and end times of BST for each year, as a
+    sorted datetime64[ns] array [start, end, start, end, ...]. BST starts
+    at 02:00 BST and ends at 02:00 BST (01:00 UTC on both dates).
+    '''
+    years = np.arange(first_year, last_year + 1) - 1970
+    years = years.astype('datetime64[Y]')
+
+    def last_sunday(month):
+        # Day after the last day of the month, then back to a Sunday
+        day = (years + np.timedelta64(1, 'Y')).astype('datetime64[M]') \
+              - np.timedelta64(12 - month, 'M')
+        day = day.astype('datetime64[D]') - np.timedelta64(1, 'D')
+        # 1970-01-01 was a Thursday, so Sundays are 3 mod 7 days after it
+        return day - ((day.astype(int) - 3) % 7).astype('timedelta64[D]')
+
+    start = last_sunday(3) + np.timedelta64(2, 'h')
+    end = last_sunday(10) + np.timedelta64(2, 'h')
+    boundaries = np.stack([start, end], axis=-1).ravel()
+    return boundaries.astype('datetime64[ns]')
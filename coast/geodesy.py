@@ -0,0 +1,189 @@
+'''
+Distances on a spherical Earth between longitude/latitude points, and
+queries for the grid points within a distance of many centres.
+
+*Methods Overview*
+    -> haversine(): Great circle distance, broadcast like a numpy ufunc
+    -> point_to_grid(): Distance from one point to every point of a grid
+    -> pairwise(): Distance matrix between two sets of points
+    -> along_track(): Cumulative distance along a track
+    -> unit_vectors(): Points as 3D vectors on the unit sphere
+    -> build_tree(): Spatial index of grid points for within_radius()
+    -> within_radius(): All grid points within a radius of each of many
+                        centres, as offsets and a flat index array
+
+All distances are in km. The kernels take a dtype argument to compute in
+single precision (np.float32) for large grids. If numba is installed the
+haversine kernel is compiled for numpy inputs; set USE_NUMBA = False to
+always use the numpy version.
+'''
+
+import numpy as np
+from scipy.spatial import cKDTree
+from .logging_util import get_slug, debug, info, warn, error
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+EARTH_RADIUS = 6371.007176 # km
+USE_NUMBA = True
+
+
+def _haversine(lon1, lat1, lon2, lat2):
+    lon1 = np.deg2rad(lon1)
+    lat1 = np.deg2rad(lat1)
+    lon2 = np.deg2rad(lon2)
+    lat2 = np.deg2rad(lat2)
+    distance = np.sin((lat2 - lat1) / 2) ** 2 \
+               + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(distance))
+
+
+if numba is not None:
+    _haversine_ufunc = numba.vectorize(['float32(float32, float32, float32, float32)',
+                                        'float64(float64, float64, float64, float64)'],
+                                       cache=True)(_haversine)
+else:
+    _haversine_ufunc = None
+
+
+def haversine(lon1, lat1, lon2, lat2, dtype=None):
+    '''
+    Great circle distance (km) between locations 1 and 2, using the
+    haversine formula. Inputs broadcast against each other like numpy
+    arrays, so either can be a single location, and xarray and dask
+    arrays give xarray and dask results.
+
+    Parameters
+    ----------
+    lon1, lat1 : Location(s) 1 (degrees)
+    lon2, lat2 : Location(s) 2 (degrees)
+    dtype : precision of the calculation, e.g. np.float32. Default is the
+        precision of the inputs.
+
+    Returns
+    -------
+    Distances in km
+    '''
+    coords = [lon1, lat1, lon2, lat2]
+    if dtype is not None:
+        coords = [coord.astype(dtype) if hasattr(coord, 'astype') else np.asarray(coord, dtype=dtype)
+                  for coord in coords]
+    if USE_NUMBA and _haversine_ufunc is not None \
+       and all(isinstance(coord, (np.ndarray, np.number, float, int)) for coord in coords):
+        return _haversine_ufunc(*coords)
+    return _haversine(*coords)
+
+
+def point_to_grid(lon, lat, grid_lon, grid_lat, dtype=None):
+    '''
+    Distance (km) from a single location to every point of a grid of any
+    shape. The result has the shape of the grid.
+    '''
+    if np.ndim(lon) != 0 or np.ndim(lat) != 0:
+        raise ValueError("point_to_grid() takes a single location. Use pairwise() for many.")
+    return haversine(lon, lat, grid_lon, grid_lat, dtype)
+
+
+def pairwise(lon1, lat1, lon2, lat2, dtype=None):
+    '''
+    Distance matrix (km) between every location in 1 (N points) and every
+    location in 2 (M points), of shape (N, M).
+    '''
+    lon1 = np.ravel(lon1)[:, np.newaxis]
+    lat1 = np.ravel(lat1)[:, np.newaxis]
+    return haversine(lon1, lat1, np.ravel(lon2), np.ravel(lat2), dtype)
+
+
+def along_track(lon, lat, dtype=None):
+    '''
+    Cumulative distance (km) along a track of locations, starting at zero.
+    '''
+    lon = np.asarray(lon)
+    lat = np.asarray(lat)
+    step = haversine(lon[:-1], lat[:-1], lon[1:], lat[1:], dtype)
+    return np.concatenate((np.zeros(1, dtype=step.dtype), np.cumsum(step)))
+
+
+def unit_vectors(lon, lat):
+    '''
+    Locations (degrees) as 3D cartesian vectors on the unit sphere, of
+    shape (N, 3). The chord distance between these is a monotonic function
+    of the great circle distance, so ordinary spatial indexes can be used.
+    NaN locations become the origin, which is never within the radius
+    once within_radius() checks distances exactly.
+    '''
+    lon = np.deg2rad(np.ravel(np.asarray(lon, dtype=float)))
+    lat = np.deg2rad(np.ravel(np.asarray(lat, dtype=float)))
+    xyz = np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+    xyz[~np.isfinite(xyz).all(axis=1)] = 0
+    return xyz
+
+
+def build_tree(longitude, latitude):
+    '''
+    A spatial index (scipy cKDTree) of the points of a grid, for
+    within_radius(). Build it once for repeated queries on the same grid.
+    '''
+    debug(f"Building a spherical tree of {np.size(longitude)} points")
+    return cKDTree(unit_vectors(longitude, latitude))
+
+
+def within_radius(longitude, latitude, centre_lon, centre_lat, radius, tree=None,
+                  return_distance=False):
+    '''
+    All grid points within radius (km) of each of many centres, found
+    with one query of a spatial index instead of a full grid distance
+    calculation per centre. Distances are checked exactly with the
+    haversine formula in double precision.
+
+    The result is in compressed sparse row form: the grid points near
+    centre i are indices[offsets[i]:offsets[i+1]], as indices into the
+    flattened (C order) grid and in ascending order.
+
+    Example usage:
+        offsets, indices = coast.geodesy.within_radius(
+            nemo.dataset.longitude, nemo.dataset.latitude,
+            altimetry.dataset.longitude, altimetry.dataset.latitude, 20)
+        y, x = np.unravel_index(indices, nemo.dataset.longitude.shape)
+
+    Parameters
+    ----------
+    longitude, latitude : grid locations (degrees), any shape
+    centre_lon, centre_lat : centres (degrees), single values or 1D arrays
+    radius : distance (km) within which to find points
+    tree : output of build_tree() for this grid, if already built
+    return_distance : if True, also return the distance to each point
+
+    Returns
+    -------
+    offsets (int array, n_centres + 1), indices (int array) and, if
+    requested, distances (float array like indices)
+    '''
+    longitude = np.ravel(np.asarray(longitude))
+    latitude = np.ravel(np.asarray(latitude))
+    centre_lon = np.atleast_1d(np.asarray(centre_lon, dtype=float))
+    centre_lat = np.atleast_1d(np.asarray(centre_lat, dtype=float))
+    if tree is None:
+        tree = build_tree(longitude, latitude)
+    debug(f"Finding points within {radius} km of {len(centre_lon)} centres")
+
+    # Chord length of the radius, slightly enlarged as distances are
+    # checked exactly below
+    chord = 2 * np.sin(min(radius / EARTH_RADIUS, np.pi) / 2) * (1 + 1e-9) + 1e-12
+    centre_tree = cKDTree(unit_vectors(centre_lon, centre_lat))
+    pairs = centre_tree.sparse_distance_matrix(tree, chord, output_type='ndarray')
+    centre, point = pairs['i'], pairs['j']
+    distance = haversine(centre_lon[centre], centre_lat[centre],
+                         longitude[point].astype(float), latitude[point].astype(float))
+    keep = distance < radius
+    centre, point, distance = centre[keep], point[keep], distance[keep]
+
+    order = np.lexsort((point, centre))
+    offsets = np.zeros(len(centre_lon) + 1, dtype=int)
+    np.cumsum(np.bincount(centre, minlength=len(centre_lon)), out=offsets[1:])
+    if return_distance:
+        return offsets, point[order], distance[order]
+    return offsets, point[order]
@@ -52,7 +52,7 @@ def get_slug(
 
 
 def get_source(level=1):
-    frame = inspect.stack()
+    frame = inspect.stack(context=0)
     if type(frame) is list:
         frame = frame[level]
 
@@ -72,11 +72,14 @@ def add_info(msg, level=3):
 
 
 def debug(msg, *args, **kwargs):
-    return logging.debug(add_info(msg), *args, **kwargs)
+    # Finding the source is slow, so skip it if the message is not logged
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        return logging.debug(add_info(msg), *args, **kwargs)
 
 
 def info(msg, *args, **kwargs):
-    return logging.info(add_info(msg), *args, **kwargs)
+    if logging.getLogger().isEnabledFor(logging.INFO):
+        return logging.info(add_info(msg), *args, **kwargs)
 
 
 def warning(msg, *args, **kwargs):
@@ -3,12 +3,21 @@ Python definitions used to help with plotting routines.
 
 *Methods Overview*
     -> geo_scatter(): Geographical scatter plot.
+    -> decimate_section(): Block average a (depth, distance) section to the
+                           resolution it will be drawn at
+    -> plot_sections(): Render many section plots to files in worker processes
 '''
 
 import matplotlib.pyplot as plt
 from warnings import warn
 from .logging_util import get_slug, debug, info, warn, error
 import numpy as np
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+# The figure reused by plot_sections() in each process
+_section_template = {}
 
 def r2_lin(x, y, fit):
     '''For calculating r-squared of a linear fit. Fit should be a python polyfit
@@ -252,4 +261,152 @@ def determine_clim_by_standard_deviation(color_data, n_std_dev=2.5):
     color_data_std = np.nanstd(color_data)
     vmin = color_data_mean - n_std_dev*color_data_std
     vmax = color_data_mean + n_std_dev*color_data_std
-    return vmin, vmax 
\ No newline at end of file
+    return vmin, vmax
+
+
+def decimate_section(values, depth, r_dim, n_columns, n_rows):
+    '''
+    Block averages (ignoring NaNs) a section of values (depth levels, points
+    along the section) down to at most n_columns points along the section
+    and n_rows levels, e.g. the number of pixels it is drawn on. Sections
+    already at or below that size are returned unchanged.
+
+    Parameters
+    ----------
+    values, depth : 2D arrays (z_dim, r_dim), depth may also be 1D (z_dim)
+    r_dim : 1D array of the position along the section
+    n_columns, n_rows : the maximum size of the output
+
+    Returns
+    -------
+    values, depth (2D) and r_dim (1D) arrays, decimated
+    '''
+    values = np.asarray(values, dtype=float)
+    depth = np.broadcast_to(np.asarray(depth, dtype=float).reshape(
+                                (values.shape[0], -1)), values.shape)
+    r_dim = np.asarray(r_dim, dtype=float)
+    factor_z = max(int(np.ceil(values.shape[0] / max(n_rows, 1))), 1)
+    factor_r = max(int(np.ceil(values.shape[1] / max(n_columns, 1))), 1)
+    if factor_z == 1 and factor_r == 1:
+        return values, np.array(depth), r_dim
+    debug(f"Decimating a section of shape {values.shape} by {factor_z} x {factor_r}")
+
+    def block_mean(array, factors):
+        pad = [(0, -size % factor) for size, factor in zip(array.shape, factors)]
+        array = np.pad(array, pad, constant_values=np.nan)
+        shape = []
+        for size, factor in zip(array.shape, factors):
+            shape.extend([size // factor, factor])
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            return np.nanmean(array.reshape(shape), axis=tuple(range(1, 2 * len(factors), 2)))
+
+    return ( block_mean(values, (factor_z, factor_r)), block_mean(depth, (factor_z, factor_r)),
+             block_mean(r_dim, (factor_r,)) )
+
+
+def plot_sections(sections, filename, times=(0,), var='normal_velocities',
+                  plot_info=None, cmap='seismic', dpi=100, n_workers=None):
+    '''
+    Renders section plots of a variable against depth and position along
+    the section for many sections and times, saving each to a file. Each
+    time slice is decimated to the resolution of the figure before it is
+    drawn, and the plots are drawn in parallel worker processes. Each
+    worker reuses one figure, axes and colourbar for all its plots.
+
+    Example usage:
+        files = coast.plot_util.plot_sections(
+                    [tran_f, cont_f], 'velocity_{section}_{time}.png', times=range(24),
+                    plot_info={'fig_size':(5,3), 'title':'Normal velocities'})
+
+    Parameters
+    ----------
+    sections : list of Transect_f or Contour_f objects (after the cross
+        flow is calculated), or of xarray.Datasets with var (t_dim, z_dim,
+        r_dim) and depth_0 (z_dim, r_dim)
+    filename : output file name, formatted with the index of the section
+        and the time as {section} and {time}
+    times : time indices (t_dim) to plot for every section
+    var : name of the variable to plot
+    plot_info : dictionary of infomation {'fig_size': value, 'title': value,
+        'vmin':value, 'vmax':value, 'label':value}. If vmin and vmax are
+        not set then the colourbar will be centred at zero. The title is
+        formatted with {section} and {time}.
+    cmap : colour map
+    dpi : resolution of the saved figures
+    n_workers : number of worker processes. Default is the number of CPUs;
+        1 renders in this process.
+
+    Returns
+    -------
+    list of the file names written
+    '''
+    plot_info = dict({'fig_size':(5,3), 'title':'', 'label':var}, **(plot_info or {}))
+    # The pixels covered by the axes of the template figure
+    n_columns = int(plot_info['fig_size'][0] * dpi * 0.6)
+    n_rows = int(plot_info['fig_size'][1] * dpi * 0.75)
+
+    jobs = []
+    for isection, section in enumerate(sections):
+        ds = getattr(section, 'data_cross_tran_flow', getattr(section, 'data_cross_flow', section))
+        for time in times:
+            data = ds[[var, 'depth_0']]
+            if 't_dim' in data[var].dims:
+                data = data.isel(t_dim=time)
+            values = data[var].transpose('z_dim', 'r_dim').values
+            depth = data.depth_0.transpose('z_dim', 'r_dim').values
+            # Leave out points with no depths, e.g. the last point of a
+            # contour, which has no segment
+            has_depth = ~np.all(np.isnan(depth), axis=0)
+            values, depth, r_dim = decimate_section(values[:, has_depth], depth[:, has_depth],
+                                                    np.flatnonzero(has_depth),
+                                                    n_columns, n_rows)
+            jobs.append({'values': values, 'depth': depth, 'r_dim': r_dim,
+                         'filename': filename.format(section=isection, time=time),
+                         'title': plot_info['title'].format(section=isection, time=time),
+                         'plot_info': plot_info, 'cmap': cmap, 'dpi': dpi})
+    debug(f"Rendering {len(jobs)} section plots")
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = min(n_workers, len(jobs))
+    if n_workers <= 1:
+        return [_render_section(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(_render_section, jobs,
+                                 chunksize=max(len(jobs) // (4 * n_workers), 1)))
+
+
+def _render_section(job):
+    ''' Draws one decimated section on this process's template figure. '''
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    plot_info = job['plot_info']
+    key = (tuple(plot_info['fig_size']), job['dpi'])
+    if key not in _section_template:
+        fig = Figure(figsize=plot_info['fig_size'], dpi=job['dpi'])
+        FigureCanvasAgg(fig)
+        ax = fig.add_axes([0.15, 0.15, 0.6, 0.75])
+        cax = fig.add_axes([0.8, 0.15, 0.03, 0.75])
+        _section_template[key] = (fig, ax, cax)
+    fig, ax, cax = _section_template[key]
+    ax.clear()
+    cax.clear()
+
+    values = job['values']
+    r_dim_2d = np.broadcast_to(job['r_dim'], values.shape)
+    if 'vmin' in plot_info and 'vmax' in plot_info:
+        vmin, vmax = plot_info['vmin'], plot_info['vmax']
+    else:
+        lim = np.nanmax(np.abs(values)) if np.any(np.isfinite(values)) else 1
+        vmin, vmax = -lim, lim
+    mesh = ax.pcolormesh(r_dim_2d, job['depth'], values, cmap=job['cmap'],
+                         vmin=vmin, vmax=vmax, shading='auto')
+    fig.colorbar(mesh, cax=cax, label=plot_info['label'])
+    ax.set_title(job['title'])
+    ax.set_ylabel('Depth [m]')
+    ax.set_xticks([job['r_dim'][0], job['r_dim'][-1]])
+    ax.set_xticklabels(['A', 'B'])
+    ax.invert_yaxis()
+    fig.savefig(job['filename'], dpi=job['dpi'])
+    return job['filename']
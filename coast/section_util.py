@@ -0,0 +1,717 @@
+'''
+Python definitions shared by the TRANSECT and CONTOUR modules for sections,
+i.e. 4-connected paths of (y, x) indices through the model grid.
+
+*Methods Overview*
+    -> gen_z_levels(): Standard z-levels down to a maximum depth
+    -> polyline_indices(): Straight index-space legs through many waypoints
+    -> great_circle_points(): Points along great circle arcs through waypoints
+    -> four_connected(): Replace diagonal steps of a path, in one insert
+    -> shortest_path_rule(), isobath_rule(): Tie-breaks for four_connected()
+    -> segment_steps(): Direction of each segment along a section
+    -> gather_points(): One indexed read of the unique (y, x) points needed
+    -> interpolate_columns_to_z(): Vectorised profile interpolation to z-levels
+    -> geostrophic_flow(): Geostrophic velocities and transports across a section
+    -> normal_point_metrics(): u/v grid variables at the normal velocity points
+    -> TransportOperator: Sparse operator from u/v fields to transports
+                          across many sections at once
+'''
+
+import numpy as np
+import xarray as xr
+import gsw
+import warnings
+from scipy import sparse
+from scipy.integrate import cumtrapz
+from .logging_util import get_slug, debug, info, warn, error
+
+GRAVITY = 9.8 # m s^-2
+EARTH_ROT_RATE = 7.2921 * 10**(-5) # rad/s
+EARTH_RADIUS = 6371.007176 # km
+
+
+def gen_z_levels(max_depth):
+    '''
+    Generates a pre-defined 1d vertical depth coordinate, i.e. horizontal
+    z-level vertical coordinates up to a supplied maximum depth, 'max_depth'
+    '''
+    max_depth = max_depth + 650
+    z_levels_0_50 = np.arange(0,55,5)
+    z_levels_60_290 = np.arange(60,300,10)
+    z_levels_300_600 = np.arange(300,650,50)
+    z_levels_650_ = np.arange(650,max_depth+150,150)
+    z_levels = np.concatenate( (z_levels_0_50, z_levels_60_290,
+                                z_levels_300_600, z_levels_650_) )
+    z_levels = z_levels[z_levels <= max_depth]
+    return z_levels
+
+
+def polyline_indices(y_points, x_points):
+    '''
+    Rasterises a polyline through waypoints in index space. Each leg is a
+    straight line of max(|dy|, |dx|) + 1 points rounded to the grid, as
+    NEMO.transect_indices, so consecutive points differ by at most one
+    index in y and x. Shared points between legs and repeated points are
+    kept once. All legs are generated together, without a loop.
+
+    Parameters
+    ----------
+    y_points, x_points : 1d arrays of (possibly fractional) y and x indices
+        of the waypoints
+
+    Returns
+    -------
+    y_ind, x_ind : 1d int arrays of the indices along the path
+    '''
+    y_points = np.atleast_1d(np.asarray(y_points, dtype=float))
+    x_points = np.atleast_1d(np.asarray(x_points, dtype=float))
+    delta_y = np.diff(y_points)
+    delta_x = np.diff(x_points)
+    n_steps = np.ceil(np.maximum(np.abs(delta_y), np.abs(delta_x))).astype(int)
+    # Points 1..n_steps of each leg, as np.linspace( start, stop, n_steps+1 )
+    leg = np.repeat(np.arange(len(n_steps)), n_steps)
+    k = np.arange(leg.size) - np.repeat(np.cumsum(n_steps) - n_steps, n_steps) + 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        step_y = delta_y[leg] / n_steps[leg]
+        step_x = delta_x[leg] / n_steps[leg]
+    last = k == n_steps[leg]
+    y_ind = np.where(last, y_points[1:][leg], k * step_y + y_points[:-1][leg])
+    x_ind = np.where(last, x_points[1:][leg], k * step_x + x_points[:-1][leg])
+    y_ind = np.round(np.concatenate((y_points[:1], y_ind))).astype(int)
+    x_ind = np.round(np.concatenate((x_points[:1], x_ind))).astype(int)
+    keep = np.concatenate(([True], (np.diff(y_ind) != 0) | (np.diff(x_ind) != 0)))
+    return y_ind[keep], x_ind[keep]
+
+
+def great_circle_points(latitude, longitude, spacing=1.):
+    '''
+    Points along the great circle arcs joining waypoints, no further than
+    spacing (km) apart. Use a spacing finer than the model grid and map
+    the points to the grid to follow a great circle rather than a straight
+    line in index space.
+
+    Parameters
+    ----------
+    latitude, longitude : 1d arrays of the waypoints (degrees)
+    spacing : maximum distance between points (km)
+
+    Returns
+    -------
+    latitude, longitude : 1d arrays of points along the arcs, including
+        the waypoints
+    '''
+    lat = np.deg2rad(np.atleast_1d(np.asarray(latitude, dtype=float)))
+    lon = np.deg2rad(np.atleast_1d(np.asarray(longitude, dtype=float)))
+    xyz = np.stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)), axis=-1)
+    start, end = xyz[:-1], xyz[1:]
+    angle = np.arctan2(np.linalg.norm(np.cross(start, end), axis=-1),
+                       np.sum(start * end, axis=-1))
+    n_steps = np.maximum(np.ceil(angle * EARTH_RADIUS / spacing).astype(int), 1)
+    leg = np.repeat(np.arange(len(n_steps)), n_steps)
+    fraction = ( np.arange(leg.size) - np.repeat(np.cumsum(n_steps) - n_steps, n_steps)
+                 + 1 ) / n_steps[leg]
+    # Spherical linear interpolation
+    sin_angle = np.sin(angle[leg])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight_start = np.where(sin_angle > 0, np.sin((1 - fraction) * angle[leg]) / sin_angle,
+                                1 - fraction)
+        weight_end = np.where(sin_angle > 0, np.sin(fraction * angle[leg]) / sin_angle, fraction)
+    points = weight_start[:, np.newaxis] * start[leg] + weight_end[:, np.newaxis] * end[leg]
+    points = np.concatenate((xyz[:1], points))
+    lat_out = np.rad2deg(np.arctan2(points[:, 2], np.hypot(points[:, 0], points[:, 1])))
+    lon_out = np.rad2deg(np.arctan2(points[:, 1], points[:, 0]))
+    return lat_out, lon_out
+
+
+def four_connected(y_ind, x_ind, y_first=True):
+    '''
+    Redefines a path so that each point is separated from its neighbours
+    by a single index change in y or x, but not both. Each diagonal step
+    gains a point, stepping in y first, i.e. through (y[i+1], x[i]), or in
+    x first, through (y[i], x[i+1]). All the new points are inserted with
+    a single concatenation.
+
+    Parameters
+    ----------
+    y_ind, x_ind : 1d int arrays of an 8-connected path
+    y_first : bool, or a function f(y, x) of the indices at the start of
+        the diagonal steps returning a bool array, True to step in y first.
+        See shortest_path_rule() and isobath_rule().
+
+    Returns
+    -------
+    y_ind, x_ind : 1d int arrays of the 4-connected path
+    '''
+    y_ind = np.asarray(y_ind)
+    x_ind = np.asarray(x_ind)
+    spacing = np.abs(np.diff(y_ind)) + np.abs(np.diff(x_ind))
+    if spacing.size and spacing.max() > 2:
+        raise ValueError("The path is not continuous. The path must be defined on "
+                         "adjacent grid points.")
+    diagonal = np.nonzero(spacing == 2)[0]
+    if callable(y_first):
+        y_first = y_first(y_ind[diagonal], x_ind[diagonal])
+    y_first = np.broadcast_to(y_first, diagonal.shape)
+    y_new = np.where(y_first, y_ind[diagonal + 1], y_ind[diagonal])
+    x_new = np.where(y_first, x_ind[diagonal], x_ind[diagonal + 1])
+    return np.insert(y_ind, diagonal + 1, y_new), np.insert(x_ind, diagonal + 1, x_new)
+
+
+def shortest_path_rule(e1, e2):
+    '''
+    Tie-break for four_connected(): step in y first where the distance
+    e2[y, x] + e1[y+1, x] is shorter than e1[y, x] + e2[y, x+1].
+
+    Parameters
+    ----------
+    e1, e2 : 2d arrays (y_dim, x_dim) of the grid spacing
+    '''
+    e1 = np.asarray(e1)
+    e2 = np.asarray(e2)
+    def rule(y, x):
+        y_next = np.minimum(y + 1, e1.shape[0] - 1)
+        x_next = np.minimum(x + 1, e1.shape[1] - 1)
+        return e2[y, x] + e1[y_next, x] < e2[y, x_next] + e1[y, x]
+    return rule
+
+
+def isobath_rule(bathymetry, depth):
+    '''
+    Tie-break for four_connected(): step in y first where the depth at
+    [y+1, x] is at least as close to the isobath depth as at [y, x+1].
+
+    Parameters
+    ----------
+    bathymetry : 2d array (y_dim, x_dim)
+    depth : depth of the isobath
+    '''
+    bathymetry = np.asarray(bathymetry)
+    def rule(y, x):
+        y_next = np.minimum(y + 1, bathymetry.shape[0] - 1)
+        x_next = np.minimum(x + 1, bathymetry.shape[1] - 1)
+        return ( np.abs(bathymetry[y_next, x] - depth)
+                 <= np.abs(bathymetry[y, x_next] - depth) )
+    return rule
+
+
+def segment_steps(y_ind, x_ind):
+    '''
+    The change in y and x index along each segment of a section, where a
+    segment joins the points r and r+1. On an f-grid section the velocity
+    normal to a segment is u where dy != 0 and v where dx != 0, found on the
+    u or v grid at section point normal_point.
+
+    Returns
+    -------
+    dy, dx : 1d int arrays (n_segments)
+    normal_point : 1d int array (n_segments), index along the section of the
+        u/v point between the two f-points of each segment
+    '''
+    dy = np.diff(np.asarray(y_ind))
+    dx = np.diff(np.asarray(x_ind))
+    normal_point = np.arange(len(dy)) + ((dy > 0) | (dx > 0))
+    return dy, dx, normal_point
+
+
+def gather_points(dataset, y_points, x_points, dim='c_dim'):
+    '''
+    Subsets a dataset at many (y, x) points with a single vectorised isel,
+    reading each distinct point once. The points are read in grid order.
+
+    Parameters
+    ----------
+    dataset : xarray.Dataset with y_dim and x_dim
+    y_points, x_points : int arrays of the same (any) shape
+    dim : name of the new dimension of distinct points
+
+    Returns
+    -------
+    gathered : xarray.Dataset with dim in place of y_dim and x_dim
+    inverse : int array, the shape of y_points, indexing dim for each point
+    '''
+    y_points, x_points = np.broadcast_arrays(np.asarray(y_points),
+                                             np.asarray(x_points))
+    shape = (dataset.dims['y_dim'], dataset.dims['x_dim'])
+    flat = np.ravel_multi_index((y_points.ravel(), x_points.ravel()), shape)
+    unique, inverse = np.unique(flat, return_inverse=True)
+    y_unique, x_unique = np.unravel_index(unique, shape)
+    debug(f"Gathering {len(unique)} distinct points of {flat.size} from {get_slug(dataset)}")
+    gathered = dataset.isel(y_dim=xr.DataArray(y_unique, dims=[dim]),
+                            x_dim=xr.DataArray(x_unique, dims=[dim]))
+    return gathered, inverse.reshape(y_points.shape)
+
+
+def interpolate_columns_to_z(values, depth, z_levels):
+    '''
+    Linearly interpolates many profiles from their own depths on to common
+    z_levels, extrapolating beyond the ends of each profile. This gives
+    the result of scipy's interp1d(..., fill_value="extrapolate") for every
+    profile without looping over them.
+
+    NaNs are dropped from a profile before interpolating, as with
+    numpy.ma.compressed(), and the remaining values are paired with the
+    shallowest depths. Profiles with no valid values are set to zero and
+    profiles with a single valid value are set to that value.
+
+    Parameters
+    ----------
+    values : array (t_dim, z_dim, c_dim) of profiles
+    depth : array (z_dim, c_dim), increasing with z_dim
+    z_levels : 1d array of depths to interpolate to
+
+    Returns
+    -------
+    array (t_dim, len(z_levels), c_dim)
+    '''
+    values = np.asarray(values)
+    depth = np.asarray(depth)
+    nt, nz, nc = values.shape
+    valid = ~np.isnan(values)
+    n_valid = valid.sum(axis=1)[:, np.newaxis, :]
+    # Pack the valid values to the top of each profile
+    order = np.argsort(~valid, axis=1, kind='stable')
+    packed = np.take_along_axis(values, order, axis=1)
+
+    # Interpolation interval of each z-level, as np.searchsorted(depth, z)
+    # clipped to the valid part of each profile
+    hi = (depth[np.newaxis, :, :] < z_levels[:, np.newaxis, np.newaxis]).sum(axis=1)
+    hi = np.minimum(hi[np.newaxis, :, :], n_valid - 1)
+    hi = np.clip(hi, 1, max(nz - 1, 1))
+    lo = hi - 1
+    depth = np.broadcast_to(depth, (nt, nz, nc))
+    x_lo = np.take_along_axis(depth, lo, axis=1)
+    x_hi = np.take_along_axis(depth, hi, axis=1)
+    y_lo = np.take_along_axis(packed, lo, axis=1)
+    y_hi = np.take_along_axis(packed, hi, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (y_hi - y_lo) / (x_hi - x_lo)
+        interpolated = slope * (z_levels[np.newaxis, :, np.newaxis] - x_lo) + y_lo
+
+    interpolated = np.where(n_valid > 1, interpolated, packed[:, :1, :])
+    return np.where(n_valid > 0, interpolated, 0)
+
+
+def geostrophic_flow(nemo_t, section: xr.Dataset, y_ind, x_ind,
+                     ref_density=None, time_chunk=None):
+    '''
+    Calculates the geostrophic velocity and volume transport across each
+    segment of a section on the f-grid.
+
+    The density and pressure are needed on the four t-points around each
+    f-point, (j,i), (j+1,i), (j,i+1) and (j+1,i+1). The distinct t-point
+    columns are read from nemo_t in one indexed read and the density and
+    pressure are calculated once per column, by interpolating temperature
+    and salinity on to z-levels and using the EOS10 equation of state.
+    If nemo_t is dask-backed (or time_chunk is given) the result is lazy
+    and is calculated chunk by chunk in time.
+
+    The hydrostatic pressure on each z-level has its mean removed to reduce
+    the noise in the horizontal gradients. If ref_density is None, as in
+    Transect_t.construct_pressure, the pressure at each of the four sets of
+    t-points is relative to the mean density of that set, and the mean
+    density of all four sets is the reference for the velocities.
+
+    Parameters
+    ----------
+    nemo_t : NEMO object on the t-grid for the entire domain. Must contain
+        temperature, salinity, ssh, depth_0, bathymetry, e1 and e2.
+    section : xarray.Dataset of the f-grid along the section (r_dim). Must
+        contain latitude, e1, e2 and bathymetry.
+    y_ind, x_ind : 1d int arrays, f-grid indices of the section
+    ref_density : float, optional. Reference density.
+    time_chunk : int, optional. Number of times per dask chunk.
+
+    Returns
+    -------
+    xarray.Dataset on (t_dim, depth_z_levels, r_dim), with r_dim along the
+    segments of the section, containing:
+        normal_velocity_hpg, normal_velocity_spg (m/s),
+        normal_transport_hpg, normal_transport_spg (Sv),
+        e12 (horizontal scale factor along the section at the normal
+        velocity points) and bathymetry (at the normal velocity points)
+    '''
+    debug(f"Calculating geostrophic flow across {len(y_ind)} points with {get_slug(nemo_t)}")
+    y_ind = np.asarray(y_ind)
+    x_ind = np.asarray(x_ind)
+
+    # The four t-points around each f-point: (j,i), (j+1,i), (j,i+1), (j+1,i+1)
+    y_corners = y_ind[np.newaxis, :] + np.array([[0], [1], [0], [1]])
+    x_corners = x_ind[np.newaxis, :] + np.array([[0], [0], [1], [1]])
+    variables = ['salinity', 'temperature', 'ssh', 'depth_0', 'bathymetry',
+                 'latitude', 'longitude', 'e1', 'e2']
+    columns, corners = gather_points(nemo_t.dataset.reset_coords()[variables],
+                                     y_corners, x_corners)
+    time = nemo_t.dataset['time'] if 'time' in nemo_t.dataset else None
+    has_time = 't_dim' in columns.salinity.dims
+    if not has_time:
+        for var in ['salinity', 'temperature', 'ssh']:
+            columns[var] = columns[var].expand_dims(dim={'t_dim':1}, axis=0)
+    if time_chunk is not None:
+        columns = columns.chunk({'t_dim': time_chunk})
+    if columns.chunks:
+        columns = columns.chunk({'z_dim': -1, 'c_dim': -1})
+
+    z_levels = gen_z_levels(float(columns.bathymetry.max()))
+
+    # Density and hydrostatic pressure once per distinct column
+    density = xr.apply_ufunc(_density_on_z_levels, columns.salinity, columns.temperature,
+                columns.depth_0, columns.latitude, columns.longitude,
+                kwargs={'z_levels': z_levels},
+                input_core_dims=[['z_dim', 'c_dim'], ['z_dim', 'c_dim'],
+                                 ['z_dim', 'c_dim'], ['c_dim'], ['c_dim']],
+                output_core_dims=[['depth_z_levels', 'c_dim']],
+                dask='parallelized', output_dtypes=[np.float64],
+                dask_gufunc_kwargs={'output_sizes': {'depth_z_levels': len(z_levels)}})
+    pressure_h = xr.apply_ufunc(_hydrostatic_pressure, density,
+                kwargs={'z_levels': z_levels,
+                        'ref_density': 0 if ref_density is None else ref_density},
+                input_core_dims=[['depth_z_levels', 'c_dim']],
+                output_core_dims=[['depth_z_levels', 'c_dim']],
+                dask='parallelized', output_dtypes=[np.float64])
+
+    def at_corner(variable, corner):
+        return variable.isel(c_dim=xr.DataArray(corners[corner], dims=['r_dim']))
+
+    # Pressures at each set of t-points, T=(j,i), J=(j+1,i), I=(j,i+1), JI=(j+1,i+1)
+    density_c = [at_corner(density, corner) for corner in range(4)]
+    p_h = []
+    p_s = []
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        for corner in range(4):
+            if ref_density is None:
+                ref_corner = density_c[corner].mean()
+                p_h.append( at_corner(pressure_h, corner) - GRAVITY * ref_corner
+                            * xr.DataArray(z_levels - z_levels[0], dims=['depth_z_levels']) )
+            else:
+                ref_corner = ref_density
+                p_h.append( at_corner(pressure_h, corner) )
+            p_s.append( ref_corner * GRAVITY * at_corner(columns.ssh, corner) )
+
+        # Remove the mean hydrostatic pressure on each z_level
+        pressure_h_zlevel_mean = xr.concat( p_h, dim='concat_dim' ) \
+                                    .mean(dim=('concat_dim', 'r_dim', 't_dim'), skipna=True)
+        if ref_density is None:
+            ref_density = xr.concat( density_c, dim='concat_dim' ).mean(skipna=True)
+    p_h = [p - pressure_h_zlevel_mean for p in p_h]
+    e1 = [at_corner(columns.e1, corner) for corner in range(4)]
+    e2 = [at_corner(columns.e2, corner) for corner in range(4)]
+    T, J, I, JI = range(4)
+
+    # Pressure gradients at the f-points, for u and v normal to the section
+    e2v = 0.5 * ( e2[J] + e2[T] )
+    e2v_i1 = 0.5 * ( e2[JI] + e2[I] )
+    e1v = 0.5 * ( e1[J] + e1[T] )
+    e1v_i1 = 0.5 * ( e1[JI] + e1[I] )
+    e1f = 0.5 * ( e1v + e1v_i1 )
+    e1u = 0.5 * ( e1[I] + e1[T] )
+    e1u_j1 = 0.5 * ( e1[JI] + e1[J] )
+    e2u = 0.5 * ( e2[I] + e2[T] )
+    e2u_j1 = 0.5 * ( e2[JI] + e2[J] )
+    e2f = 0.5 * ( e2u + e2u_j1 )
+
+    def grad_u(p):
+        return 0.5 * ( ( e1v * (p[J] - p[T]) / e2v ) + ( e1v_i1 * (p[JI] - p[I]) / e2v_i1 ) ) / e1f
+
+    def grad_v(p):
+        return 0.5 * ( ( e2u * (p[I] - p[T]) / e1u ) + ( e2u_j1 * (p[JI] - p[J]) / e1u_j1 ) ) / e2f
+
+    # Average the gradients at the two f-points of each segment on to the
+    # normal velocity point, where the velocity is u (dy != 0) or v (dx != 0)
+    dy, dx, normal_point = segment_steps(y_ind, x_ind)
+    is_u = dy != 0
+    direction = xr.DataArray( np.where(is_u, -dy, -dx), dims=['r_dim'] )
+    e_horiz = xr.DataArray( np.select( [dy > 0, dy < 0, dx > 0],
+                    [0.5 * ( e2[J] + e2[JI] ).values[:-1], 0.5 * ( e2[T] + e2[I] ).values[:-1],
+                     0.5 * ( e1[I] + e1[JI] ).values[:-1]], 0.5 * ( e1[T] + e1[J] ).values[:-1] ),
+                    dims=['r_dim'] )
+    f = 2 * EARTH_ROT_RATE * np.sin( np.deg2rad(section.latitude.values) )
+    e1f_section = section.e1.values
+    e2f_section = section.e2.values
+    e_horiz_f = [ xr.DataArray(np.where(is_u, e2f_section[:-1], e1f_section[:-1]), dims=['r_dim']),
+                  xr.DataArray(np.where(is_u, e2f_section[1:], e1f_section[1:]), dims=['r_dim']) ]
+    f = [ xr.DataArray(f[:-1], dims=['r_dim']), xr.DataArray(f[1:], dims=['r_dim']) ]
+    is_u = xr.DataArray(is_u, dims=['r_dim'])
+
+    def normal_velocity(p):
+        grad_r0 = xr.where( is_u, grad_u(p).isel(r_dim=slice(None, -1)),
+                            grad_v(p).isel(r_dim=slice(None, -1)) )
+        grad_r1 = xr.where( is_u, grad_u(p).isel(r_dim=slice(1, None)),
+                            grad_v(p).isel(r_dim=slice(1, None)) )
+        return ( direction * 0.5 * ( e_horiz_f[0] * grad_r0 / f[0] + e_horiz_f[1] * grad_r1 / f[1] )
+                 / (e_horiz * ref_density) )
+
+    normal_velocity_hpg = normal_velocity(p_h)
+    normal_velocity_spg = normal_velocity(p_s)
+
+    # Bathymetry at normal velocity points. Remove redundant levels below it
+    H = 0.5 * ( section.bathymetry.values[:-1] + section.bathymetry.values[1:] )
+    active_z_levels = np.count_nonzero( z_levels[:, np.newaxis] <= H, axis=0 ).max()
+    H = xr.DataArray(H, dims=['r_dim'])
+    depth_z_levels = xr.DataArray(z_levels, dims=['depth_z_levels'])
+    normal_velocity_hpg = normal_velocity_hpg.where( depth_z_levels <= H ) \
+                            .isel(depth_z_levels=slice(None, active_z_levels))
+
+    flow = xr.Dataset()
+    flow['normal_velocity_hpg'] = normal_velocity_hpg.transpose('t_dim', 'depth_z_levels', 'r_dim')
+    flow['normal_velocity_spg'] = normal_velocity_spg.transpose('t_dim', 'r_dim')
+    flow = flow.assign_coords(depth_z_levels=z_levels[:active_z_levels])
+    flow['normal_transport_hpg'] = ( flow.normal_velocity_hpg.fillna(0)
+                                     .integrate(coord='depth_z_levels') * e_horiz / 1000000 )
+    flow['normal_transport_spg'] = flow.normal_velocity_spg * H * e_horiz / 1000000
+    flow['e12'] = e_horiz
+    flow['bathymetry'] = H
+    if has_time:
+        if time is not None:
+            flow = flow.assign_coords(time=time)
+    else:
+        flow = flow.squeeze('t_dim', drop=True)
+    return flow
+
+
+def normal_point_metrics(y_ind, x_ind, nemo_u=None, nemo_v=None,
+                         variables=('latitude', 'longitude'), fn_domain=None):
+    '''
+    Variables from the u and v grids at the normal velocity point of each
+    segment of a section on the f-grid, i.e. from the u-grid where the
+    section steps in y and from the v-grid where it steps in x.
+
+    Parameters
+    ----------
+    y_ind, x_ind : 1d int arrays, f-grid indices of the section
+    nemo_u, nemo_v : NEMO objects on the u and v grids. If either is not
+        given that grid is loaded from the domain file fn_domain.
+    variables : names of the variables to take, e.g. latitude, e1, depth_0
+    fn_domain : domain file, only used if nemo_u or nemo_v is None
+
+    Returns
+    -------
+    xarray.Dataset of the variables along the segments (r_dim)
+    '''
+    from .NEMO import NEMO # Here as NEMO uses this module
+    variables = list(variables)
+    dy, dx, normal_point = segment_steps(y_ind, x_ind)
+    da_y_ind = xr.DataArray( np.asarray(y_ind)[normal_point], dims=['r_dim'] )
+    da_x_ind = xr.DataArray( np.asarray(x_ind)[normal_point], dims=['r_dim'] )
+    grids = []
+    for nemo, grid_ref in [(nemo_u, 'u-grid'), (nemo_v, 'v-grid')]:
+        if nemo is None:
+            info(f"Loading the {grid_ref} from the domain file for the section metrics")
+            nemo = NEMO( fn_domain=fn_domain, grid_ref=grid_ref )
+        dataset = nemo.dataset.reset_coords()[variables]
+        grids.append( dataset.isel(y_dim=da_y_ind, x_dim=da_x_ind) )
+    is_u = xr.DataArray(dy != 0, dims=['r_dim'])
+    return xr.where(is_u, grids[0], grids[1])
+
+
+class TransportOperator():
+    '''
+    A sparse linear operator mapping u and v velocity fields (z_dim, y_dim,
+    x_dim) to the depth integrated volume transport across every segment of
+    many sections on the f-grid, e.g. Transect_f and Contour_f objects.
+
+    The operator is built once from the section indices. Each segment picks
+    out the u or v column at its normal velocity point (as
+    Transect_f.calc_flow_across_transect and Contour_f.calc_cross_contour_flow)
+    with the sign of the flow across the section and the e2 or e1 and e3
+    weights. apply() then computes all the transport time series in one
+    pass over the velocity output, as a sparse matrix product for each time
+    chunk. Missing velocities count as zero.
+
+    If a time varying cell thickness (e3) is on the u and v grids it is
+    multiplied in as the operator is applied, if not the initial cell
+    thickness (e3_0) is part of the operator.
+
+    Example usage:
+        operator = coast.section_util.TransportOperator(
+                        [tran_f, cont_f], nemo_u, nemo_v, names=['strait', 'shelf'])
+        transports = operator.apply(nemo_u, nemo_v, time_chunk=10)
+        transports.section_transport.sel(section='shelf').plot()
+
+    Parameters
+    ----------
+    sections : list of Transect_f or Contour_f objects, or (y_ind, x_ind)
+        tuples of f-grid indices
+    nemo_u, nemo_v : NEMO objects on the u and v grids, for the metrics
+    names : (optional) a name for each section. Default 0, 1, 2, ...
+    '''
+
+    def __init__(self, sections, nemo_u, nemo_v, names=None):
+        if names is None:
+            names = np.arange(len(sections))
+        self.names = np.asarray(names)
+        self.time_varying_e3 = ( 'e3' in nemo_u.dataset.data_vars
+                                 and 'e3' in nemo_v.dataset.data_vars )
+        e3_name = 'e3' if self.time_varying_e3 else 'e3_0'
+        if e3_name not in nemo_u.dataset or e3_name not in nemo_v.dataset:
+            error("e3 or e3_0 needed on the u and v grids to compute transports")
+            raise ValueError("e3 or e3_0 needed on the u and v grids to compute transports")
+        nz = nemo_u.dataset.dims['z_dim']
+        ny = nemo_u.dataset.dims['y_dim']
+        nx = nemo_u.dataset.dims['x_dim']
+        self.field_shape = (nz, ny, nx)
+
+        y_points, x_points, is_u, sign, section = [], [], [], [], []
+        for isection, sec in enumerate(sections):
+            if hasattr(sec, 'y_ind'):
+                y_ind, x_ind = sec.y_ind, sec.x_ind
+            else:
+                y_ind, x_ind = sec
+            y_ind = np.asarray(y_ind)
+            x_ind = np.asarray(x_ind)
+            dy, dx, normal_point = segment_steps(y_ind, x_ind)
+            y_points.append(y_ind[normal_point])
+            x_points.append(x_ind[normal_point])
+            is_u.append(dy != 0)
+            # u flux + north, - south; v flux - east, + west
+            sign.append(np.where(dy != 0, np.sign(dy), -np.sign(dx)))
+            section.append(np.full(len(dy), isection))
+        y_points = np.concatenate(y_points)
+        x_points = np.concatenate(x_points)
+        is_u = np.concatenate(is_u)
+        sign = np.concatenate(sign)
+        self.section_index = np.concatenate(section)
+        self.n_segments = len(self.section_index)
+        debug(f"Building a transport operator for {len(sections)} sections, "
+              f"{self.n_segments} segments")
+
+        # The metrics at the normal velocity points, one isel on each grid
+        metrics = []
+        for nemo, is_grid, e_horiz in [(nemo_u, is_u, 'e2'), (nemo_v, ~is_u, 'e1')]:
+            dataset = nemo.dataset.reset_coords()
+            da_y = xr.DataArray(y_points[is_grid], dims=['seg_dim'])
+            da_x = xr.DataArray(x_points[is_grid], dims=['seg_dim'])
+            points = dataset[['latitude', 'longitude', e_horiz]].isel(y_dim=da_y, x_dim=da_x)
+            metrics.append(points.load())
+            if self.time_varying_e3:
+                e3 = np.ones((nz, is_grid.sum()))
+            else:
+                e3 = dataset.e3_0.isel(y_dim=da_y, x_dim=da_x).transpose('z_dim', 'seg_dim').values
+            weight = np.nan_to_num( sign[is_grid] * points[e_horiz].values * e3 / 1000000. )
+            rows = np.broadcast_to(np.nonzero(is_grid)[0], (nz, is_grid.sum()))
+            columns = ( np.arange(nz)[:, np.newaxis] * ny * nx
+                        + y_points[is_grid] * nx + x_points[is_grid] )
+            operator = sparse.csr_matrix((weight.ravel(), (rows.ravel(), columns.ravel())),
+                                         shape=(self.n_segments, nz * ny * nx))
+            operator.eliminate_zeros()
+            if e_horiz == 'e2':
+                self.operator_u = operator
+            else:
+                self.operator_v = operator
+        self.latitude = np.full(self.n_segments, np.nan)
+        self.longitude = np.full(self.n_segments, np.nan)
+        for points, is_grid in [(metrics[0], is_u), (metrics[1], ~is_u)]:
+            self.latitude[is_grid] = points.latitude.values
+            self.longitude[is_grid] = points.longitude.values
+        self.operator_section = sparse.csr_matrix(
+            (np.ones(self.n_segments), (self.section_index, np.arange(self.n_segments))),
+            shape=(len(sections), self.n_segments))
+
+    def segments(self, section):
+        '''
+        The segment (seg_dim) indices of one section, given by its position
+        in the list of sections.
+        '''
+        return np.nonzero(self.section_index == section)[0]
+
+    def apply(self, nemo_u, nemo_v, time_chunk=None):
+        '''
+        Applies the operator to the velocities of nemo_u and nemo_v. The
+        result is lazy if the velocities are dask arrays or time_chunk is
+        given, with one sparse matrix product per time chunk.
+
+        Parameters
+        ----------
+        nemo_u, nemo_v : NEMO objects on the u and v grids with u_velocity
+            and v_velocity (and e3 if the operator uses time varying e3)
+        time_chunk : (optional) number of time steps in each dask chunk
+
+        Returns
+        -------
+        xarray.Dataset with
+            normal_transport (t_dim, seg_dim) : transport across each segment
+            section_transport (t_dim, section) : total across each section
+        '''
+        flux_u = nemo_u.dataset.u_velocity
+        flux_v = nemo_v.dataset.v_velocity
+        if self.time_varying_e3:
+            flux_u = flux_u * nemo_u.dataset.e3
+            flux_v = flux_v * nemo_v.dataset.e3
+        has_time = 't_dim' in flux_u.dims
+        if not has_time:
+            flux_u = flux_u.expand_dims('t_dim')
+            flux_v = flux_v.expand_dims('t_dim')
+        fluxes = []
+        for flux in [flux_u, flux_v]:
+            flux = flux.reset_coords(drop=True).transpose('t_dim', 'z_dim', 'y_dim', 'x_dim')
+            if time_chunk is not None:
+                flux = flux.chunk({'t_dim': time_chunk})
+            if flux.chunks:
+                flux = flux.chunk({'z_dim': -1, 'y_dim': -1, 'x_dim': -1})
+            fluxes.append(flux)
+
+        normal_transport = xr.apply_ufunc(
+            self._matvec, fluxes[0], fluxes[1],
+            input_core_dims=[['z_dim', 'y_dim', 'x_dim']] * 2,
+            output_core_dims=[['seg_dim']], dask='parallelized',
+            output_dtypes=[float], dask_gufunc_kwargs={'output_sizes':{'seg_dim': self.n_segments}})
+        section_transport = xr.apply_ufunc(
+            lambda transport: (self.operator_section @ transport.T).T, normal_transport,
+            input_core_dims=[['seg_dim']], output_core_dims=[['section']],
+            dask='parallelized', output_dtypes=[float],
+            dask_gufunc_kwargs={'output_sizes':{'section': len(self.names)}})
+
+        transports = xr.Dataset()
+        transports['normal_transport'] = normal_transport
+        transports['section_transport'] = section_transport
+        transports = transports.assign_coords(
+                section=self.names,
+                section_index=(('seg_dim'), self.section_index),
+                latitude=(('seg_dim'), self.latitude),
+                longitude=(('seg_dim'), self.longitude))
+        if has_time and 'time' in nemo_u.dataset.coords:
+            transports = transports.assign_coords(time=nemo_u.dataset.time)
+        if not has_time:
+            transports = transports.squeeze('t_dim', drop=True)
+        transports.normal_transport.attrs = {'units':'Sv',
+                'standard_name':'depth integrated volume transport across each section segment'}
+        transports.section_transport.attrs = {'units':'Sv',
+                'standard_name':'volume transport across each section'}
+        return transports
+
+    def _matvec(self, flux_u, flux_v):
+        shape = flux_u.shape[:-3]
+        flux_u = np.nan_to_num(flux_u.reshape((-1, self.operator_u.shape[1])))
+        flux_v = np.nan_to_num(flux_v.reshape((-1, self.operator_v.shape[1])))
+        transport = self.operator_u @ flux_u.T + self.operator_v @ flux_v.T
+        return transport.T.reshape(shape + (self.n_segments,))
+
+
+def _density_on_z_levels(salinity, temperature, depth, latitude, longitude, z_levels):
+    '''
+    In-situ density (EOS10) on z_levels for arrays of columns (..., z, c),
+    after interpolating the practical salinity and potential temperature.
+    '''
+    shape = salinity.shape
+    salinity = salinity.reshape((-1,) + shape[-2:])
+    temperature = temperature.reshape((-1,) + shape[-2:])
+    salinity_z = interpolate_columns_to_z(salinity, depth, z_levels)
+    temperature_z = interpolate_columns_to_z(temperature, depth, z_levels)
+    # Absolute Pressure (depth must be negative)
+    pressure_absolute = gsw.p_from_z( -z_levels[:, np.newaxis], latitude )
+    # Absolute Salinity
+    salinity_absolute = gsw.SA_from_SP( salinity_z, pressure_absolute, longitude, latitude )
+    salinity_absolute[salinity_absolute < 0] = np.nan
+    # Conservative Temperature
+    temp_conservative = gsw.CT_from_pt( salinity_absolute, temperature_z )
+    # In-situ density
+    density = gsw.rho( salinity_absolute, temp_conservative, pressure_absolute )
+    return density.reshape(shape[:-2] + density.shape[-2:])
+
+
+def _hydrostatic_pressure(density, z_levels, ref_density):
+    '''
+    Hydrostatic perturbation pressure from the cumulative integral of the
+    perturbation density down z_levels (axis -2).
+    '''
+    return -cumtrapz( density - ref_density, x=-z_levels, axis=-2, initial=0 ) * GRAVITY
@@ -5,12 +5,23 @@ Python definitions used to aid with statistical calculations.
     -> normal_distribution(): Create values for a normal distribution
     -> cumulative_distribution(): Integration udner a PDF
     -> empirical_distribution(): Estimates CDF empirically
+    -> doodson_x0_filter(): Doodson X0 tidal filter along an axis
+    -> apply_filter_bank(): Several low-pass tidal filters in one pass
+    -> find_extrema_grid(): High and low waters for every column of a grid
+    -> find_maxima_many(): Cubic spline maxima of many time series at once
 '''
 
 import numpy as np
 import xarray as xr
+import dask
+import dask.array as da
 from .logging_util import get_slug, debug, info, warn, error
 import scipy
+import scipy.interpolate
+import scipy.ndimage
+import scipy.special
+import scipy.signal
+from functools import lru_cache
 
 def quadratic_spline_roots(spl):
     """
@@ -18,17 +29,48 @@ def quadratic_spline_roots(spl):
     https://stackoverflow.com/questions/50371298/find-maximum-minimum-of-a-1d-interpolated-function
     Used in find_maxima().
 
+    The quadratic through the start, middle and end of every knot interval
+    is solved in closed form for all intervals at once. spl may also be a
+    scipy.interpolate.BSpline holding many series (see find_maxima_many()),
+    in which case the roots of each series are returned as the columns of
+    an array padded with NaNs.
+
     Example usage:
     see example_scripts/tidegauge_tutorial.py
     """
-    roots = []
-    knots = spl.get_knots()
-    for a, b in zip(knots[:-1], knots[1:]):
-        u, v, w = spl(a), spl((a+b)/2), spl(b)
-        t = np.roots([u+w-2*v, w-u, 2*v])
-        t = t[np.isreal(t) & (np.abs(t) <= 1)]
-        roots.extend(t*(b-a)/2 + (b+a)/2)
-    return np.sort(roots)
+    if hasattr(spl, 'get_knots'):
+        knots = spl.get_knots()
+    else:
+        knots = np.unique(spl.t)
+    a, b = knots[:-1], knots[1:]
+    u, v, w = spl(a), spl((a+b)/2), spl(b)
+    if u.ndim > 1:
+        a, b = a[:, np.newaxis], b[:, np.newaxis]
+    t = _quadratic_roots(u+w-2*v, w-u, 2*v)
+    roots = t*(b-a)/2 + (b+a)/2
+    if u.ndim == 1:
+        return np.sort(roots[~np.isnan(roots)])
+    return np.sort(roots.reshape((-1,) + roots.shape[2:]), axis=0)
+
+def _quadratic_roots(A, B, C):
+    """
+    Real roots in [-1, 1] of A*t**2 + B*t + C = 0, elementwise. Returns an
+    array with a new leading axis of length 2 (one per root), NaN where 
+    there is no such root. As np.roots, a zero leading coefficient reduces
+    the equation to linear and a double root is returned twice.
+    """
+    roots = np.full((2,) + np.shape(A), np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        disc = B**2 - 4*A*C
+        quadratic = (A != 0) & (disc >= 0)
+        # Numerically stable form of the quadratic formula
+        q = -0.5*(B + np.where(B >= 0, 1, -1)*np.sqrt(np.where(quadratic, disc, 0)))
+        roots[0] = np.where(quadratic, q/A, np.nan)
+        roots[1] = np.where(quadratic, np.where(q != 0, C/q, q/A), np.nan)
+        linear = (A == 0) & (B != 0)
+        roots[0] = np.where(linear, -C/B, roots[0])
+    roots[np.abs(roots) > 1] = np.nan
+    return roots
 
 def find_maxima(x, y, method='comp', **kwargs):
     '''
@@ -49,6 +91,9 @@ def find_maxima(x, y, method='comp', **kwargs):
         JP NOTE: Cubic method:
             i) has ineligent fix for NaNs,
 
+    For many time series sharing the same x, find_maxima_many() fits and
+    searches all of them at once with the cubic method.
+
     Example usage:
     see example_scripts/tidegauge_tutorial.py
     '''
@@ -85,7 +130,7 @@ def find_maxima(x, y, method='comp', **kwargs):
         """
         # Remove NaNs
         I = np.isnan(y)
-        if sum(I) > 0:
+        if I.any():
             print('find_maxima(): There were NaNs in timeseries')
             x = x[np.logical_not(I)]
             y = y[np.logical_not(I)]
@@ -122,9 +167,7 @@ def find_maxima(x, y, method='comp', **kwargs):
         # Convert back to datetime64 if appropriate
         y_out = max_vals
         if flag_dt64:
-            N = len(extr_x_vals[ind])
-            x_out = [np.datetime64('1970-01-01T00:00:00')
-             + np.timedelta64(int(extr_x_vals[ind[i]]), 's') for i in range(N)]
+            x_out = _seconds_to_datetime(extr_x_vals[ind])
         else:
             x_out = extr_x_vals[ind]
 
@@ -137,6 +180,111 @@ def find_maxima(x, y, method='comp', **kwargs):
         return new_x, new_y
 
 
+def find_maxima_many(x, y, axis=0):
+    '''
+    Finds the maxima of many time series sharing the same x (e.g. times) 
+    using the 'cubic' method of find_maxima(): a not-a-knot cubic spline is
+    fitted to every series at once and the roots of its derivative are found
+    for all knot intervals and all series in one vectorised solve.
+    
+    Series containing NaNs are fitted individually, after removing the NaNs.
+    
+    Parameters
+    ----------
+        x (array) : 1D array of increasing x values (float or datetime64)
+        y (array) : Array of values with x along axis
+        axis (int) : Axis of y corresponding to x
+
+    Returns
+    -------
+        x_max, y_max : arrays of shape (n_max, ...) where the remaining 
+        dimensions are those of y without axis and n_max is the largest 
+        number of maxima in any series. Unused elements are NaN (NaT).
+    '''
+    x = np.asarray(x)
+    y = np.moveaxis(np.asarray(y, dtype=np.float64), axis, 0)
+    other_shape = y.shape[1:]
+    y = y.reshape((y.shape[0], -1))
+    
+    flag_dt64 = np.issubdtype(x.dtype, np.datetime64)
+    if flag_dt64: # convert to decimal sec since 1970
+        x_float = ((x - np.datetime64('1970-01-01T00:00:00'))
+                   / np.timedelta64(1, 's')).astype('float64')
+    else:
+        x_float = x.astype('float64')
+    
+    has_nan = np.isnan(y).any(axis=0)
+    n_series = y.shape[1]
+    x_max = [None]*n_series
+    y_max = [None]*n_series
+    
+    groups = [ (np.where(~has_nan)[0], np.ones(len(x_float), dtype=bool)) ]
+    groups += [ (np.array([ii]), ~np.isnan(y[:, ii])) 
+                for ii in np.where(has_nan)[0] ]
+    for columns, valid in groups:
+        if len(columns) == 0 or valid.sum() < 4:
+            continue
+        xx = x_float[valid]
+        yy = y[valid][:, columns]
+        spl = scipy.interpolate.make_interp_spline(xx, yy, k=3, axis=0)
+        roots = quadratic_spline_roots(spl.derivative())
+        # Add buffer points to ensure extrema are within, then find the
+        # roots that are greater than both neighbours (cf. argrelmax)
+        ends = np.broadcast_to(xx[[0, -1], np.newaxis], (2, len(columns)))
+        roots = np.sort(np.concatenate([ends, roots]), axis=0)
+        values = _evaluate_columns(spl, roots)
+        with np.errstate(invalid='ignore'):
+            is_max = np.zeros(values.shape, dtype=bool)
+            is_max[1:-1] = (values[1:-1] > values[:-2]) & \
+                           (values[1:-1] > values[2:])
+        for jj, column in enumerate(columns):
+            x_max[column] = roots[is_max[:, jj], jj]
+            y_max[column] = values[is_max[:, jj], jj]
+    
+    n_max = max([0] + [len(xm) for xm in x_max if xm is not None])
+    x_out = np.full((n_max, n_series), np.nan)
+    y_out = np.full((n_max, n_series), np.nan)
+    for column in range(n_series):
+        if x_max[column] is not None:
+            x_out[:len(x_max[column]), column] = x_max[column]
+            y_out[:len(y_max[column]), column] = y_max[column]
+    
+    if flag_dt64:
+        valid = ~np.isnan(x_out)
+        x_dt = np.full(x_out.shape, np.datetime64('NaT'), dtype='datetime64[s]')
+        x_dt[valid] = _seconds_to_datetime(x_out[valid])
+        x_out = x_dt
+    return x_out.reshape((n_max,) + other_shape), \
+           y_out.reshape((n_max,) + other_shape)
+
+def _evaluate_columns(spl, x):
+    '''
+    Evaluates a spline holding many series (columns) at different points for
+    each series: x has shape (n_points, n_series) and may contain NaNs.
+    Avoids evaluating every series at every point.
+    '''
+    # Taylor coefficients of each polynomial piece at its left breakpoint
+    breaks = np.unique(spl.t)
+    coefficients = [spl(breaks[:-1], nu=nu)/scipy.special.factorial(nu) 
+                    for nu in range(spl.k, -1, -1)]
+    valid = ~np.isnan(x)
+    x_valid = np.where(valid, x, breaks[0])
+    interval = np.clip(np.searchsorted(breaks, x_valid, side='right') - 1, 
+                       0, len(breaks) - 2)
+    dx = x_valid - breaks[interval]
+    columns = np.broadcast_to(np.arange(x.shape[1]), x.shape)
+    values = np.zeros(x.shape)
+    for coefficient in coefficients:
+        values = values*dx + coefficient[interval, columns]
+    values[~valid] = np.nan
+    return values
+
+def _seconds_to_datetime(seconds):
+    ''' Seconds since 1970 to datetime64[s], truncating fractions '''
+    return np.datetime64('1970-01-01T00:00:00') \
+           + np.asarray(seconds).astype(np.int64).astype('timedelta64[s]')
+
+
 def doodson_x0_filter(elevation, ax=0):
     '''
     The Doodson X0 filter is a simple filter designed to damp out the main
@@ -152,7 +300,11 @@ def doodson_x0_filter(elevation, ax=0):
     to earlier Doodson filter, because of their superior ability
     to remove tidal period variability from oceanic signals."
 
-    This routine can be used for any dimension input array.
+    This routine can be used for any dimension input array. The convolution
+    is done along the time axis of the whole array at once using 
+    scipy.ndimage.convolve1d. If the input is a dask array (or a DataArray
+    containing one), the filter is applied lazily to each chunk with a 
+    19 point overlap and a dask array is returned.
 
     Parameters
     ----------
@@ -167,20 +319,370 @@ def doodson_x0_filter(elevation, ax=0):
     if elevation.shape[ax] < 39:
         print('Doodson_XO: Ensure time axis has >=39 elements. Returning.')
         return
-    # Define DOODSON XO weights
+    kern = doodson_kernel()
+
+    if isinstance(elevation, xr.DataArray):
+        elevation = elevation.data
+    ax = ax % elevation.ndim
+
+    if isinstance(elevation, da.Array):
+        # Each chunk is extended by 19 points from its neighbours along the
+        # time axis. Outer edges are filled with NaNs by _convolve_axis.
+        return elevation.map_overlap(_convolve_axis, depth={ax:19}, 
+                                     boundary='none', kern=kern, ax=ax,
+                                     dtype=np.float64)
+    else:
+        return _convolve_axis(np.asarray(elevation), kern, ax)
+
+
+def _convolve_axis(arr, kern, ax):
+    '''
+    Convolves array with a symmetric kernel along axis ax. Points within half
+    a kernel length of either end of the axis are NaN, as are points whose
+    window contains a NaN.
+    '''
+    return scipy.ndimage.convolve1d(arr.astype(np.float64, copy=False), kern, axis=ax,
+                                    mode='constant', cval=np.nan)
+
+
+@lru_cache()
+def doodson_kernel(dt_hours=1.):
+    '''
+    Weights of the Doodson X0 filter. Only defined for hourly data.
+    '''
+    if not np.isclose(dt_hours, 1):
+        raise ValueError('The Doodson X0 filter requires hourly data, '
+                         f'not a sampling interval of {dt_hours} hours.')
     kern = np.array([1, 0, 1, 0, 0, 1, 0, 1, 1, 0, 2, 0, 1, 1, 0, 2, 1, 1, 2,
                      0,
                      2, 1, 1, 2, 0, 1, 1, 0, 2, 0, 1, 1, 0, 1, 0, 0, 1, 0, 1])
-    kern = kern/30
-
-    # Convolve input array with weights along the specified axis.
-    filtered = np.apply_along_axis(lambda m: np.convolve(m, kern, mode=1),
-                                   axis=ax, arr=elevation)
-
-    # Pad out boundary areas with NaNs for given (arbitrary) axis.
-    # DB: Is this the best way to do this?? Can put_along_axis be used instead
-    filtered = filtered.swapaxes(0,ax)
-    filtered[:19] = np.nan
-    filtered[-19:] = np.nan
-    filtered = filtered.swapaxes(0,ax)
-    return filtered
+    return _read_only(kern/30)
+
+
+@lru_cache()
+def godin_kernel(dt_hours=1.):
+    '''
+    Weights of the Godin (A24 A24 A25) filter: successive running means over
+    24, 24 and 25 hours. For hourly data this is 71 points long.
+    '''
+    kern = np.array([1.])
+    for hours in (24, 24, 25):
+        n_points = int(round(hours/dt_hours))
+        kern = np.convolve(kern, np.ones(n_points)/n_points)
+    return _read_only(kern)
+
+
+@lru_cache()
+def lanczos_kernel(dt_hours=1., cutoff_hours=40., half_width_hours=120.):
+    '''
+    Weights of the cosine-Lanczos low-pass filter with a cutoff period of 
+    cutoff_hours: the ideal (sinc) low-pass weights tapered by a cosine 
+    window 0.5*(1 + cos(pi*k/n_half)) to +/- half_width_hours, normalised 
+    to have unit sum.
+    '''
+    n_half = int(round(half_width_hours/dt_hours))
+    k = np.arange(-n_half, n_half + 1)
+    cutoff = dt_hours/cutoff_hours  # cycles per sample
+    kern = 2*cutoff*np.sinc(2*cutoff*k) * 0.5*(1 + np.cos(np.pi*k/n_half))
+    return _read_only(kern/kern.sum())
+
+
+@lru_cache()
+def butterworth_sos(dt_hours=1., cutoff_hours=40., order=4):
+    '''
+    Second order sections of a low-pass Butterworth filter with a cutoff
+    period of cutoff_hours. Applied forwards and backwards (zero phase).
+    '''
+    return _read_only(scipy.signal.butter(order, 1/cutoff_hours, btype='low', 
+                                          fs=1/dt_hours, output='sos'))
+
+
+def apply_filter_bank(variable, filters=('doodson',), time_dim_name='t_dim',
+                      dt_hours=None):
+    '''
+    Applies one or more low-pass tidal filters along the time dimension of a
+    DataArray of any rank. Available filters:
+
+        'doodson'     :: Doodson X0 (hourly data only). See doodson_x0_filter()
+        'godin'       :: Godin A24 A24 A25 running means
+        'lanczos'     :: cosine-Lanczos. kwargs: cutoff_hours (40), 
+                         half_width_hours (120)
+        'butterworth' :: zero phase Butterworth. kwargs: cutoff_hours (40), 
+                         order (4)
+
+    Filters are given as names or as (name, kwargs) tuples, e.g.
+        filters = ['godin', ('lanczos', {'cutoff_hours':33})]
+
+    Filter weights are computed once per sampling interval and cached. If
+    the variable contains a dask array, all filters are applied lazily in a
+    single pass over the data: each chunk is extended along time by the 
+    largest half width of the requested filters (map_overlap style), read
+    once and every filter applied to it. For numpy data all filters are
+    applied in memory.
+    
+    Output from the convolution filters (doodson, godin, lanczos) is NaN 
+    where the filter window is incomplete at either end or contains a NaN.
+    The butterworth filter is applied with scipy.signal.sosfiltfilt and any
+    NaN in a time series will make the whole filtered series NaN, so fill
+    missing values first. As an infinite impulse response filter, its lazy
+    output differs very slightly (~1e-5 of the signal) from the in-memory
+    result near chunk boundaries.
+
+    Parameters
+    ----------
+        variable (xr.DataArray) : Variable to filter
+        filters (list) : Filter names or (name, kwargs) tuples
+        time_dim_name (str) : Name of the time dimension
+        dt_hours (float) : Sampling interval in hours. If None, this is 
+            taken from a datetime coordinate along time_dim_name.
+
+    Returns
+    -------
+        xr.Dataset with one filtered variable per filter, named after the 
+        filter, with the same dimensions and coordinates as variable.
+    '''
+    if dt_hours is None:
+        dt_hours = _sampling_interval_hours(variable, time_dim_name)
+    
+    names = []
+    functions = []
+    depth = 0
+    for spec in filters:
+        name, kwargs = (spec, {}) if isinstance(spec, str) else spec
+        function, half_width = _filter_function(name, dt_hours, **kwargs)
+        names.append(name)
+        functions.append(function)
+        depth = max(depth, half_width)
+    
+    ax = variable.dims.index(time_dim_name)
+    data = variable.data
+    if variable.shape[ax] <= 2*depth:
+        raise ValueError(f'{time_dim_name} must be longer than {2*depth} '
+                         'points for the requested filters.')
+
+    if isinstance(data, da.Array):
+        overlapped = da.overlap.overlap(data, depth={ax:depth}, 
+                                        boundary='none')
+        filtered = overlapped.map_blocks(_filter_block, functions, ax,
+                                         new_axis=0, dtype=np.float64,
+                                         chunks=((len(functions),),) 
+                                                + overlapped.chunks)
+        trim = {ii:0 for ii in range(filtered.ndim)}
+        trim[ax+1] = depth
+        filtered = da.overlap.trim_internal(filtered, trim, boundary='none')
+    else:
+        filtered = _filter_block(np.asarray(data), functions, ax)
+    
+    dataset = xr.Dataset()
+    for ii, name in enumerate(names):
+        dataset[name] = variable.copy(data=filtered[ii])
+        dataset[name].attrs['filter'] = name
+    return dataset
+
+
+def _read_only(arr):
+    ''' Marks a cached array read only, so callers cannot change the cache '''
+    arr.setflags(write=False)
+    return arr
+
+
+def _filter_function(name, dt_hours, **kwargs):
+    '''
+    Returns a function applying the named filter along an axis of a numpy
+    array and the half width (in samples) of data it needs either side of
+    each point.
+    '''
+    if name == 'butterworth':
+        sos = butterworth_sos(dt_hours, **kwargs)
+        cutoff_hours = kwargs.get('cutoff_hours', 40.)
+        order = kwargs.get('order', 4)
+        # Allow the impulse response of the forward and backward passes
+        # to decay before the edge of each overlapped chunk
+        half_width = int(np.ceil(order*cutoff_hours/dt_hours))
+        # sosfiltfilt needs a writable copy of the cached, read only sos
+        function = lambda arr, ax: scipy.signal.sosfiltfilt(np.array(sos), arr, axis=ax)
+        return function, half_width
+    kernels = {'doodson':doodson_kernel, 'godin':godin_kernel,
+               'lanczos':lanczos_kernel}
+    if name not in kernels:
+        raise ValueError(f'Unknown filter {name}. Choose from '
+                         f'{list(kernels) + ["butterworth"]}')
+    kern = kernels[name](dt_hours, **kwargs)
+    function = lambda arr, ax: _convolve_axis(arr, kern, ax)
+    return function, len(kern)//2
+
+
+def _filter_block(arr, functions, ax):
+    ''' Apply each filter function to arr and stack along a new axis 0 '''
+    arr = arr.astype(np.float64, copy=False)
+    return np.stack([function(arr, ax) for function in functions])
+
+
+def _sampling_interval_hours(variable, time_dim_name):
+    ''' Median sampling interval (hours) of a datetime coordinate '''
+    for coord in variable.coords.values():
+        if coord.dims == (time_dim_name,) and \
+           np.issubdtype(coord.dtype, np.datetime64):
+            return float( np.median(np.diff(coord.values)) 
+                          / np.timedelta64(1, 'h') )
+    raise ValueError(f'No datetime coordinate along {time_dim_name}. '
+                     'Specify dt_hours.')
+
+
+def find_extrema_grid(variable, time_dim_name='t_dim', time_var_name='time',
+                      refine=True, max_events=None):
+    '''
+    Finds the maxima (e.g. high waters) and minima (e.g. low waters) of every
+    time series in a DataArray of any rank at once, e.g. ssh(t, y, x). An
+    extremum is a point greater (less) than the previous point and greater 
+    (less) than or equal to the next, as for find_maxima(method='comp'). If
+    refine is True, the time and height of each extremum are refined by 
+    fitting a parabola through it and its two neighbours.
+
+    Time series containing NaNs (e.g. land) have no extrema next to a NaN.
+    
+    For a dask array the extrema are first located lazily on each time chunk
+    with a one point overlap. If max_events is None, the largest number of 
+    extrema in any time series is then computed, which requires an extra 
+    pass through the data. Supply max_events (e.g. 2 per day for a 
+    semi-diurnal tide, plus a margin) to avoid it; any further extrema are 
+    discarded. The events of each time series are then gathered into padded
+    arrays, lazily with the full time series of each spatial chunk in memory.
+
+    Parameters
+    ----------
+        variable (xr.DataArray) : Variable to search, must have a datetime
+            coordinate time_var_name along time_dim_name.
+        time_dim_name (str) : Name of the time dimension
+        time_var_name (str) : Name of the time coordinate
+        refine (bool) : Refine extrema with a parabolic fit
+        max_events (int) : Size of the event dimension of the output
+
+    Returns
+    -------
+        xr.Dataset containing {name}_highs and time_highs along a new
+        dimension highs_dim, and {name}_lows and time_lows along lows_dim,
+        plus the non-time dimensions of variable. Unused events are NaN/NaT.
+        n_highs and n_lows are the number of extrema in each time series.
+    '''
+    name = variable.name if variable.name is not None else 'variable'
+    variable = variable.transpose(time_dim_name, ...)
+    data = variable.data
+    time = variable[time_var_name].values
+    
+    if isinstance(data, da.Array):
+        # Each time chunk needs at least 3 steps to find extrema in
+        if min(data.chunks[0]) < 3:
+            data = data.rechunk({0:_merge_short_chunks(data.chunks[0], 3)})
+        overlapped = da.overlap.overlap(data, depth={0:1}, boundary='none')
+        dense = overlapped.map_blocks(_extrema_block, refine, new_axis=0,
+                                      dtype=np.float64, 
+                                      chunks=((4,),) + overlapped.chunks)
+        trim = {ii:0 for ii in range(dense.ndim)}
+        trim[1] = 1
+        dense = da.overlap.trim_internal(dense, trim, boundary='none')
+    else:
+        dense = _extrema_block(np.asarray(data), refine)
+    
+    n_highs = (~np.isnan(dense[0])).sum(axis=0)
+    n_lows = (~np.isnan(dense[2])).sum(axis=0)
+    if max_events is None:
+        # Both counts from one evaluation of a lazy graph
+        n_high_max, n_low_max = dask.compute(n_highs.max(), n_lows.max())
+        max_events = int( max(n_high_max, n_low_max) )
+    
+    if isinstance(dense, da.Array):
+        dense = dense.rechunk({1:-1})
+        events = dense.map_blocks(_compact_events, time, max_events, 
+                                  dtype=np.float64, 
+                                  chunks=((4,), (max_events,)) + dense.chunks[2:])
+    else:
+        events = _compact_events(dense, time, max_events)
+    
+    # Times were carried as float nanoseconds since 1970 so they could share
+    # an array with the heights. NaN becomes NaT.
+    def to_datetime(arr):
+        if isinstance(arr, da.Array):
+            return arr.map_blocks(_float_to_datetime, dtype='datetime64[ns]')
+        return _float_to_datetime(arr)
+    
+    other_dims = variable.dims[1:]
+    coords = {key:coord for key, coord in variable.coords.items() 
+              if time_dim_name not in coord.dims}
+    dataset = xr.Dataset(coords=coords)
+    dataset[name + '_highs'] = (('highs_dim',) + other_dims, events[0])
+    dataset['time_highs'] = (('highs_dim',) + other_dims, to_datetime(events[1]))
+    dataset[name + '_lows'] = (('lows_dim',) + other_dims, events[2])
+    dataset['time_lows'] = (('lows_dim',) + other_dims, to_datetime(events[3]))
+    dataset['n_highs'] = (other_dims, np.minimum(n_highs, max_events))
+    dataset['n_lows'] = (other_dims, np.minimum(n_lows, max_events))
+    return dataset
+
+
+def _extrema_block(block, refine=True):
+    '''
+    Locates maxima and minima along axis 0 of block. Returns an array of
+    shape (4,) + block.shape holding the height of each maximum, its 
+    fractional offset in samples, the height of each minimum and its offset.
+    Elements that are not extrema are NaN.
+    '''
+    block = block.astype(np.float64, copy=False)
+    prev, cur, nxt = block[:-2], block[1:-1], block[2:]
+    out = np.full((4,) + block.shape, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if refine:
+            offset = 0.5*(prev - nxt)/(prev - 2*cur + nxt)
+            height = cur - 0.25*(prev - nxt)*offset
+        else:
+            offset = np.zeros_like(cur)
+            height = cur
+        for ii, is_extremum in enumerate( [(cur > prev) & (cur >= nxt),
+                                           (cur < prev) & (cur <= nxt)] ):
+            out[2*ii, 1:-1][is_extremum] = height[is_extremum]
+            out[2*ii+1, 1:-1][is_extremum] = offset[is_extremum]
+    return out
+
+
+def _merge_short_chunks(chunks, minimum):
+    '''
+    Chunk sizes with each chunk shorter than minimum merged into its
+    neighbour, so the sizes still add up to the same length.
+    '''
+    merged = []
+    for size in chunks:
+        if len(merged) > 0 and (size < minimum or merged[-1] < minimum):
+            merged[-1] += size
+        else:
+            merged.append(size)
+    return tuple(merged)
+
+
+def _compact_events(dense, time, max_events):
+    '''
+    Gathers the extrema found by _extrema_block (full time axis, axis 1) into 
+    padded arrays of shape (4, max_events, ...) holding high water heights,
+    high water times, low water heights and low water times. Times are float
+    nanoseconds since 1970, interpolated from time for fractional offsets.
+    '''
+    time_ns = time.astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+    index = np.arange(len(time))
+    out = np.full((4, max_events) + dense.shape[2:], np.nan)
+    for ii in range(2):
+        height = dense[2*ii]
+        mask = ~np.isnan(height)
+        event = np.cumsum(mask, axis=0) - 1
+        keep = mask & (event < max_events)
+        t_ind, *space_ind = np.nonzero(keep)
+        event = event[keep]
+        out[2*ii][(event, *space_ind)] = height[keep]
+        out[2*ii+1][(event, *space_ind)] = np.interp(
+            t_ind + dense[2*ii+1][keep], index, time_ns)
+    return out
+
+
+def _float_to_datetime(arr):
+    ''' Float nanoseconds since 1970 to datetime64, with NaN as NaT '''
+    out = np.full(arr.shape, np.datetime64('NaT'), dtype='datetime64[ns]')
+    valid = ~np.isnan(arr)
+    out[valid] = np.round(arr[valid]).astype(np.int64).view('datetime64[ns]')
+    return out
@@ -0,0 +1,397 @@
+'''
+Python definitions used for tidal harmonic analysis.
+
+*Methods Overview*
+    -> astronomical_arguments(): Mean longitudes s, h, p, N, p' at times
+    -> nodal_corrections(): Nodal amplitude factors f and phase corrections u
+    -> design_matrix(): Harmonic basis functions for a time axis
+    -> harmonic_analysis(): Least squares fit of constituents to many series
+    -> HarmonicAccumulator: Normal equations accumulated over time chunks
+    -> predict_tide(): Tidal prediction from constituents, lazily in time
+'''
+
+import numpy as np
+import xarray as xr
+import dask.array as da
+import scipy.linalg
+from . import general_utils
+from .logging_util import get_slug, debug, info, warn, error
+
+# Doodson numbers of each constituent: multiples of lunar time (tau), s, h, p,
+# N' (= -N) and p', followed by a phase offset in degrees.
+# See Pugh (1987), Tides, Surges and Mean Sea-Level, Table 4.2.
+CONSTITUENTS = {
+    'SA'  : (0,  0,  1,  0, 0, 0,   0),
+    'SSA' : (0,  0,  2,  0, 0, 0,   0),
+    'MM'  : (0,  1,  0, -1, 0, 0,   0),
+    'MF'  : (0,  2,  0,  0, 0, 0,   0),
+    'Q1'  : (1, -2,  0,  1, 0, 0, -90),
+    'O1'  : (1, -1,  0,  0, 0, 0, -90),
+    'P1'  : (1,  1, -2,  0, 0, 0, -90),
+    'K1'  : (1,  1,  0,  0, 0, 0,  90),
+    'J1'  : (1,  2,  0, -1, 0, 0,  90),
+    'OO1' : (1,  3,  0,  0, 0, 0,  90),
+    '2N2' : (2, -2,  0,  2, 0, 0,   0),
+    'MU2' : (2, -2,  2,  0, 0, 0,   0),
+    'N2'  : (2, -1,  0,  1, 0, 0,   0),
+    'NU2' : (2, -1,  2, -1, 0, 0,   0),
+    'M2'  : (2,  0,  0,  0, 0, 0,   0),
+    'L2'  : (2,  1,  0, -1, 0, 0, 180),
+    'T2'  : (2,  2, -3,  0, 0, 1,   0),
+    'S2'  : (2,  2, -2,  0, 0, 0,   0),
+    'K2'  : (2,  2,  0,  0, 0, 0,   0),
+    'MN4' : (4, -1,  0,  1, 0, 0,   0),
+    'M4'  : (4,  0,  0,  0, 0, 0,   0),
+    'MS4' : (4,  2, -2,  0, 0, 0,   0),
+    'M6'  : (6,  0,  0,  0, 0, 0,   0),
+}
+
+# Rates of change (degrees per hour) of tau, s, h, p, N' and p'
+_SPEEDS = np.array([15 - 0.5490165 + 0.0410686, 0.5490165, 0.0410686,
+                    0.0046418, 0.0022064, 0.0000020])
+
+# Epoch of the astronomical argument polynomials: 1900 January 0.5
+_EPOCH = np.datetime64('1899-12-31T12:00:00')
+
+
+def constituent_speeds(constituents):
+    '''
+    Angular speeds (degrees per hour) of the named constituents.
+    '''
+    doodson = np.array([CONSTITUENTS[name.upper()][:6] for name in constituents])
+    return doodson @ _SPEEDS
+
+
+def astronomical_arguments(times):
+    '''
+    Lunar time tau and the mean longitudes of the moon (s), sun (h), lunar
+    perigee (p), negative of the lunar ascending node (N' = -N) and solar
+    perigee (p') in degrees at each time. Returns an array of shape
+    (len(times), 6). Polynomials in Julian centuries from the 1900 epoch as
+    in Doodson (1921) and Pugh (1987), Table 4.2.
+    '''
+    times = np.asarray(times, dtype='datetime64[ns]')
+    days = (times - _EPOCH) / np.timedelta64(1, 'D')
+    T = days / 36525
+    s = 270.434164 + 481267.8831*T - 0.0011*T**2
+    h = 279.696678 + 36000.768925*T + 0.0003*T**2
+    p = 334.329556 + 4069.0340*T - 0.0103*T**2
+    N = 259.183275 - 1934.1420*T + 0.0021*T**2
+    p1 = 281.220844 + 1.719175*T + 0.00045*T**2
+    # Epoch is at noon, so add 180 degrees for hours since midnight
+    tau = 360*np.mod(days, 1) + 180 + h - s
+    return np.mod(np.stack([tau, s, h, p, -N, p1], axis=-1), 360)
+
+
+def nodal_corrections(constituents, times):
+    '''
+    Nodal amplitude factors f and phase corrections u (degrees) of the named
+    constituents at each time, from the longitude of the lunar node. Uses
+    the approximations of Pugh (1987) Table 4.3. Constituents without an
+    entry (L2 uses M2) are not corrected. Returns two arrays of shape
+    (len(times), len(constituents)).
+    '''
+    N = np.radians(-astronomical_arguments(times)[:, 4])
+    cosN, cos2N, cos3N = np.cos(N), np.cos(2*N), np.cos(3*N)
+    sinN, sin2N, sin3N = np.sin(N), np.sin(2*N), np.sin(3*N)
+
+    f_m2 = 1.0004 - 0.0373*cosN + 0.0002*cos2N
+    u_m2 = -2.14*sinN
+    f_o1 = 1.0089 + 0.1871*cosN - 0.0147*cos2N + 0.0014*cos3N
+    u_o1 = 10.80*sinN - 1.34*sin2N + 0.19*sin3N
+    f_k1 = 1.0060 + 0.1150*cosN - 0.0088*cos2N + 0.0006*cos3N
+    u_k1 = -8.86*sinN + 0.68*sin2N - 0.07*sin3N
+    f_k2 = 1.0241 + 0.2863*cosN + 0.0083*cos2N - 0.0015*cos3N
+    u_k2 = -17.74*sinN + 0.68*sin2N - 0.04*sin3N
+    f_j1 = 1.1029 + 0.1676*cosN - 0.0170*cos2N + 0.0016*cos3N
+    u_j1 = -12.94*sinN + 1.34*sin2N - 0.19*sin3N
+    f_oo1 = 1.1027 + 0.6504*cosN + 0.0317*cos2N - 0.0014*cos3N
+    u_oo1 = -36.68*sinN + 4.02*sin2N - 0.57*sin3N
+    f_mf = 1.043 + 0.414*cosN
+    u_mf = -23.7*sinN + 2.7*sin2N - 0.4*sin3N
+    f_mm = 1.000 - 0.130*cosN
+    one, zero = np.ones_like(N), np.zeros_like(N)
+
+    table = {'M2':(f_m2, u_m2), 'N2':(f_m2, u_m2), '2N2':(f_m2, u_m2),
+             'MU2':(f_m2, u_m2), 'NU2':(f_m2, u_m2), 'L2':(f_m2, u_m2),
+             'O1':(f_o1, u_o1), 'Q1':(f_o1, u_o1), 'K1':(f_k1, u_k1),
+             'K2':(f_k2, u_k2), 'J1':(f_j1, u_j1), 'OO1':(f_oo1, u_oo1),
+             'MF':(f_mf, u_mf), 'MM':(f_mm, zero),
+             'M4':(f_m2**2, 2*u_m2), 'MN4':(f_m2**2, 2*u_m2),
+             'MS4':(f_m2, u_m2), 'M6':(f_m2**3, 3*u_m2)}
+    f = np.stack([table.get(name.upper(), (one, zero))[0]
+                  for name in constituents], axis=-1)
+    u = np.stack([table.get(name.upper(), (one, zero))[1]
+                  for name in constituents], axis=-1)
+    return f, u
+
+
+def design_matrix(times, constituents):
+    '''
+    Harmonic basis functions for a time axis. Column 0 is the mean; columns
+    1 + 2*j and 2 + 2*j are f cos(V + u) and f sin(V + u) for constituent j,
+    where V is the equilibrium argument, so that a series is modelled as
+
+        z0 + sum_j f_j H_j cos(V_j + u_j - g_j)
+
+    with coefficients H_j cos(g_j) and H_j sin(g_j). Returns an array of
+    shape (len(times), 1 + 2*len(constituents)).
+    '''
+    doodson = np.array([CONSTITUENTS[name.upper()] for name in constituents],
+                       dtype=np.float64)
+    V = astronomical_arguments(times) @ doodson[:, :6].T + doodson[:, 6]
+    f, u = nodal_corrections(constituents, times)
+    arg = np.radians(V + u)
+    X = np.empty((len(V), 1 + 2*len(constituents)))
+    X[:, 0] = 1
+    X[:, 1::2] = f*np.cos(arg)
+    X[:, 2::2] = f*np.sin(arg)
+    return X
+
+
+def harmonic_analysis(variable, constituents, time_dim_name='t_dim',
+                      time_var_name='time', time_chunk=None):
+    '''
+    Least squares harmonic analysis of every time series in a DataArray of
+    any rank, e.g. ssh(t, y, x) or sea_level(time). The design matrix is
+    built once for the time axis and all series are fitted together.
+
+    If time_chunk is None and the variable is not a dask array, the fit uses
+    one QR factorisation of the design matrix shared by all series without
+    missing values. Series with NaNs are fitted individually, ignoring the
+    NaNs. Otherwise the variable is read in blocks of time_chunk time steps
+    (or its dask chunks) and the normal equations are accumulated with a
+    HarmonicAccumulator, so only one block is in memory at a time.
+
+    Series that are entirely NaN (e.g. land), or that have fewer valid
+    points than unknowns, are NaN in the output.
+
+    Parameters
+    ----------
+        variable (xr.DataArray) : Variable to analyse
+        constituents (list) : Constituent names, e.g. ['M2', 'S2', 'K1'].
+            See tide_util.CONSTITUENTS.
+        time_dim_name (str) : Name of the time dimension
+        time_var_name (str) : Name of the datetime coordinate along time
+        time_chunk (int) : Number of time steps per block when streaming
+
+    Returns
+    -------
+        xr.Dataset containing harmonic_x and harmonic_y (H cos g, H sin g),
+        harmonic_a (amplitude H) and harmonic_g (Greenwich phase lag g,
+        degrees) with a new 'constituent' dimension, and z0 (the mean).
+        Variable names are as used by NEMO.harmonics_convert().
+    '''
+    variable = variable.transpose(time_dim_name, ...)
+    times = variable[time_var_name].values
+    other_dims = variable.dims[1:]
+    other_shape = variable.shape[1:]
+    n_time = variable.shape[0]
+
+    if time_chunk is None and variable.chunks is not None:
+        time_chunk = variable.chunks[0][0]
+
+    if time_chunk is None:
+        values = np.asarray(variable.values, dtype=np.float64).reshape((n_time, -1))
+        beta = _fit_qr(design_matrix(times, constituents), values)
+    else:
+        accumulator = HarmonicAccumulator(constituents,
+                                          int(np.prod(other_shape)))
+        for t0 in range(0, n_time, time_chunk):
+            block = variable[t0:t0 + time_chunk]
+            accumulator.update(times[t0:t0 + time_chunk],
+                               block.values.reshape((len(block), -1)))
+        beta = accumulator.solve()
+
+    beta = beta.reshape((beta.shape[0],) + other_shape)
+    coords = {key:coord for key, coord in variable.coords.items()
+              if time_dim_name not in coord.dims}
+    dataset = xr.Dataset(coords=coords)
+    dims = ('constituent',) + other_dims
+    dataset['harmonic_x'] = (dims, beta[1::2])
+    dataset['harmonic_y'] = (dims, beta[2::2])
+    dataset['harmonic_a'] = (dims, np.hypot(beta[1::2], beta[2::2]))
+    dataset['harmonic_g'] = (dims, np.mod(np.degrees(
+                                  np.arctan2(beta[2::2], beta[1::2])), 360))
+    dataset['z0'] = (other_dims, beta[0])
+    dataset['constituent'] = np.array(constituents, dtype='str')
+    return dataset
+
+
+def _fit_qr(X, values):
+    '''
+    Least squares coefficients (n_unknowns, n_series) for the columns of
+    values. One QR factorisation is shared by all complete series.
+    '''
+    n_unknowns = X.shape[1]
+    beta = np.full((n_unknowns, values.shape[1]), np.nan)
+    valid = ~np.isnan(values)
+    complete = valid.all(axis=0)
+
+    if complete.any():
+        Q, R = np.linalg.qr(X)
+        beta[:, complete] = scipy.linalg.solve_triangular(
+                                R, Q.T @ values[:, complete])
+    for column in np.where(~complete & (valid.sum(axis=0) >= n_unknowns))[0]:
+        rows = valid[:, column]
+        beta[:, column] = np.linalg.lstsq(X[rows], values[rows, column],
+                                          rcond=None)[0]
+    return beta
+
+
+class HarmonicAccumulator():
+    '''
+    Normal equations (X^T X) beta = X^T y of a harmonic fit, accumulated over
+    consecutive blocks of time for many series at once. X^T X is shared by
+    all series without missing values. For series with missing values a
+    correction (the contribution of the missing rows) is kept per series,
+    so the result is identical to fitting only the valid times. Series that
+    have not yet had a valid value need no storage.
+
+    Example usage:
+        acc = HarmonicAccumulator(['M2', 'S2'], n_series)
+        for times, values in blocks:    # values is (n_times, n_series)
+            acc.update(times, values)
+        beta = acc.solve()
+    '''
+
+    def __init__(self, constituents, n_series):
+        self.constituents = list(constituents)
+        n_unknowns = 1 + 2*len(constituents)
+        self.XtX = np.zeros((n_unknowns, n_unknowns))
+        self.XtY = np.zeros((n_unknowns, n_series))
+        self.n_valid = np.zeros(n_series, dtype=np.int64)
+        self.corrections = {}
+
+    def update(self, times, values):
+        '''
+        Add a block of data. values has shape (len(times), n_series).
+        '''
+        X = design_matrix(times, self.constituents)
+        values = np.asarray(values, dtype=np.float64)
+        missing = np.isnan(values)
+
+        # Series valid for the first time need the whole accumulated X^T X
+        # as their correction, since all their earlier values were missing
+        n_valid_block = (~missing).sum(axis=0)
+        for column in np.where((self.n_valid == 0) & (n_valid_block > 0))[0]:
+            self.corrections[column] = self.XtX.copy()
+
+        # Missing values in series that have had valid data
+        seen = (self.n_valid + n_valid_block) > 0
+        columns = np.where(seen & missing.any(axis=0))[0]
+        if len(columns) > 0:
+            C = np.einsum('tp,tc,tq->cpq', X, missing[:, columns].astype(float), X)
+            for ii, column in enumerate(columns):
+                self.corrections[column] = self.corrections.get(column, 0) + C[ii]
+
+        self.XtX += X.T @ X
+        self.XtY += X.T @ np.where(missing, 0, values)
+        self.n_valid += n_valid_block
+        debug(f"{get_slug(self)} updated with {len(times)} times")
+
+    def solve(self):
+        '''
+        Solve the normal equations for all series. Returns coefficients of
+        shape (1 + 2*n_constituents, n_series), NaN for series with too few
+        valid values.
+        '''
+        n_unknowns = self.XtX.shape[0]
+        beta = np.full(self.XtY.shape, np.nan)
+        enough = self.n_valid >= n_unknowns
+        corrected = np.zeros(len(enough), dtype=bool)
+        corrected[list(self.corrections)] = True
+
+        shared = enough & ~corrected
+        if shared.any():
+            factor = scipy.linalg.cho_factor(self.XtX)
+            beta[:, shared] = scipy.linalg.cho_solve(factor, self.XtY[:, shared])
+
+        columns = [column for column in self.corrections if enough[column]]
+        if len(columns) > 0:
+            A = self.XtX - np.stack([self.corrections[c] for c in columns])
+            b = self.XtY[:, columns].T[:, :, np.newaxis]
+            beta[:, columns] = np.linalg.solve(A, b)[:, :, 0].T
+        return beta
+
+
+def predict_tide(harmonics, times, time_chunk=None, dtype=np.float64,
+                 include_z0=True, time_dim_name='t_dim', time_var_name='time'):
+    '''
+    Predicted tide from harmonic constituents at every point of a harmonics
+    dataset, e.g. the output of harmonic_analysis() or of
+    NEMO.harmonics_combine(). The harmonic basis (f cos(V + u), f sin(V + u))
+    is computed once per time for all points, so the prediction is a single
+    matrix product per block of times.
+
+    If time_chunk is given the result is a dask array, evaluated time_chunk
+    times at a time when computed. The non-tidal residual of a whole domain
+    can then be formed without holding the full prediction in memory, e.g.
+        residual = nemo.dataset.ssh - predict_tide(harm, nemo.dataset.time,
+                                                   time_chunk=240).values
+
+    Parameters
+    ----------
+        harmonics (xr.Dataset) : Must have a 'constituent' dimension with
+            constituent names as its coordinate and either harmonic_x and
+            harmonic_y or harmonic_a and harmonic_g (degrees). z0 is added
+            if present and include_z0 is True.
+        times (array) : Times to predict at, convertible to datetime64
+        time_chunk (int) : Number of times per dask chunk. None for numpy.
+        dtype : Output data type, e.g. np.float32 to halve memory. The
+            astronomical arguments are always computed in float64.
+        include_z0 (bool) : Add the mean level z0, if present
+        time_dim_name (str) : Name of the output time dimension
+        time_var_name (str) : Name of the output time coordinate
+
+    Returns
+    -------
+        xr.DataArray with dimensions (time_dim_name, *other dimensions of
+        harmonics) and the non-constituent coordinates of harmonics
+    '''
+    constituents = [str(name) for name in harmonics['constituent'].values]
+    if 'harmonic_x' in harmonics:
+        x = harmonics['harmonic_x']
+        y = harmonics['harmonic_y']
+    else:
+        x, y = general_utils.polar2cart(harmonics['harmonic_a'], 
+                                        harmonics['harmonic_g'], 
+                                        degrees=True)
+    other_dims = tuple(dim for dim in x.dims if dim != 'constituent')
+    x = x.transpose('constituent', *other_dims)
+    y = y.transpose('constituent', *other_dims)
+    other_shape = x.shape[1:]
+
+    # Coefficients in the column order of design_matrix()
+    coeffs = np.zeros((1 + 2*len(constituents), int(np.prod(other_shape))),
+                      dtype=dtype)
+    coeffs[1::2] = np.asarray(x).reshape((len(constituents), -1))
+    coeffs[2::2] = np.asarray(y).reshape((len(constituents), -1))
+    if include_z0 and 'z0' in harmonics:
+        coeffs[0] = np.asarray(harmonics['z0'].transpose(*other_dims)).ravel()
+
+    times = np.asarray(times, dtype='datetime64[ns]')
+    if time_chunk is None:
+        data = _predict_block(times, coeffs, constituents=constituents)
+        data = data.reshape((len(times),) + other_shape)
+    else:
+        data = da.blockwise(_predict_block, 'tp',
+                            da.from_array(times, chunks=time_chunk), 't',
+                            da.from_array(coeffs, chunks=coeffs.shape), 'cp',
+                            concatenate=True, dtype=dtype,
+                            constituents=constituents)
+        data = data.reshape((len(times),) + other_shape)
+
+    coords = {key:coord for key, coord in x.coords.items()
+              if 'constituent' not in coord.dims}
+    coords[time_var_name] = (time_dim_name, times)
+    return xr.DataArray(data, dims=(time_dim_name,) + other_dims,
+                        coords=coords, name='tide_prediction')
+
+
+def _predict_block(times, coeffs, constituents):
+    '''
+    Prediction at a block of times for all points: design matrix @ coeffs.
+    '''
+    X = design_matrix(times, constituents).astype(coeffs.dtype)
+    return X @ coeffs
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the cubic spline maxima finder in stats_util.
+
+Compares, on synthetic 1-minute tide gauge data:
+    - the previous quadratic_spline_roots(), which loops over every knot
+      interval in Python and calls np.roots, with the vectorised version
+    - find_maxima(method='cubic') called once per station with
+      find_maxima_many() called once for all stations.
+
+Run from the repository root:
+    python example_scripts/find_maxima_benchmark.py
+"""
+import coast.stats_util as stats_util
+import numpy as np
+import xarray as xr
+import scipy.interpolate
+import time
+
+
+def quadratic_spline_roots_loop(spl):
+    ''' The previous, per-knot implementation of quadratic_spline_roots() '''
+    roots = []
+    knots = spl.get_knots()
+    for a, b in zip(knots[:-1], knots[1:]):
+        u, v, w = spl(a), spl((a+b)/2), spl(b)
+        t = np.roots([u+w-2*v, w-u, 2*v])
+        t = t[np.isreal(t) & (np.abs(t) <= 1)]
+        roots.extend(t*(b-a)/2 + (b+a)/2)
+    return np.sort(roots)
+
+
+#%% Synthetic data: 1-minute data at a few stations. Set n_days = 365 for a
+#   year of data (the loop implementation then takes several minutes).
+n_days = 30
+n_stations = 4
+minutes = np.arange(0, n_days*24*60)
+times = np.datetime64('2020-01-01') + minutes.astype('timedelta64[m]')
+phases = np.linspace(0, np.pi, n_stations)
+sea_level = np.cos(2*np.pi*minutes[:,np.newaxis]/(12.42*60) + phases) \
+            + 0.3*np.cos(2*np.pi*minutes[:,np.newaxis]/(12*60) + phases)
+
+#%% Root finding on one station
+seconds = ((times - np.datetime64('1970-01-01')) / np.timedelta64(1, 's'))
+spline = scipy.interpolate.InterpolatedUnivariateSpline(seconds, 
+                                                        sea_level[:,0], k=3)
+derivative = spline.derivative()
+
+t0 = time.perf_counter()
+roots_loop = quadratic_spline_roots_loop(derivative)
+t1 = time.perf_counter()
+roots_vectorised = stats_util.quadratic_spline_roots(derivative)
+t2 = time.perf_counter()
+print(f"quadratic_spline_roots: loop {t1-t0:.2f} s, vectorised {t2-t1:.3f} s,"
+      f" same roots: {np.allclose(np.real(roots_loop), roots_vectorised)}")
+
+#%% Maxima of all stations
+x = xr.DataArray(times, dims='time')
+t0 = time.perf_counter()
+for station in range(n_stations):
+    stats_util.find_maxima(x, xr.DataArray(sea_level[:,station], dims='time'),
+                           method='cubic')
+t1 = time.perf_counter()
+times_max, heights_max = stats_util.find_maxima_many(times, sea_level)
+t2 = time.perf_counter()
+print(f"maxima of {n_stations} stations: find_maxima loop {t1-t0:.2f} s, "
+      f"find_maxima_many {t2-t1:.2f} s")
@@ -0,0 +1,55 @@
+# Test with PyTest
+
+import coast
+import numpy as np
+import xarray as xr
+import pytest
+
+
+def gappy_dataset():
+    ''' Daily data on a few days a month over two years, including a leap year '''
+    rng = np.random.default_rng(1)
+    days = np.arange(np.datetime64('2019-01-01'), np.datetime64('2021-01-01'))
+    day_of_month = (days - days.astype('datetime64[M]')).astype(int) + 1
+    days = days[np.isin(day_of_month, [1, 2, 15, 31])]
+    values = rng.normal(size=(len(days), 2))
+    values[::5, 1] = np.nan
+    return xr.Dataset({'sst': (('t_dim', 'x_dim'), values)},
+                      coords={'time': ('t_dim', days.astype('datetime64[ns]'))})
+
+
+def brute_force_pooled(ds, window):
+    ''' Mean and variance of all values within window//2 calendar days, circularly '''
+    doy = ds.time.dt.dayofyear.values
+    values = ds.sst.values
+    half = window // 2
+    mean = np.full((366, values.shape[1]), np.nan)
+    var = np.full((366, values.shape[1]), np.nan)
+    for day in range(1, 367):
+        distance = np.abs(doy - day)
+        distance = np.minimum(distance, 366 - distance)
+        pooled = values[distance <= half]
+        for ix in range(values.shape[1]):
+            valid = pooled[:, ix][~np.isnan(pooled[:, ix])]
+            if len(valid) > 0:
+                mean[day - 1, ix] = valid.mean()
+            if len(valid) > 1:
+                var[day - 1, ix] = valid.var(ddof=1)
+    return mean, var
+
+
+@pytest.mark.parametrize('window', [1, 3, 15])
+def test_smoothed_dayofyear_pools_by_calendar_day(window):
+    ds = gappy_dataset()
+    clim = coast.CLIMATOLOGY.make_climatology_streaming(ds, 'dayofyear', time_chunk=50,
+                                                        variance=True, smoothing_window=window)
+    mean, var = brute_force_pooled(ds, window)
+    assert np.array_equal(clim.dayofyear, np.arange(1, 367))
+    assert np.allclose(clim.sst, mean, equal_nan=True)
+    assert np.allclose(clim.sst_var, var, equal_nan=True)
+
+
+def test_even_smoothing_window_raises():
+    with pytest.raises(ValueError):
+        coast.CLIMATOLOGY.make_climatology_streaming(gappy_dataset(), 'dayofyear',
+                                                     smoothing_window=4)
@@ -0,0 +1,117 @@
+# Test with PyTest, against a local stub of the EA flood-monitoring API
+
+import coast
+import numpy as np
+import json
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+N_READINGS = 25
+STATIONS = {'E70124': 'Liverpool', 'E71524': 'Heysham'}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    ''' Serves station information and readings like the EA API. '''
+    requests_seen = []
+    fail_next = 0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query, keep_blank_values=True)
+        StubHandler.requests_seen.append(self.path)
+        if StubHandler.fail_next > 0:
+            StubHandler.fail_next -= 1
+            return self.send_json({}, status=503)
+
+        parts = url.path.strip('/').split('/')
+        base = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+        if parts[:2] == ['id', 'stations']:
+            station_id = parts[2].replace('.json', '')
+            if station_id not in STATIONS:
+                return self.send_json({}, status=404)
+            return self.send_json({'items': {
+                'label': STATIONS[station_id], 'lat': 53.4, 'long': -3.0,
+                'measures': [{'@id': f"{base}/id/measures/{station_id}-level"}]}})
+        if parts[:2] == ['id', 'measures'] and parts[-1] == 'readings':
+            # Readings in reverse time order, as with _sorted
+            limit = int(query['_limit'][0])
+            offset = int(query['_offset'][0])
+            times = np.datetime64('2020-10-01T00:00') \
+                    + np.arange(N_READINGS)[::-1]*np.timedelta64(15, 'm')
+            items = [{'dateTime': str(time) + ':00Z', 'value': float(ii)}
+                     for ii, time in enumerate(times)][offset:offset + limit]
+            return self.send_json({'items': items})
+        return self.send_json({}, status=404)
+
+    def send_json(self, content, status=200):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    StubHandler.requests_seen = []
+    StubHandler.fail_next = 0
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_readings_paged_and_sorted(stub_url):
+    client = coast.ea_util.EAClient(base_url=stub_url, page_size=10)
+    time, value = client.get_readings('E70124', ndays=1)
+    assert len(time) == N_READINGS
+    assert np.all(np.diff(time) == np.timedelta64(15, 'm'))
+    assert np.array_equal(value, np.arange(N_READINGS)[::-1])
+    readings_requests = [r for r in StubHandler.requests_seen if 'readings' in r]
+    assert len(readings_requests) == 3
+
+
+def test_readings_cached_on_disk(stub_url, tmp_path):
+    client = coast.ea_util.EAClient(base_url=stub_url, cache_dir=str(tmp_path))
+    date_start = np.datetime64('2020-10-01')
+    date_end = np.datetime64('2020-10-02')
+    time, value = client.get_readings('E70124', date_start, date_end)
+    n_requests = len(StubHandler.requests_seen)
+    time2, value2 = client.get_readings('E70124', date_start, date_end)
+    assert len(StubHandler.requests_seen) == n_requests
+    assert np.array_equal(time, time2) and np.array_equal(value, value2)
+
+
+def test_retry_after_server_error(stub_url):
+    StubHandler.fail_next = 1
+    client = coast.ea_util.EAClient(base_url=stub_url, backoff_factor=0)
+    station = client.get_station('E71524')
+    assert station['items']['label'] == 'Heysham'
+
+
+def test_many_stations_concurrently(stub_url):
+    client = coast.ea_util.EAClient(base_url=stub_url, max_workers=4)
+    tidegauges = coast.TIDEGAUGE.read_EA_API_multiple(
+                     ['E70124', 'missing', 'E71524'], ndays=1, client=client)
+    assert [tg.dataset.site_name for tg in tidegauges] == ['Liverpool', 'Heysham']
+    assert all(tg.dataset.dims['time'] == N_READINGS for tg in tidegauges)
+
+
+def test_read_EA_API_to_xarray(stub_url):
+    client = coast.ea_util.EAClient(base_url=stub_url)
+    dataset = coast.TIDEGAUGE.read_EA_API_to_xarray(
+                  date_start=np.datetime64('2020-10-01'),
+                  date_end=np.datetime64('2020-10-02'), client=client)
+    assert dataset.latitude == 53.4
+    assert dataset.sea_level.dtype == float
+    assert dataset.time.dtype == np.dtype('datetime64[ns]')
+    assert coast.TIDEGAUGE.read_EA_API_to_xarray(stationId='missing',
+                                                 client=client) is None
@@ -0,0 +1,81 @@
+# Test with PyTest
+
+import coast
+import numpy as np
+import xarray as xr
+from coast import geodesy
+
+KM_PER_DEGREE = np.pi * geodesy.EARTH_RADIUS / 180
+
+# A regular 0.1 degree grid
+GRID_LON, GRID_LAT = np.meshgrid(np.arange(-10, 5, 0.1), np.arange(45, 60, 0.1))
+
+
+def test_haversine_known_distances():
+    assert np.isclose(geodesy.haversine(0, 0, 1, 0), KM_PER_DEGREE)
+    assert np.isclose(geodesy.haversine(0, 0, 0, -1), KM_PER_DEGREE)
+    assert np.isclose(geodesy.haversine(-179.5, 0, 179.5, 0), KM_PER_DEGREE)
+    assert np.isclose(geodesy.haversine(0, 90, 123, 90), 0)
+
+
+def test_haversine_precision_and_xarray():
+    lon = xr.DataArray(GRID_LON.astype(np.float32), dims=('y_dim', 'x_dim'))
+    lat = xr.DataArray(GRID_LAT.astype(np.float32), dims=('y_dim', 'x_dim'))
+    dist = geodesy.point_to_grid(0, 51, lon, lat)
+    assert isinstance(dist, xr.DataArray) and dist.dtype == np.float32
+    dist32 = geodesy.point_to_grid(0, 51, GRID_LON, GRID_LAT, dtype=np.float32)
+    dist64 = geodesy.point_to_grid(0, 51, GRID_LON, GRID_LAT)
+    assert dist32.dtype == np.float32 and dist64.dtype == np.float64
+    assert np.allclose(dist32, dist64, atol=0.05)
+    assert np.allclose(coast.general_utils.calculate_haversine_distance(0, 51, GRID_LON, GRID_LAT),
+                       dist64)
+
+
+def test_pairwise_and_along_track():
+    lon = np.array([0., 1., 2., 3.])
+    lat = np.zeros(4)
+    matrix = geodesy.pairwise(lon, lat, lon[:2], lat[:2])
+    assert matrix.shape == (4, 2)
+    assert np.allclose(matrix[:, 0], lon * KM_PER_DEGREE)
+    assert np.allclose(geodesy.along_track(lon, lat), lon * KM_PER_DEGREE)
+
+
+def test_within_radius_matches_brute_force():
+    centre_lon = np.array([0., -5.55, 4.99, -20.])
+    centre_lat = np.array([51., 50.05, 59.9, 50.])
+    offsets, indices, distances = geodesy.within_radius(GRID_LON, GRID_LAT, centre_lon,
+                                                        centre_lat, 50, return_distance=True)
+    assert offsets.shape == (5,) and offsets[-1] == len(indices) == len(distances)
+    for ii in range(len(centre_lon)):
+        expected = np.flatnonzero(geodesy.point_to_grid(centre_lon[ii], centre_lat[ii],
+                                                        GRID_LON, GRID_LAT) < 50)
+        assert np.array_equal(indices[offsets[ii]:offsets[ii+1]], expected)
+    assert offsets[-1] - offsets[-2] == 0
+    assert np.all(distances < 50)
+
+
+def test_within_radius_ignores_nan_points():
+    lon = GRID_LON.copy()
+    lon[:, :50] = np.nan
+    tree = geodesy.build_tree(lon, GRID_LAT)
+    offsets, indices = geodesy.within_radius(lon, GRID_LAT, -5, 52, 20000, tree=tree)
+    assert np.array_equal(indices, np.flatnonzero(np.isfinite(lon)))
+
+
+def test_subset_indices_by_distance_BT_csr():
+    lon = GRID_LON.copy()
+    mask = GRID_LAT > 52
+    centre_lon = np.array([0., -5., 1.])
+    centre_lat = np.array([51., 52., 58.])
+    offsets, ind_y, ind_x = coast.general_utils.subset_indices_by_distance_BT(
+        lon, GRID_LAT, centre_lon, centre_lat, 30, mask=mask, csr=True)
+    assert np.array_equal(lon, GRID_LON)
+    assert offsets[-1] - offsets[-2] == 0
+    assert not mask[ind_y, ind_x].any()
+    lists_y, lists_x = coast.general_utils.subset_indices_by_distance_BT(
+        lon, GRID_LAT, centre_lon, centre_lat, 30, mask=mask)
+    for ii in range(len(centre_lon)):
+        assert np.array_equal(lists_y[ii], ind_y[offsets[ii]:offsets[ii+1]])
+        assert np.array_equal(lists_x[ii], ind_x[offsets[ii]:offsets[ii+1]])
+    index = coast.general_utils.cached_grid_index(GRID_LON, GRID_LAT)
+    assert index is coast.general_utils.cached_grid_index(lon, GRID_LAT.copy())
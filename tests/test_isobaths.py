@@ -0,0 +1,28 @@
+# Test with PyTest
+
+import coast
+import numpy as np
+import xarray as xr
+from coast import CONTOUR
+
+LON, LAT = np.meshgrid(np.linspace(-10, 5, 60), np.linspace(45, 60, 50))
+BATHYMETRY = 2000 * np.exp(-((LON + 2)**2 + (LAT - 52)**2) / 20)
+
+
+class _Domain:
+    dataset = xr.Dataset({'bathymetry': (('y_dim', 'x_dim'), BATHYMETRY),
+                          'latitude': (('y_dim', 'x_dim'), LAT),
+                          'longitude': (('y_dim', 'x_dim'), LON)})
+
+
+def test_isobath_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(CONTOUR, 'ISOBATH_CACHE_SIZE', 3)
+    coast.Isobaths.clear_cache()
+    isobaths = coast.Isobaths(_Domain(), [200, 500, 1000, 1500])
+    assert [key[1] for key in CONTOUR._isobath_cache] == [500., 1000., 1500.]
+    again = coast.Isobaths(_Domain(), [1500])
+    assert again.contours_by_depth[1500] is isobaths.contours_by_depth[1500]
+    y_ind, x_ind, _ = isobaths.get_segment(200, [50, -10], [55, 3])
+    assert len(y_ind) == len(x_ind) > 0
+    assert len(isobaths._trees) == 2 and len(again._trees) == 0
+    coast.Isobaths.clear_cache()
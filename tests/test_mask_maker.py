@@ -0,0 +1,23 @@
+# Test with PyTest
+
+import coast
+import sys
+import numpy as np
+
+mask_maker = sys.modules['coast.MASK_MAKER']
+
+LON, LAT = np.meshgrid(np.linspace(-10, 10, 40), np.linspace(45, 65, 30))
+BATHYMETRY = np.full(LON.shape, 100.)
+
+
+def test_region_mask_cache_is_bounded(monkeypatch, tmp_path):
+    monkeypatch.setattr(mask_maker, 'REGION_MASK_CACHE_SIZE', 4)
+    coast.MASK_MAKER.clear_cache()
+    masks = coast.MASK_MAKER.region_masks(LON, LAT, BATHYMETRY, cache_dir=tmp_path)
+    coast.MASK_MAKER.region_masks(LON + 0.1, LAT, BATHYMETRY, cache_dir=tmp_path)
+    assert len(mask_maker._region_mask_cache) == 4
+    assert len(list(tmp_path.glob('mask_*.npy'))) == 8
+    from_disk = coast.MASK_MAKER.region_masks(LON, LAT, BATHYMETRY, cache_dir=tmp_path)
+    for name in masks:
+        assert np.array_equal(masks[name], from_disk[name])
+    coast.MASK_MAKER.clear_cache()
@@ -0,0 +1,44 @@
+# Test with PyTest
+
+import numpy as np
+import xarray as xr
+import pytest
+from coast import stats_util
+
+
+@pytest.mark.parametrize('n_hours, chunk', [(745, 24), (745, 372), (746, 24), (50, 1)])
+def test_find_extrema_grid_short_trailing_chunk(n_hours, chunk):
+    hours = np.arange(n_hours)
+    time = np.datetime64('2007-01-01') + hours.astype('timedelta64[h]')
+    amplitude = np.linspace(0.5, 2, 6).reshape((2, 3))
+    ssh = amplitude * np.cos(2*np.pi*hours/12.42)[:, np.newaxis, np.newaxis]
+    ssh = xr.DataArray(ssh, dims=['t_dim', 'y_dim', 'x_dim'], name='ssh',
+                       coords={'time': ('t_dim', time)})
+    eager = stats_util.find_extrema_grid(ssh, refine=False)
+    lazy = stats_util.find_extrema_grid(ssh.chunk({'t_dim': chunk}), refine=False).compute()
+    xr.testing.assert_allclose(eager, lazy)
+
+
+def test_merge_short_chunks():
+    assert stats_util._merge_short_chunks((24, 24, 1), 3) == (24, 25)
+    assert stats_util._merge_short_chunks((2, 24, 2, 24), 3) == (28, 24)
+    assert stats_util._merge_short_chunks((1, 1), 3) == (2,)
+
+
+@pytest.mark.parametrize('kernel', [stats_util.doodson_kernel, stats_util.godin_kernel,
+                                    stats_util.lanczos_kernel, stats_util.butterworth_sos])
+def test_cached_filter_weights_are_read_only(kernel):
+    weights = kernel()
+    with pytest.raises(ValueError):
+        weights[0] = 0
+    assert kernel() is weights
+
+
+def test_lanczos_kernel_removes_tides():
+    kern = stats_util.lanczos_kernel(1., 40., 120.)
+    k = np.arange(-120, 121)
+    assert np.isclose(kern.sum(), 1) and np.allclose(kern, kern[::-1])
+    assert np.isclose(kern[0], 0) and np.isclose(kern[-1], 0)
+    # Response to diurnal and semi-diurnal tides, and to a 10 day signal
+    response = [abs(np.sum(kern * np.cos(2*np.pi*k/period))) for period in (12.42, 23.93, 240)]
+    assert response[0] < 1e-3 and response[1] < 1e-2 and response[2] > 0.9
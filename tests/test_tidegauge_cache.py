@@ -0,0 +1,52 @@
+# Test with PyTest
+
+import coast
+import numpy as np
+import datetime
+import pytest
+
+GESLA_HEADER = """# GESLA-2 DATA FILE
+# SITE NAME Test_Gauge
+# COUNTRY United_Kingdom
+# CONTRIBUTOR BODC
+# LATITUDE 52.47300
+# LONGITUDE 1.75083
+# COORDINATE SYSTEM Unspecified
+# START DATE/TIME 2007/01/01 00:00:00
+# END DATE/TIME 2007/01/02 23:00:00
+# TIME ZONE HOURS 0.
+# DATUM INFORMATION Unspecified
+# INSTRUMENT Unspecified
+# PRECISION 0.001
+# NULL VALUE -99.9999
+"""
+
+
+@pytest.fixture
+def fn_gesla(tmp_path):
+    ''' A GESLA v3 file of hourly data for 2 days, with a 32 line header '''
+    lines = GESLA_HEADER.splitlines()
+    lines += ['#'] * (32 - len(lines))
+    times = np.datetime64('2007-01-01T00:00') + np.arange(48) * np.timedelta64(1, 'h')
+    for ii, time in enumerate(times):
+        date, clock = str(time).split('T')
+        lines.append(f"{date.replace('-', '/')} {clock}:00 {ii / 10:9.4f} 1 0")
+    fn = tmp_path / 'test_gauge'
+    fn.write_text('\n'.join(lines) + '\n')
+    yield str(fn)
+    coast.TIDEGAUGE.cache_dir = None
+
+
+@pytest.mark.parametrize('date_start, date_end, n_times', [
+    (datetime.datetime(2007, 1, 1, 12), datetime.datetime(2007, 1, 2, 0), 13),
+    (datetime.datetime(2007, 1, 2, 12), datetime.datetime(2007, 1, 5), 12),
+    (datetime.datetime(2007, 1, 3), datetime.datetime(2007, 1, 5), 0),
+    (datetime.datetime(2006, 12, 1), datetime.datetime(2006, 12, 5), 0),
+    (None, None, 48)])
+def test_gesla_cache_is_transparent(fn_gesla, tmp_path, date_start, date_end, n_times):
+    parsed = coast.TIDEGAUGE.read_gesla_to_xarray_v3(fn_gesla, date_start, date_end)
+    coast.TIDEGAUGE.cache_dir = str(tmp_path / 'cache')
+    first = coast.TIDEGAUGE.read_gesla_to_xarray_v3(fn_gesla, date_start, date_end)
+    second = coast.TIDEGAUGE.read_gesla_to_xarray_v3(fn_gesla, date_start, date_end)
+    assert parsed.dims['time'] == n_times
+    assert parsed.identical(first) and parsed.identical(second)
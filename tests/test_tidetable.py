@@ -14,3 +14,20 @@ import coast.general_utils as general_utils
 def test_dayoweek():
     check1 = general_utils.dayoweek( np.datetime64('2020-10-16') ) == 'Fri'
     assert check1
+
+
+#-----------------------------------------------------------------------------#
+#%% nearest tide table events with a single event                           #
+#                                                                             #
+def test_tidetable_nearest_single_event():
+    tidetable = coast.TIDEGAUGE()
+    tidetable.dataset = xr.Dataset(
+        {'sea_level': ('time', [9.5])},
+        coords={'time': [np.datetime64('2020-10-13T12:00')]})
+    guess = np.datetime64('2020-10-13T10:00')
+    nearest_2 = tidetable.get_tidetabletimes(guess, method='nearest_2')
+    assert nearest_2.shape == (1,)
+    assert nearest_2.values[0] == 9.5
+    nearest_HW = tidetable.get_tidetabletimes(guess, method='nearest_HW')
+    assert nearest_HW.values == 9.5
+    assert nearest_HW.time.values == np.datetime64('2020-10-13T12:00')
@@ -648,7 +648,7 @@ except:
 #
 subsec = subsec+1
 try:
-    tran_f.calc_geostrophic_flow( nemo_t )
+    tran_f.calc_geostrophic_flow( nemo_t, nemo_u=nemo_u, nemo_v=nemo_v )
     cksum1 = (tran_f.data_cross_tran_flow.normal_velocity_hpg
                 .sum(dim=('t_dim', 'depth_z_levels', 'r_dim')).item())
     cksum2 = (tran_f.data_cross_tran_flow.normal_velocity_spg
@@ -667,6 +667,115 @@ try:
               " X - TRANSECT geostrophic flow calculations now as expected")
 except:
     print(str(sec) + chr(subsec) + ' FAILED.\n' + traceback.format_exc())
+
+#-----------------------------------------------------------------------------#
+#%% ( 4f ) Geostrophic flow calculated lazily in time chunks                    #
+#
+subsec = subsec+1
+try:
+    flow_eager = tran_f.data_cross_tran_flow
+    tran_f.calc_geostrophic_flow( nemo_t, nemo_u=nemo_u, nemo_v=nemo_v,
+                                  time_chunk=1 )
+    flow_lazy = tran_f.data_cross_tran_flow
+    check1 = flow_lazy.normal_velocity_hpg.chunks is not None
+    check2 = np.allclose(flow_lazy.normal_transport_hpg.values,
+                         flow_eager.normal_transport_hpg.values, equal_nan=True)
+    check3 = np.allclose(flow_lazy.normal_transport_spg.values,
+                         flow_eager.normal_transport_spg.values, equal_nan=True)
+    if check1 and check2 and check3:
+        print(str(sec) + chr(subsec) +
+              " OK - TRANSECT geostrophic flow in time chunks as expected")
+    else:
+        print(str(sec) + chr(subsec) +
+              " X - TRANSECT geostrophic flow in time chunks not as expected")
+except:
+    print(str(sec) + chr(subsec) + ' FAILED.\n' + traceback.format_exc())
+
+#-----------------------------------------------------------------------------#
+#%% ( 4g ) Cross transect flow calculated lazily in time chunks                 #
+#
+subsec = subsec+1
+try:
+    tran_lazy = coast.Transect_f( nemo_f, (54,-15), (56,-12) )
+    tran_lazy.calc_flow_across_transect(nemo_u, nemo_v, time_chunk=1)
+    check1 = tran_lazy.data_cross_tran_flow.normal_transports.chunks is not None
+    cksum = tran_lazy.data_cross_tran_flow.normal_transports.sum(dim=('t_dim', 'r_dim')).item()
+    if check1 and np.isclose(cksum,-48.67562136873888):
+        print(str(sec) + chr(subsec) +
+              " OK - TRANSECT cross flow in time chunks as expected")
+    else:
+        print(str(sec) + chr(subsec) +
+              " X - TRANSECT cross flow in time chunks not as expected")
+except:
+    print(str(sec) + chr(subsec) + ' FAILED.\n' + traceback.format_exc())
+
+#-----------------------------------------------------------------------------#
+#%% ( 4h ) 4-connected index path through many waypoints                        #
+#
+subsec = subsec+1
+try:
+    y_path, x_path = coast.section_util.polyline_indices([10, 30, 25, 60], [5, 12, 40, 41])
+    rule = coast.section_util.shortest_path_rule(nemo_f.dataset.e1.values,
+                                                 nemo_f.dataset.e2.values)
+    y_path, x_path = coast.section_util.four_connected(y_path, x_path, y_first=rule)
+    steps = np.abs(np.diff(y_path)) + np.abs(np.diff(x_path))
+    check1 = np.all(steps == 1)
+    check2 = [y_path[0], x_path[0], y_path[-1], x_path[-1]] == [10, 5, 60, 41]
+    check3 = len(y_path) == (20 + 7) + (5 + 28) + (35 + 1) + 1 # Manhattan length
+    if check1 and check2 and check3:
+        print(str(sec) + chr(subsec) + " OK - 4-connected path through waypoints as expected")
+    else:
+        print(str(sec) + chr(subsec) + " X - 4-connected path through waypoints not as expected")
+except:
+    print(str(sec) + chr(subsec) + ' FAILED.\n' + traceback.format_exc())
+
+#-----------------------------------------------------------------------------#
+#%% ( 4i ) Transects through waypoints and along great circles                  #
+#
+subsec = subsec+1
+try:
+    waypoints = [(54,-15), (55,-13), (56,-12)]
+    tran_way = coast.Transect_f( nemo_f, waypoints=waypoints )
+    tran_gc = coast.Transect_f( nemo_f, waypoints[0], waypoints[-1], great_circle=True )
+    y_way, x_way = nemo_f.find_j_i_list( [54, 55, 56], [-15, -13, -12] )
+    check1 = [tuple(nemo_f.find_j_i(lat, lon)) for lat, lon in waypoints] == list(zip(y_way, x_way))
+    check2 = all( np.all(np.abs(np.diff(tran.y_ind)) + np.abs(np.diff(tran.x_ind)) == 1)
+                  for tran in [tran_way, tran_gc] )
+    check3 = ( [tran_gc.y_ind[0], tran_gc.x_ind[0], tran_gc.y_ind[-1], tran_gc.x_ind[-1]]
+               == [y_way[0], x_way[0], y_way[-1], x_way[-1]] )
+    if check1 and check2 and check3:
+        print(str(sec) + chr(subsec) + " OK - TRANSECT through waypoints and along great circles")
+    else:
+        print(str(sec) + chr(subsec) + " X - TRANSECT through waypoints or along great circles not as expected")
+except:
+    print(str(sec) + chr(subsec) + ' FAILED.\n' + traceback.format_exc())
+
+#-----------------------------------------------------------------------------#
+#%% ( 4j ) Batch section plots with decimation                                  #
+#
+subsec = subsec+1
+try:
+    values = np.arange(40*1000, dtype=float).reshape(40, 1000)
+    values[:, 500:] = np.nan
+    dec, dec_depth, dec_r = coast.plot_util.decimate_section( values, np.arange(40),
+                                                              np.arange(1000), 100, 40 )
+    check1 = dec.shape == (40, 100) and np.isclose(dec[0,0], 4.5) and np.isnan(dec[0,-1])
+    # A contour section, whose last point has no segment and no depths
+    contours, no_contours = coast.Contour.get_contours(nemo_f, 200)
+    y_cont, x_cont, _ = coast.Contour.get_contour_segment(nemo_f, contours[0],
+                                                          [50,-10], [60,3])
+    cont_plot = coast.Contour_f(nemo_f, y_cont, x_cont, 200)
+    cont_plot.calc_cross_contour_flow(nemo_u, nemo_v)
+    fn_sections = coast.plot_util.plot_sections( [tran_f, cont_plot], 
+                                                 dn_fig + 'section_{section}_{time}.png',
+                                                 times=[0, 1], n_workers=2 )
+    check2 = all(os.path.isfile(fn) for fn in fn_sections) and len(fn_sections) == 4
+    if check1 and check2:
+        print(str(sec) + chr(subsec) + " OK - Batch section plots with decimation")
+    else:
+        print(str(sec) + chr(subsec) + " X - Batch section plots with decimation not as expected")
+except:
+    print(str(sec) + chr(subsec) + ' FAILED.\n' + traceback.format_exc())
 '''
 #################################################
 ## ( 5 ) Object Manipulation (e.g. subsetting) ##
@@ -1343,6 +1452,122 @@ try:
 except:
     print(str(sec) + chr(subsec) +' FAILED.')
 
+#-----------------------------------------------------------------------------#
+#%% ( 7p ) TIDEGAUGE batched tide table lookups                               #
+#                                                                             #
+subsec = subsec+1
+
+try:
+    # Uses the tide table loaded in 7m
+    guesses = np.array(['2020-10-13 12:48', '2020-10-15 03:10', 
+                        '2020-10-25 00:00'], dtype='datetime64[m]')
+    HW = tg.get_tidetabletimes_many(guesses, method='nearest_HW')
+    near = tg.get_tidetabletimes_many(guesses, method='nearest_1', winsize=2)
+    window = tg.get_tidetabletimes_many(guesses, method='window', winsize=24)
+
+    check1 = HW.values[0] == 8.01
+    check2 = near.time.values[0] == np.datetime64('2020-10-13 14:36')
+    check3 = np.isnan(near.values[2]) and near.time.values[2] == guesses[2]
+    check4 = np.array_equal( window.values[0, :8], [3.47, 7.78, 2.8 , 8.01, 2.83, 8.45, 2.08, 8.71])
+    check5 = np.array_equal(window.values[1][~np.isnan(window.values[1])],
+                            tg.get_tidetabletimes(guesses[1], method='window', 
+                                                  winsize=24).values)
+
+    if check1 and check2 and check3 and check4 and check5:
+        print(str(sec) + chr(subsec) + " OK - Batched tide table lookups")
+    else:
+        print(str(sec) + chr(subsec) + " X - Batched tide table lookups")
+except:
+    print(str(sec) + chr(subsec) +' FAILED.')
+
+#-----------------------------------------------------------------------------#
+#%% ( 7q ) TIDEGAUGE reading multiple tide tables                             #
+#                                                                             #
+subsec = subsec+1
+
+try:
+    filnam = 'example_files/Gladstone_2020-10_HLW.txt'
+    multi = coast.TIDEGAUGE.read_HLW_multiple_to_xarray([filnam, filnam], 
+                                                        date_start, date_end)
+    
+    # BST ends at 02:00 local time on 25/10/2020
+    local = np.array(['2020-10-13 12:48', '2020-10-26 12:48'], 
+                     dtype='datetime64[ns]')
+    utc = coast.general_utils.uk_local_to_utc(local)
+
+    check1 = multi.dims['port_dim'] == 2
+    check2 = np.array_equal(multi.sea_level[1], tg.dataset.sea_level)
+    check3 = np.array_equal(multi.time[0], tg.dataset.time)
+    check4 = np.array_equal(utc, local - np.array([1, 0], dtype='timedelta64[h]'))
+    if check1 and check2 and check3 and check4:
+        print(str(sec) + chr(subsec) + " OK - Multiple tide tables read")
+    else:
+        print(str(sec) + chr(subsec) + " X - Multiple tide tables read")
+except:
+    print(str(sec) + chr(subsec) +' FAILED.')
+
+#-----------------------------------------------------------------------------#
+#%% ( 7r ) TIDEGAUGE BODC reader QC flags and column layouts                  #
+#                                                                             #
+subsec = subsec+1
+
+try:
+    # Write the header of the example file with a few flagged data lines,
+    # once aligned and once with a misaligned line
+    with open(fn_tidegauge2) as file:
+        header = [next(file) for ii in range(11)]
+    data = ['        1) 2020/10/13 00:00:00      5.354M     0.265M\n',
+            '        2) 2020/10/13 00:15:00      5.016      0.243N\n',
+            '        3) 2020/10/13 00:30:00    -99.000N    -0.241\n']
+    misaligned = data[:2] + ['  3) 2020/10/13 00:30:00 -99.000N -0.241\n', '\n']
+    fn_aligned = os.path.join(dn_files, 'test_bodc_aligned.txt')
+    fn_misaligned = os.path.join(dn_files, 'test_bodc_misaligned.txt')
+    with open(fn_aligned, 'w') as file:
+        file.writelines(header + data)
+    with open(fn_misaligned, 'w') as file:
+        file.writelines(header + misaligned)
+    
+    aligned = coast.TIDEGAUGE.read_bodc_to_xarray(fn_aligned)
+    other = coast.TIDEGAUGE.read_bodc_to_xarray(fn_misaligned)
+    
+    check1 = np.array_equal(aligned.sea_level, [5.354, 5.016, -99.0])
+    check2 = list(aligned.qc_flags.values) == ['M', 'N', 'N']
+    check3 = aligned.time.values[1] == np.datetime64('2020-10-13 00:15')
+    check4 = aligned.equals(other)
+    if check1 and check2 and check3 and check4:
+        print(str(sec) + chr(subsec) + " OK - BODC flags and layouts read")
+    else:
+        print(str(sec) + chr(subsec) + " X - BODC flags and layouts read")
+except:
+    print(str(sec) + chr(subsec) +' FAILED.')
+
+#-----------------------------------------------------------------------------#
+#%% ( 7s ) TIDEGAUGE parsed file cache                                        #
+#                                                                             #
+subsec = subsec+1
+
+try:
+    date0 = datetime.datetime(2007,1,10)
+    date1 = datetime.datetime(2007,1,12)
+    parsed = coast.TIDEGAUGE.read_gesla_to_xarray_v3(fn_tidegauge, date0, date1)
+
+    # First read parses the file into the cache, second reads the cache
+    coast.TIDEGAUGE.cache_dir = os.path.join(dn_files, 'tidegauge_cache')
+    first = coast.TIDEGAUGE.read_gesla_to_xarray_v3(fn_tidegauge, date0, date1)
+    second = coast.TIDEGAUGE.read_gesla_to_xarray_v3(fn_tidegauge, date0, date1)
+    n_entries = len(os.listdir(coast.TIDEGAUGE.cache_dir))
+    coast.TIDEGAUGE.cache_dir = None
+
+    check1 = parsed.identical(first) and parsed.identical(second)
+    check2 = n_entries >= 1
+    if check1 and check2:
+        print(str(sec) + chr(subsec) + " OK - Tide gauge read through parsed file cache")
+    else:
+        print(str(sec) + chr(subsec) + " X - Tide gauge read through parsed file cache")
+except:
+    coast.TIDEGAUGE.cache_dir = None
+    print(str(sec) + chr(subsec) +' FAILED.')
+
 
 '''
 ###############################################################################
@@ -1419,7 +1644,7 @@ else:
 #%% ( 8e ) Calculate pressure gradient driven flow across contour               #
 #                                                                             #
 subsec = subsec+1
-cont_f.calc_geostrophic_flow(nemo_t, 1027)
+cont_f.calc_geostrophic_flow(nemo_t, 1027, nemo_u=nemo_u, nemo_v=nemo_v)
 if np.allclose((cont_f.data_cross_flow.normal_velocity_hpg +
                 cont_f.data_cross_flow.normal_velocity_spg +
                 cont_f.data_cross_flow.transport_across_AB_hpg +
@@ -1427,6 +1652,65 @@ if np.allclose((cont_f.data_cross_flow.normal_velocity_hpg +
     print(str(sec) + chr(subsec) + " OK - Cross-contour geostrophic flow calculations as expected")
 else:
     print(str(sec) + chr(subsec) + " X - Cross-contour geostrophic flow calculations not as expected")
+#-----------------------------------------------------------------------------#
+#%% ( 8f ) Transport across many sections with one sparse operator             #
+#                                                                             #
+subsec = subsec+1
+tran_f = coast.Transect_f( nemo_f, (54,-15), (56,-12) )
+tran_f.calc_flow_across_transect(nemo_u, nemo_v)
+operator = coast.section_util.TransportOperator([tran_f, cont_f], nemo_u, nemo_v,
+                                                names=['transect', 'contour'])
+transports = operator.apply(nemo_u, nemo_v, time_chunk=1)
+check1 = np.allclose(transports.normal_transport.isel(seg_dim=operator.segments(0)),
+                     tran_f.data_cross_tran_flow.normal_transports)
+check2 = np.allclose(transports.section_transport.sel(section='contour'),
+                     cont_f.data_cross_flow.depth_integrated_normal_transport.sum(dim='r_dim'))
+if check1 and check2:
+    print(str(sec) + chr(subsec) + " OK - Transport operator for many sections as expected")
+else:
+    print(str(sec) + chr(subsec) + " X - Transport operator for many sections not as expected")
+#-----------------------------------------------------------------------------#
+#%% ( 8g ) Cached multi-isobath contour extraction                              #
+#                                                                             #
+subsec = subsec+1
+from skimage import measure
+isobaths = coast.Isobaths(nemo_f, [200, 1000])
+# Contours straight from skimage, independent of the cache
+bathy = nemo_f.dataset.bathymetry.values
+raw_contours = measure.find_contours(bathy, 200)
+expected = [np.round(contour).astype(int) for contour in raw_contours]
+cached = isobaths.get_contours(200)[0]
+check1 = len(expected) == isobaths.contours_by_depth[200].dims['contour'] and \
+         all( np.array_equal(contour_a, contour_b) for contour_a, contour_b 
+              in zip(expected, cached) )
+# closed, area (shoelace) and length (haversine) of the longest contour
+ds_iso = isobaths.contours_by_depth[200]
+ic = int(np.argmax([len(contour) for contour in raw_contours]))
+raw = raw_contours[ic]
+closed = bool(np.all(raw[0] == raw[-1])) and len(raw) > 2
+area = 0.5 * abs(np.sum(raw[:-1,1] * raw[1:,0] - raw[1:,1] * raw[:-1,0]))
+lat = np.radians(nemo_f.dataset.latitude.values[expected[ic][:,0], expected[ic][:,1]])
+lon = np.radians(nemo_f.dataset.longitude.values[expected[ic][:,0], expected[ic][:,1]])
+hav = np.sin(np.diff(lat)/2)**2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon)/2)**2
+length = np.sum(2 * 6371.007176 * np.arcsin(np.sqrt(hav)))
+check2 = bool(ds_iso.closed.values[ic]) == closed and \
+         np.isclose(ds_iso.length.values[ic], length) and \
+         ( np.isclose(ds_iso.area.values[ic], area) if closed else np.isnan(ds_iso.area.values[ic]) )
+# Segment between the points nearest to the start and end, found by brute force
+y_seg, x_seg, contour_seg = isobaths.get_segment(200, [50,-10], [60,3], contour=0)
+lat0 = nemo_f.dataset.latitude.values[expected[0][:,0], expected[0][:,1]]
+lon0 = nemo_f.dataset.longitude.values[expected[0][:,0], expected[0][:,1]]
+nearest = [ np.argmin( general_utils.calculate_haversine_distance(lon_pt, lat_pt, lon0, lat0) )
+            for lat_pt, lon_pt in ([50,-10], [60,3]) ]
+segment = expected[0][min(nearest):max(nearest)+1]
+if segment[0,0] > segment[-1,0] or \
+   ( segment[0,0] == segment[-1,0] and segment[0,1] > segment[-1,1] ):
+    segment = segment[::-1]
+check3 = np.array_equal(contour_seg, segment)
+if check1 and check2 and check3:
+    print(str(sec) + chr(subsec) + " OK - Cached isobath contours as expected")
+else:
+    print(str(sec) + chr(subsec) + " X - Cached isobath contours not as expected")
 
 #%%
 '''
@@ -1490,6 +1774,28 @@ try:
         print(str(sec) + chr(subsec) + " X - Original signal not reconstructed from HEOFs")
 
 
+except:
+    print(str(sec) + chr(subsec) + ' FAILED.\n' + traceback.format_exc())
+
+#%%---------------------------------------------------------------------------#
+# ( 9c ) Compute HEOFs lazily in chunks of points                             #
+#
+subsec = subsec+1
+try:
+    heofs_chunked = coast.hilbert_eofs( nemo_t.dataset.ssh, chunk_points=1000, 
+                                        n_modes=5 )
+    heofs_single = coast.hilbert_eofs( nemo_t.dataset.ssh, chunk_points=1000,
+                                       n_modes=5, dtype=np.complex64 )
+
+    check1 = np.allclose( heofs_chunked.variance, heofs.variance[:5] )
+    check2 = np.allclose( heofs_single.variance, heofs.variance[:5], rtol=1e-3 )
+    check3 = np.allclose( heofs_chunked.EOF_amp, heofs.EOF_amp[:,:,:5], 
+                          equal_nan=True )
+    if check1 and check2 and check3:
+        print(str(sec) + chr(subsec) + " OK - Chunked HEOFs match in-memory HEOFs")
+    else:
+        print(str(sec) + chr(subsec) + " X - Chunked HEOFs do not match in-memory HEOFs")
+
 except:
     print(str(sec) + chr(subsec) + ' FAILED.\n' + traceback.format_exc())
     
@@ -1710,6 +2016,131 @@ try:
 except:
     print(str(sec) + chr(subsec) +' FAILED.')
 
+#-----------------------------------------------------------------------------#
+# ( 12b ) doodson_x0_filter() on N-D numpy and dask arrays                    #
+#                                                                             #
+
+subsec = subsec+1
+
+try:
+    kern = np.array([1, 0, 1, 0, 0, 1, 0, 1, 1, 0, 2, 0, 1, 1, 0, 2, 1, 1, 2,
+                     0,
+                     2, 1, 1, 2, 0, 1, 1, 0, 2, 0, 1, 1, 0, 1, 0, 0, 1, 0, 1])/30
+    elevation = np.random.random((10, 200, 12))
+    # Reference: one convolution per column
+    reference = np.apply_along_axis(lambda m: np.convolve(m, kern, mode='same'),
+                                    axis=1, arr=elevation)
+    reference[:,:19] = np.nan
+    reference[:,-19:] = np.nan
+    
+    filtered = stats_util.doodson_x0_filter(elevation, ax=1)
+    elevation_dask = xr.DataArray(elevation).chunk({'dim_1':50})
+    filtered_dask = stats_util.doodson_x0_filter(elevation_dask, ax=1)
+    
+    check1 = np.allclose(filtered, reference, equal_nan=True)
+    check2 = np.allclose(filtered_dask.compute(), reference, equal_nan=True)
+    if check1 and check2:
+        print(str(sec) + chr(subsec) + " OK - doodson_x0_filter() on numpy and dask arrays")
+    else:
+        print(str(sec) + chr(subsec) + " X - Problem with stats_util.doodson_x0_filter()")
+
+except:
+    print(str(sec) + chr(subsec) +' FAILED.')
+
+#-----------------------------------------------------------------------------#
+# ( 12c ) apply_filter_bank(). Several tidal filters in one pass              #
+#                                                                             #
+
+subsec = subsec+1
+
+try:
+    hours = np.arange(2000)
+    time = np.datetime64('2007-01-01') + hours.astype('timedelta64[h]')
+    residual = 0.5*np.cos(2*np.pi*hours/500)
+    elevation = xr.DataArray( np.cos(2*np.pi*hours/12.42) + residual,
+                              dims=['t_dim'], coords={'time':('t_dim',time)} )
+    filters = ['doodson', 'godin', 'lanczos', 'butterworth']
+    filtered = stats_util.apply_filter_bank(elevation, filters)
+    filtered_dask = stats_util.apply_filter_bank(elevation.chunk({'t_dim':400}), 
+                                                 filters)
+    
+    # Away from the ends, each filter should remove the M2-like signal
+    check1 = all( np.max(np.abs(filtered[name][300:-300] - residual[300:-300])) 
+                  < 0.01 for name in filters )
+    check2 = all( np.allclose(filtered[name], filtered_dask[name], 
+                              equal_nan=True, atol=1e-4) for name in filters )
+    check3 = np.allclose( filtered.doodson, 
+                          stats_util.doodson_x0_filter(elevation), equal_nan=True )
+    if check1 and check2 and check3:
+        print(str(sec) + chr(subsec) + " OK - apply_filter_bank() on numpy and dask arrays")
+    else:
+        print(str(sec) + chr(subsec) + " X - Problem with stats_util.apply_filter_bank()")
+
+except:
+    print(str(sec) + chr(subsec) +' FAILED.')
+
+#-----------------------------------------------------------------------------#
+# ( 12d ) find_extrema_grid(). High and low waters for every grid column      #
+#                                                                             #
+
+subsec = subsec+1
+
+try:
+    hours = np.arange(24*10)
+    time = np.datetime64('2007-01-01') + hours.astype('timedelta64[h]')
+    amplitude = np.linspace(0.5, 2, 12).reshape((3,4))
+    ssh = amplitude * np.cos(2*np.pi*hours/12.42)[:,np.newaxis,np.newaxis]
+    ssh[:,0,0] = np.nan  # A land point
+    ssh = xr.DataArray( ssh, dims=['t_dim','y_dim','x_dim'], name='ssh',
+                        coords={'time':('t_dim',time)} )
+    hlw = stats_util.find_extrema_grid(ssh, refine=False)
+    hlw_dask = stats_util.find_extrema_grid(ssh.chunk({'t_dim':50}), 
+                                            refine=False).compute()
+    
+    # Compare one column with the single time series method
+    tt, hh = stats_util.find_maxima(ssh.time, ssh[:,2,3], method='comp')
+    n_highs = len(hh)
+    check1 = np.allclose( hlw.ssh_highs[:n_highs,2,3], hh )
+    check2 = np.all( hlw.time_highs[:n_highs,2,3].values == tt.values )
+    check3 = hlw.n_highs[0,0] == 0 and hlw.n_highs[2,3] == n_highs
+    check4 = np.allclose( hlw.ssh_lows, hlw_dask.ssh_lows, equal_nan=True )
+    if check1 and check2 and check3 and check4:
+        print(str(sec) + chr(subsec) + " OK - find_extrema_grid() on numpy and dask arrays")
+    else:
+        print(str(sec) + chr(subsec) + " X - Problem with stats_util.find_extrema_grid()")
+
+except:
+    print(str(sec) + chr(subsec) +' FAILED.')
+
+#-----------------------------------------------------------------------------#
+# ( 12e ) find_maxima_many(). Cubic spline maxima of many series at once      #
+#                                                                             #
+
+subsec = subsec+1
+
+try:
+    date0 = datetime.datetime(2007,1,10)
+    date1 = datetime.datetime(2007,1,12)
+    tg = coast.TIDEGAUGE(fn_tidegauge, date_start = date0, date_end = date1)
+    sea_level = np.stack( [tg.dataset.sea_level.values, 
+                           2*tg.dataset.sea_level.values], axis=1 )
+    
+    tt, hh = stats_util.find_maxima(tg.dataset.time, tg.dataset.sea_level, 
+                                    method='cubic')
+    tt_many, hh_many = stats_util.find_maxima_many(tg.dataset.time.values, 
+                                                   sea_level)
+    n_max = len(hh)
+    check1 = np.allclose( hh_many[:n_max, 0], hh )
+    check2 = np.allclose( hh_many[:n_max, 1], 2*hh )
+    check3 = np.all( tt_many[:n_max, 0] == tt.values )
+    if check1 and check2 and check3:
+        print(str(sec) + chr(subsec) + " OK - find_maxima_many() matches find_maxima()")
+    else:
+        print(str(sec) + chr(subsec) + " X - Problem with stats_util.find_maxima_many()")
+
+except:
+    print(str(sec) + chr(subsec) +' FAILED.')
+
 #%%
 '''
 #################################################
@@ -1782,6 +2213,35 @@ try:
 except:
     print(str(sec) + chr(subsec) +' FAILED.')
     
+#-----------------------------------------------------------------------------#
+# ( 13c ) Region masks with caching                                           #
+#                                                                             #
+
+subsec = subsec+1
+
+try:
+    mm = coast.MASK_MAKER
+    mm.clear_cache()
+    masks = mm.region_masks(sci.dataset.longitude, sci.dataset.latitude, 
+                            sci.dataset.bathymetry, cache_dir=dn_files + 'mask_cache')
+    mm.clear_cache()
+    north_sea = mm.region_def_nws_north_sea(sci.dataset.longitude, sci.dataset.latitude,
+                                            sci.dataset.bathymetry, 
+                                            cache_dir=dn_files + 'mask_cache')
+    inside = mm.points_in_polygon([0, 0], [60.2, 60.45], [-10, 10, 10, -10], 
+                                  [60, 60, 50, 50], spherical=True)
+
+    #TEST: Check some data
+    check1 = list(masks) == list(mm.NWS_REGIONS) and np.array_equal(masks['north_sea'], north_sea)
+    check2 = list(inside) == [True, False]
+    if check1 and check2:
+        print(str(sec) + chr(subsec) + " OK - Region MASKS created and cached")
+    else:
+        print(str(sec) + chr(subsec) + " X - Problem creating or caching region masks")
+
+except:
+    print(str(sec) + chr(subsec) +' FAILED.')
+    
 #%%
 '''
 #################################################
@@ -1830,6 +2290,180 @@ except AssertionError:
 except:
     print(str(sec) + chr(subsec) +' FAILED.')
 
+#-----------------------------------------------------------------------------#
+# ( 14b ) Streaming climatology with checkpointing                            #
+#                                                                             #
+
+subsec = subsec+1
+
+try:
+    
+    clim = coast.CLIMATOLOGY()
+    fn_checkpoint = os.path.join(dn_files, 'test_climatology_checkpoint.nc')
+    if os.path.isfile(fn_checkpoint):
+        os.remove(fn_checkpoint)
+    seaS = clim.make_climatology_streaming(ds2, 'season', time_chunk=3,
+                                           variance=True,
+                                           fn_checkpoint=fn_checkpoint)
+    # Resuming from a complete checkpoint should not change the result
+    seaR = clim.make_climatology_streaming(ds2, 'season', time_chunk=3,
+                                           variance=True,
+                                           fn_checkpoint=fn_checkpoint)
+    xr.testing.assert_allclose(seaS[['temperature','ssh']], seaX)
+    xr.testing.assert_allclose(seaS, seaR)
+    
+    check1 = np.allclose( seaS.temperature_var, 
+                          ds2.temperature.groupby("time.season").var('t_dim', ddof=1),
+                          equal_nan=True )
+    if check1:
+        print(str(sec) + chr(subsec) + " OK - Streaming climatology made and resumed from checkpoint")
+    else:
+        print(str(sec) + chr(subsec) + " X - Problem with streaming climatology variance")
+    os.remove(fn_checkpoint)
+
+except AssertionError:
+    print(str(sec) + chr(subsec) + " X - Streaming climatology does not match groupby mean")
+except:
+    print(str(sec) + chr(subsec) +' FAILED.')
+
+#-----------------------------------------------------------------------------#
+# ( 14c ) Parallel climatology writing to zarr                                #
+#                                                                             #
+
+subsec = subsec+1
+
+try:
+    
+    clim = coast.CLIMATOLOGY()
+    fn_zarr = os.path.join(dn_files, 'test_climatology.zarr')
+    fn_consolidated = os.path.join(dn_files, 'test_climatology_zarr.nc')
+    records = []
+    seasonal = clim.make_climatology(ds, 'season')
+    clim.write_climatology_zarr(seasonal, fn_zarr, 'season', 
+                                callback=records.append, 
+                                fn_netcdf=fn_consolidated)
+    
+    # One write task per season per variable
+    check1 = len(records) == 8
+    check2 = np.allclose( xr.open_zarr(fn_zarr).temperature, 
+                          seasonal.temperature, equal_nan=True )
+    check3 = os.path.isfile(fn_consolidated)
+    if check1 and check2 and check3:
+        print(str(sec) + chr(subsec) + " OK - Climatology written to zarr in parallel and consolidated")
+    else:
+        print(str(sec) + chr(subsec) + " X - Problem writing climatology to zarr")
+
+except:
+    print(str(sec) + chr(subsec) +' FAILED.')
+
+#-----------------------------------------------------------------------------#
+# ( 14d ) Multiple climatology frequencies in one pass                        #
+#                                                                             #
+
+subsec = subsec+1
+
+try:
+    
+    clim = coast.CLIMATOLOGY()
+    clims = clim.make_climatology_streaming(ds2, ['month', 'season', 'annual',
+                                            'dayofyear'], smoothing_window=3)
+    
+    xr.testing.assert_allclose(clims['season'][['temperature','ssh']], seaX)
+    check1 = np.allclose( clims['annual'].temperature, 
+                          ds2.temperature.mean('t_dim'), equal_nan=True )
+    check2 = np.allclose( clims['month'].temperature, 
+                ds2.temperature.groupby('time.month').mean('t_dim'), 
+                equal_nan=True )
+    check3 = 'dayofyear' in clims['dayofyear'].dims
+    if check1 and check2 and check3:
+        print(str(sec) + chr(subsec) + " OK - Monthly, seasonal, annual and day of year climatologies made in one pass")
+    else:
+        print(str(sec) + chr(subsec) + " X - Problem with multiple frequency climatology")
+
+except AssertionError:
+    print(str(sec) + chr(subsec) + " X - Multiple frequency seasonal climatology does not match groupby mean")
+except:
+    print(str(sec) + chr(subsec) +' FAILED.')
+
+#%%
+'''
+#################################################
+## ( 15 ) Tidal harmonic analysis              ##
+#################################################
+'''
+sec = sec+1
+subsec = 96
+
+#-----------------------------------------------------------------------------#
+# ( 15a ) Batched harmonic analysis of synthetic tides                        #
+#                                                                             #
+
+subsec = subsec+1
+
+try:
+    
+    # Synthetic M2 and K1 tide at each point of a small grid, with known
+    # amplitudes and phases. One column is land (all NaN) and one has gaps.
+    times = np.arange('2020-01-01', '2020-03-01', 
+                      np.timedelta64(1,'h'), dtype='datetime64[ns]')
+    constituents = ['M2', 'S2', 'K1', 'O1']
+    amp = np.random.uniform(0.1, 2, (4, 3, 3))
+    pha = np.random.uniform(0, 360, (4, 3, 3))
+    X = coast.tide_util.design_matrix(times, constituents)
+    xx = (amp*np.cos(np.radians(pha))).reshape(4,-1)
+    yy = (amp*np.sin(np.radians(pha))).reshape(4,-1)
+    ssh = 0.5 + X[:, 1::2] @ xx + X[:, 2::2] @ yy
+    ssh = ssh.reshape(len(times), 3, 3)
+    ssh[:, 0, 0] = np.nan
+    ssh[::7, 1, 1] = np.nan
+    tide = xr.DataArray(ssh, dims=['t_dim','y_dim','x_dim'], 
+                        coords={'time':('t_dim', times)})
+    
+    ha = coast.tide_util.harmonic_analysis(tide, constituents)
+    ha_stream = coast.tide_util.harmonic_analysis(tide, constituents, 
+                                                  time_chunk=200)
+    
+    check1 = np.allclose(ha.harmonic_a.values[:, 1:, 1:], amp[:, 1:, 1:])
+    dg = np.mod(ha.harmonic_g.values - pha + 180, 360) - 180
+    check2 = np.allclose(dg[:, 1:, 1:], 0, atol=1e-4)
+    check3 = np.all(np.isnan(ha.harmonic_a[:, 0, 0]))
+    check4 = np.allclose(ha.harmonic_a, ha_stream.harmonic_a, equal_nan=True)
+    if check1 and check2 and check3 and check4:
+        print(str(sec) + chr(subsec) + " OK - Tidal harmonics recovered by batched and streaming analysis")
+    else:
+        print(str(sec) + chr(subsec) + " X - Problem with tidal harmonic analysis")
+
+except:
+    print(str(sec) + chr(subsec) +' FAILED.')
+
+#-----------------------------------------------------------------------------#
+# ( 15b ) Tidal prediction from harmonics                                     #
+#                                                                             #
+
+subsec = subsec+1
+
+try:
+    
+    # Uses the synthetic tide and harmonics of 15a
+    prediction = coast.tide_util.predict_tide(ha, times)
+    prediction_lazy = coast.tide_util.predict_tide(ha[['harmonic_a',
+                                                       'harmonic_g','z0']], 
+                                                   times, time_chunk=240, 
+                                                   dtype=np.float32)
+    residual = tide - prediction_lazy
+    
+    check1 = np.nanmax(np.abs(prediction.values - ssh)[:, 1:, 1:]) < 1e-6
+    check2 = prediction_lazy.chunks[0][0] == 240 
+    check3 = prediction_lazy.dtype == np.float32
+    check4 = np.nanmax(np.abs(residual.values[:, 1:, 1:])) < 1e-4
+    if check1 and check2 and check3 and check4:
+        print(str(sec) + chr(subsec) + " OK - Tide predicted from harmonics, lazily in time chunks")
+    else:
+        print(str(sec) + chr(subsec) + " X - Problem with tidal prediction")
+
+except:
+    print(str(sec) + chr(subsec) +' FAILED.')
+
 #%%
 '''
 ###############################################################################